@@ -9,11 +9,25 @@ from pathlib import Path
 BASE_DIR = Path(__file__).parent.parent
 STORAGE_DIR = BASE_DIR / "files"
 TRASH_DIR = BASE_DIR / "trash"
+# 内容寻址的数据块目录，文件内容按哈希去重后存放于此
+BLOB_DIR = BASE_DIR / "blobs"
+BLOB_FANOUT_LEVELS = 2  # 数据块按存储标识分散的子目录层数，每层256个目录
+# 冷数据层目录，长期未访问的数据块压缩后存放于此
+COLD_BLOB_DIR = Path(os.getenv("COLD_STORAGE_PATH", str(BASE_DIR / "blobs_cold")))
+# 分片上传的暂存目录，与数据块目录位于同一文件系统，完成时可直接重命名
+UPLOAD_TMP_DIR = BASE_DIR / "uploads"
+# 后台任务生成的结果文件（如打包好的ZIP）
+JOB_DIR = BASE_DIR / "jobs"
+# 缩略图缓存目录
+THUMBNAIL_DIR = Path(os.getenv("THUMBNAIL_PATH", str(BASE_DIR / "thumbnails")))
 DATABASE_URL = f"sqlite:///{BASE_DIR}/netdisk.db"
 
 # 安全配置
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7天
+MEDIA_TOKEN_EXPIRE_MINUTES = 60 * 6  # 音视频预览地址中限定单个文件的令牌的有效期
+INSTANT_UPLOAD_TOKEN_EXPIRE_MINUTES = 10  # 秒传校验令牌的有效期
+INSTANT_UPLOAD_PROOF_SIZE = 1024 * 1024  # 秒传时客户端需要对其计算哈希的内容范围大小
 
 # 文件配置
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
@@ -25,6 +39,63 @@ ALLOWED_EXTENSIONS = {
     'audio': {'.mp3', '.wav', '.flac', '.aac'},
 }
 
+# 分片上传配置
+CHUNK_SIZE_MIN = 4 * 1024 * 1024  # 推荐分片大小下限
+CHUNK_SIZE_MAX = 32 * 1024 * 1024  # 推荐分片大小上限
+CHUNK_TARGET_COUNT = 256  # 推荐分片大小时期望的分片数量
+CHUNK_MAX_CONCURRENCY = int(os.getenv("CHUNK_MAX_CONCURRENCY", "4"))  # 单个上传的最大并发分片数
+CHUNK_SERVER_CONCURRENCY = int(os.getenv("CHUNK_SERVER_CONCURRENCY", "32"))  # 全部上传共享的并发分片预算
+CHUNK_ACTIVE_WINDOW_SECONDS = 300  # 最近有分片写入的会话视为活跃
+
+# 下载配置
+DOWNLOAD_READ_SIZE = int(os.getenv("DOWNLOAD_READ_SIZE", str(4 * 1024 * 1024)))  # 下载本地文件时每次读取并发送的字节数，读取按该大小对齐
+
+# HTTP 缓存配置：各类响应的 Cache-Control，响应都带有 ETag，no-cache 表示每次使用缓存前向服务器验证，未变化时返回 304
+CACHE_CONTROL_FILES = os.getenv("CACHE_CONTROL_FILES", "private, no-cache")  # 登录后的下载、预览、缩略图，以及有密码的分享
+CACHE_CONTROL_SHARES = os.getenv("CACHE_CONTROL_SHARES", "public, no-cache")  # 无密码分享的下载和预览，CDN 可以缓存，但每次都要确认分享仍然有效
+CACHE_CONTROL_STATIC = os.getenv("CACHE_CONTROL_STATIC", "public, no-cache")  # /static 下的资源
+CACHE_CONTROL_STATIC_VERSIONED = os.getenv("CACHE_CONTROL_STATIC_VERSIONED", "public, max-age=31536000, immutable")  # 带 ?v= 版本号的静态资源，内容变化时版本号随之变化
+CACHE_CONTROL_PAGES = os.getenv("CACHE_CONTROL_PAGES", "no-cache")  # 模板渲染的页面
+
+# 存储后端配置
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # 新数据块写入的后端：local 或 s3
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # 兼容S3的服务地址，如本地 MinIO 的 http://localhost:9000
+S3_BUCKET = os.getenv("S3_BUCKET", "netdisk")
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs/")  # 对象键前缀
+S3_REGION = os.getenv("S3_REGION")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+S3_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 要求除最后一个分片外每个分片至少5MB
+
+# 分层存储配置：STORAGE_BACKEND 为热数据层，长期未读取的数据块移入冷数据层，再次读取时移回
+TIERING_ENABLED = os.getenv("TIERING_ENABLED", "true").lower() == "true"
+TIER_COLD_BACKEND = os.getenv("TIER_COLD_BACKEND", "cold")  # 冷数据层后端：cold（本地压缩目录）或 s3
+TIER_COLD_AFTER_DAYS = int(os.getenv("TIER_COLD_AFTER_DAYS", "30"))  # 超过该天数未读取的数据块移入冷数据层
+TIER_CHECK_INTERVAL_HOURS = int(os.getenv("TIER_CHECK_INTERVAL_HOURS", "6"))  # 检查冷数据的间隔
+TIER_BATCH_SIZE = 100  # 每轮检查最多移动的数据块数
+TIER_ACCESS_UPDATE_INTERVAL_SECONDS = 3600  # 最后访问时间的更新粒度，避免每次读取都写数据库
+TIER_DELETE_GRACE_SECONDS = 600  # 数据块移动后源数据的保留时间，移动前已开始的读取仍能打开原位置
+COLD_COMPRESSION_LEVEL = int(os.getenv("COLD_COMPRESSION_LEVEL", "6"))  # 冷数据层的 zlib 压缩级别
+
+# 线程池配置
+DISK_IO_WORKERS = int(os.getenv("DISK_IO_WORKERS", "8"))  # 执行阻塞磁盘操作的线程数
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))  # 执行数据库操作的线程数
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))  # 生成缩略图的线程数，解码大图片占用较多CPU和内存
+
+# 后台任务配置
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # 后台任务的工作线程数
+JOB_RETENTION_HOURS = 24  # 已结束的任务及其结果文件的保留时间
+
+# 数据库配置（SQLite 连接参数，每个新连接都会执行对应的 PRAGMA）
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # WAL 模式下读操作不会被写入阻塞
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL 下 NORMAL 只在检查点同步，断电最多丢失最近的提交
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # 等待写锁的最长时间
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))  # 每个连接的页缓存大小
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读取的最大字节数，0 表示关闭
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(DB_WORKERS + JOB_WORKERS + 4)))  # 连接池常驻连接数
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "8"))  # 连接池可临时超出的连接数
+DB_POOL_TIMEOUT = 30  # 等待空闲连接的秒数
+
 # 预览配置
 PREVIEW_EXTENSIONS = {
     'image': {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'},
@@ -33,6 +104,36 @@ PREVIEW_EXTENSIONS = {
     'audio': {'.mp3', '.wav', '.flac', '.aac', '.ogg', '.m4a'},
     'video': {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.webm', '.m4v'}
 }
+# 文本预览按窗口返回内容，不读取和解码整个文件
+PREVIEW_TEXT_MAX_SIZE = 1024 * 1024  # 单次预览最多返回的字节数
+PREVIEW_TEXT_DEFAULT_SIZE = 256 * 1024  # 按字节预览时默认的窗口大小
+PREVIEW_TEXT_DEFAULT_LINES = 1000  # 按行预览时默认的行数
+PREVIEW_TEXT_MAX_LINES = 10000  # 按行预览时单次最多返回的行数
+PREVIEW_ENCODING_SAMPLE_SIZE = 64 * 1024  # 检测文本编码时读取的文件开头字节数
+PREVIEW_LINE_INDEX_STRIDE = 1000  # 行索引每隔多少行记录一次字节偏移
+PREVIEW_TEXT_CACHE_ENTRIES = 128  # 内存中缓存编码和行索引的文件数
+
+# 缩略图配置：缩略图以 WebP 格式缓存在磁盘上，超出容量时删除最久未使用的缩略图
+THUMBNAIL_SIZES = (64, 128, 256, 512)  # 可生成的缩略图边长，请求的尺寸向上取最接近的一档
+THUMBNAIL_DEFAULT_SIZE = 256
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))  # WebP 编码质量
+THUMBNAIL_MAX_SOURCE_PIXELS = 100 * 1000 * 1000  # 超过该像素数的图片不生成缩略图，防止解压炸弹
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 缓存容量
+
+# 压缩存储配置：适合压缩的文本类文件以可按范围读取的 gzip 格式存放
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))  # zlib 压缩级别
+COMPRESSION_FRAME_SIZE = 256 * 1024  # 每帧的原始数据大小，范围读取最多多解压两帧
+COMPRESSION_MIN_SIZE = 4 * 1024  # 小于该大小的文件不压缩
+COMPRESSION_MAX_RATIO = 0.9  # 压缩后与压缩前的大小之比超过该值时按原样存放
+COMPRESSION_SAMPLE_SIZE = 256 * 1024  # 上传时先压缩开头的这部分数据估算压缩率
+COMPRESSIBLE_EXTENSIONS = PREVIEW_EXTENSIONS['text'] | {
+    '.log', '.csv', '.tsv', '.yaml', '.yml', '.ini', '.conf', '.sql', '.svg'
+}
+COMPRESSIBLE_MIME_TYPES = {
+    'application/json', 'application/xml', 'application/javascript',
+    'application/x-yaml', 'application/sql', 'image/svg+xml'
+}
 
 # 回收站配置
 TRASH_RETENTION_DAYS = 14
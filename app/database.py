@@ -2,18 +2,55 @@
 数据库配置和初始化
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
-from app.config import DATABASE_URL, settings
+from app.config import (
+    DATABASE_URL, settings,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+    DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT
+)
 from app.models.user import User
 from app.models.file import FileNode
 from app.models.share import ShareLink
+from app.models.upload import UploadSession, UploadChunk
+from app.models.blob import Blob
+from app.models.job import Job
+from app.migrations import run_migrations
 import os
 
 # 创建数据库引擎
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# 会话会在线程池之间传递，连接池按工作线程数设置大小，避免请求排队等待连接
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={
+        "check_same_thread": False,
+        "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000
+    },
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT
+)
+
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """为每个新的 SQLite 连接设置 PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # journal_mode 是数据库级设置，WAL 写入后会持久保存在数据库文件中
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+        # cache_size 取负数时单位为 KiB
+        cursor.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -21,6 +58,15 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # 基础模型类
 Base = declarative_base()
 
+# 按ID批量操作时每条语句包含的最大ID数，避免超出SQLite的参数上限
+SQL_IN_BATCH_SIZE = 500
+
+
+def batched(items: list, size: int = SQL_IN_BATCH_SIZE):
+    """将列表按固定大小分批"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
 
 def get_db() -> Session:
     """获取数据库会话"""
@@ -54,11 +100,20 @@ async def init_db():
         from app.models.user import Base as UserBase
         from app.models.file import Base as FileBase
         from app.models.share import Base as ShareBase
+        from app.models.upload import Base as UploadBase
+        from app.models.blob import Base as BlobBase
+        from app.models.job import Base as JobBase
         
         # 创建所有表
         UserBase.metadata.create_all(bind=engine)
         FileBase.metadata.create_all(bind=engine)
         ShareBase.metadata.create_all(bind=engine)
+        UploadBase.metadata.create_all(bind=engine)
+        BlobBase.metadata.create_all(bind=engine)
+        JobBase.metadata.create_all(bind=engine)
+        
+        # 按版本执行结构迁移，为已存在的表补充新增的列和索引
+        run_migrations(engine)
         
         # 创建默认管理员用户
         await create_default_user()
@@ -66,7 +66,9 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         client_id = self.get_client_id(request)
         
         # 排除某些不需要限制的路径
-        excluded_paths = ["/health", "/static"]
+        # 分片数据请求需要登录，并发量由 /files/chunk/init 下发的并发数控制；
+        # 缩略图需要登录，浏览图片目录时每个条目一个请求，生成在专用线程池中排队
+        excluded_paths = ["/health", "/static", "/files/chunk/upload", "/files/thumbnail/"]
         if any(request.url.path.startswith(path) for path in excluded_paths):
             return await call_next(request)
         
@@ -0,0 +1,208 @@
+"""
+数据库结构迁移
+
+create_all 只会创建缺失的表，不会修改已存在的表。已有数据库的结构变更以编号迁移的形式
+登记在 MIGRATIONS 中，启动时按版本号顺序执行，已执行的版本记录在 schema_migrations 表中。
+
+新增迁移时在列表末尾追加，不要修改或重新编号已发布的迁移。
+全新数据库的表由 create_all 按最新模型创建，因此每个迁移都需要可重复执行。
+"""
+
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+
+def _column_exists(conn: Connection, table: str, column: str) -> bool:
+    """检查表中是否存在指定的列"""
+    return any(info['name'] == column for info in inspect(conn).get_columns(table))
+
+
+def _add_column(conn: Connection, table: str, column: str, column_type: str):
+    """表中缺少该列时追加"""
+    if not _column_exists(conn, table, column):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}'))
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: str, unique: bool = False):
+    """索引不存在时创建"""
+    unique_sql = "UNIQUE " if unique else ""
+    conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})'))
+
+
+def _migration_001_blob_storage(conn: Connection):
+    """文件节点关联内容寻址的数据块，并为按父目录递归查询建立索引"""
+    _add_column(conn, "file_nodes", "blob_id", "INTEGER REFERENCES blobs (id)")
+    _create_index(conn, "ix_file_nodes_blob_id", "file_nodes", "blob_id")
+    _create_index(conn, "ix_file_nodes_parent_id", "file_nodes", "parent_id")
+
+
+def _migration_002_hot_query_indexes(conn: Connection):
+    """为目录列表、路径查找、回收站清理和分享查询建立复合索引"""
+    _create_index(
+        conn, "ix_file_nodes_owner_parent", "file_nodes",
+        "owner_id, parent_id, is_deleted, node_type DESC, name"
+    )
+    _create_index(conn, "ix_file_nodes_owner_full_path", "file_nodes", "owner_id, full_path, is_deleted")
+    _create_index(conn, "ix_file_nodes_deleted_at", "file_nodes", "is_deleted, deleted_at")
+    _create_index(conn, "ix_share_links_file_node_id", "share_links", "file_node_id")
+    _create_index(conn, "ix_share_links_creator_id", "share_links", "creator_id")
+    # 让查询规划器使用新索引的统计信息
+    conn.execute(text("ANALYZE"))
+
+
+def _migration_003_per_user_full_path(conn: Connection):
+    """full_path 从全局唯一改为 (owner_id, full_path) 唯一，每个用户有独立的路径命名空间
+    
+    SQLite 不能删除建表时声明的 UNIQUE 约束，需要按新结构重建 file_nodes 表再复制数据。
+    """
+    unique_columns = [
+        constraint['column_names']
+        for constraint in inspect(conn).get_unique_constraints("file_nodes")
+    ]
+    if ["full_path"] in unique_columns:
+        columns = (
+            "id, name, path, full_path, node_type, file_size, mime_type, file_extension, "
+            "blob_id, parent_id, is_deleted, deleted_at, created_at, updated_at, owner_id"
+        )
+        conn.execute(text(
+            'CREATE TABLE "file_nodes_new" ('
+            'id INTEGER NOT NULL, '
+            'name VARCHAR(255) NOT NULL, '
+            'path VARCHAR(1000) NOT NULL, '
+            'full_path VARCHAR(1000) NOT NULL, '
+            'node_type VARCHAR(10) NOT NULL, '
+            'file_size BIGINT, '
+            'mime_type VARCHAR(100), '
+            'file_extension VARCHAR(10), '
+            'blob_id INTEGER, '
+            'parent_id INTEGER, '
+            'is_deleted BOOLEAN, '
+            'deleted_at DATETIME, '
+            'created_at DATETIME, '
+            'updated_at DATETIME, '
+            'owner_id INTEGER NOT NULL, '
+            'PRIMARY KEY (id), '
+            'FOREIGN KEY(blob_id) REFERENCES blobs (id), '
+            'FOREIGN KEY(parent_id) REFERENCES file_nodes (id), '
+            'FOREIGN KEY(owner_id) REFERENCES users (id))'
+        ))
+        conn.execute(text(f'INSERT INTO "file_nodes_new" ({columns}) SELECT {columns} FROM "file_nodes"'))
+        # 删除旧表时其上的索引一并删除
+        conn.execute(text('DROP TABLE "file_nodes"'))
+        conn.execute(text('ALTER TABLE "file_nodes_new" RENAME TO "file_nodes"'))
+    
+    # 唯一索引同时覆盖按路径查找，迁移 002 中的非唯一索引不再需要
+    conn.execute(text('DROP INDEX IF EXISTS "ix_file_nodes_owner_full_path"'))
+    _create_index(conn, "uq_file_nodes_owner_full_path", "file_nodes", "owner_id, full_path", unique=True)
+    _create_index(conn, "ix_file_nodes_id", "file_nodes", "id")
+    _create_index(conn, "ix_file_nodes_path", "file_nodes", "path")
+    _create_index(conn, "ix_file_nodes_blob_id", "file_nodes", "blob_id")
+    _create_index(conn, "ix_file_nodes_parent_id", "file_nodes", "parent_id")
+    _create_index(
+        conn, "ix_file_nodes_owner_parent", "file_nodes",
+        "owner_id, parent_id, is_deleted, node_type DESC, name"
+    )
+    _create_index(conn, "ix_file_nodes_deleted_at", "file_nodes", "is_deleted, deleted_at")
+    conn.execute(text("ANALYZE file_nodes"))
+
+
+def _migration_004_storage_backends(conn: Connection):
+    """数据块记录所在的存储后端，分片上传记录后端的分片上传标识"""
+    _add_column(conn, "blobs", "backend", "VARCHAR(16) NOT NULL DEFAULT 'local'")
+    _add_column(conn, "upload_sessions", "storage_backend", "VARCHAR(16)")
+    _add_column(conn, "upload_sessions", "storage_key", "VARCHAR(64)")
+    _add_column(conn, "upload_sessions", "multipart_id", "VARCHAR(255)")
+
+
+def _migration_005_blob_access_tracking(conn: Connection):
+    """记录数据块的最后访问时间，已有数据块以创建时间为初始值"""
+    _add_column(conn, "blobs", "last_accessed_at", "DATETIME")
+    conn.execute(text('UPDATE "blobs" SET last_accessed_at = created_at WHERE last_accessed_at IS NULL'))
+    _create_index(conn, "ix_blobs_backend_last_accessed", "blobs", "backend, last_accessed_at")
+
+
+def _migration_006_blob_compression(conn: Connection):
+    """数据块可以压缩存放，记录压缩格式和压缩后的大小"""
+    _add_column(conn, "blobs", "encoding", "VARCHAR(16)")
+    _add_column(conn, "blobs", "encoded_size", "BIGINT")
+
+
+def _migration_007_unique_blob_content(conn: Connection):
+    """相同内容（哈希和大小）的数据块只能有一条记录
+    
+    并发上传相同内容时可能已经产生了重复的数据块，先把引用合并到编号最小的一条。
+    被合并的数据块内容仍留在存储后端中，这里只列出它们，由管理员确认后删除。
+    """
+    duplicates = conn.execute(text(
+        'SELECT b.id, b.backend, b.storage_key, b.ref_count, keep.id FROM "blobs" b '
+        'JOIN (SELECT content_hash, size, MIN(id) AS id FROM "blobs" '
+        'GROUP BY content_hash, size HAVING COUNT(*) > 1) keep '
+        'ON b.content_hash = keep.content_hash AND b.size = keep.size AND b.id != keep.id'
+    )).all()
+    for blob_id, backend, storage_key, ref_count, keep_id in duplicates:
+        conn.execute(text('UPDATE "file_nodes" SET blob_id = :keep WHERE blob_id = :id'),
+                     {"keep": keep_id, "id": blob_id})
+        conn.execute(text('UPDATE "blobs" SET ref_count = ref_count + :count WHERE id = :keep'),
+                     {"count": ref_count, "keep": keep_id})
+        conn.execute(text('DELETE FROM "blobs" WHERE id = :id'), {"id": blob_id})
+        print(f"⚠️ 重复的数据块 {blob_id} 已合并到 {keep_id}，不再使用的内容: {backend}:{storage_key}")
+    
+    # 唯一索引同时覆盖按哈希查找，原来的单列索引不再需要
+    conn.execute(text('DROP INDEX IF EXISTS "ix_blobs_content_hash"'))
+    _create_index(conn, "uq_blobs_content_hash_size", "blobs", "content_hash, size", unique=True)
+
+
+# 迁移列表：(版本号, 名称, 迁移函数)，按版本号递增
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "blob_storage", _migration_001_blob_storage),
+    (2, "hot_query_indexes", _migration_002_hot_query_indexes),
+    (3, "per_user_full_path", _migration_003_per_user_full_path),
+    (4, "storage_backends", _migration_004_storage_backends),
+    (5, "blob_access_tracking", _migration_005_blob_access_tracking),
+    (6, "blob_compression", _migration_006_blob_compression),
+    (7, "unique_blob_content", _migration_007_unique_blob_content),
+]
+
+
+def get_applied_versions(conn: Connection) -> set:
+    """获取已执行的迁移版本号"""
+    rows = conn.execute(text(f'SELECT version FROM "{MIGRATIONS_TABLE}"'))
+    return {row[0] for row in rows}
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """执行所有未执行的迁移，返回本次执行的版本号
+    
+    每个迁移在独立的事务中执行，失败时回滚该迁移并停止，已成功的迁移不受影响。
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{MIGRATIONS_TABLE}" ('
+            'version INTEGER PRIMARY KEY, '
+            'name VARCHAR(100) NOT NULL, '
+            'applied_at DATETIME NOT NULL)'
+        ))
+        applied = get_applied_versions(conn)
+    
+    executed = []
+    for version, name, migrate in sorted(MIGRATIONS, key=lambda migration: migration[0]):
+        if version in applied:
+            continue
+        
+        with engine.begin() as conn:
+            # pysqlite 只在 DML 之前自动开启事务，CREATE / ALTER / DROP 会各自立即提交；
+            # 显式开启事务，迁移中的结构变更才能和数据变更一起回滚
+            conn.exec_driver_sql("BEGIN")
+            migrate(conn)
+            conn.execute(
+                text(f'INSERT INTO "{MIGRATIONS_TABLE}" (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {"version": version, "name": name, "applied_at": datetime.utcnow()}
+            )
+        executed.append(version)
+        print(f"✅ 数据库迁移 {version:03d}_{name} 已执行")
+    
+    return executed
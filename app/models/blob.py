@@ -0,0 +1,57 @@
+"""
+内容寻址的数据块模型
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, Index
+from app.models.user import Base
+from datetime import datetime
+from typing import Optional
+
+
+class Blob(Base):
+    """数据块模型 - 相同内容只存储一份，由多个文件节点引用"""
+    __tablename__ = "blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(128), nullable=False)  # 内容的BLAKE2b哈希
+    size = Column(BigInteger, nullable=False)  # 内容大小（字节）
+    mime_type = Column(String(100), nullable=True)  # 按内容检测的MIME类型
+    storage_key = Column(String(64), nullable=False, unique=True)  # 物理存储标识
+    backend = Column(String(16), nullable=False, default='local')  # 内容所在的存储后端
+    encoding = Column(String(16), nullable=True)  # 存储时使用的压缩格式，为空表示原样存放
+    encoded_size = Column(BigInteger, nullable=True)  # 压缩存放时 gzip 数据的大小
+    ref_count = Column(Integer, nullable=False, default=0)  # 引用该数据块的文件节点数
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow)  # 最后一次读取内容的时间，用于冷热分层
+    
+    __table_args__ = (
+        # 相同内容只能有一条记录，并发上传相同内容时由数据库保证去重
+        Index('uq_blobs_content_hash_size', content_hash, size, unique=True),
+        # 按后端查找长期未访问的数据块
+        Index('ix_blobs_backend_last_accessed', backend, last_accessed_at),
+    )
+    
+    @property
+    def storage(self):
+        """读取内容使用的存储后端，压缩存放时读取到的是解压后的内容"""
+        from app.services.storage_backend import get_blob_storage
+        return get_blob_storage(self.backend, self.encoding, self.encoded_size)
+    
+    @property
+    def physical_path(self) -> Optional[str]:
+        """获取本地物理存储路径，内容不在本地磁盘时为 None"""
+        return self.storage.local_path(self.storage_key)
+
+
+class PendingBlobDeletion(Base):
+    """等待删除的数据块副本 - 数据块移动到其他后端后，源后端中的副本保留一段时间再删除
+    
+    记录在数据库中，服务重启后仍会按时删除。
+    """
+    __tablename__ = "pending_blob_deletions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    blob_id = Column(Integer, nullable=False)  # 数据块记录删除后仍要删除副本，不设外键
+    backend = Column(String(16), nullable=False)  # 副本所在的存储后端
+    storage_key = Column(String(64), nullable=False)
+    delete_after = Column(DateTime, nullable=False, index=True)  # 保留期结束的时间
@@ -2,10 +2,11 @@
 文件和目录数据模型
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, BigInteger, Index
 from sqlalchemy.orm import relationship
 from app.models.user import Base
 from datetime import datetime
+from typing import Optional
 import os
 
 
@@ -16,7 +17,7 @@ class FileNode(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)  # 文件/目录名
     path = Column(String(1000), nullable=False, index=True)  # 相对路径
-    full_path = Column(String(1000), nullable=False, unique=True)  # 完整路径
+    full_path = Column(String(1000), nullable=False)  # 完整路径，同一用户内唯一
     
     # 文件类型：'file' 或 'directory'
     node_type = Column(String(10), nullable=False, default='file')
@@ -26,8 +27,12 @@ class FileNode(Base):
     mime_type = Column(String(100), nullable=True)  # MIME类型
     file_extension = Column(String(10), nullable=True)  # 文件扩展名
     
+    # 文件内容所在的数据块，为空表示旧版按路径存储的文件
+    blob_id = Column(Integer, ForeignKey('blobs.id'), nullable=True, index=True)
+    blob = relationship("Blob")
+    
     # 父目录关系
-    parent_id = Column(Integer, ForeignKey('file_nodes.id'), nullable=True)
+    parent_id = Column(Integer, ForeignKey('file_nodes.id'), nullable=True, index=True)
     parent = relationship("FileNode", remote_side=[id], backref="children")
     
     # 状态和时间
@@ -40,6 +45,16 @@ class FileNode(Base):
     owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     owner = relationship("User", backref="files")
     
+    # 常用查询的复合索引，旧数据库由 app/migrations.py 中的迁移补充
+    __table_args__ = (
+        # 列出目录内容：按所有者和父目录过滤，目录在前、按名称排序
+        Index('ix_file_nodes_owner_parent', owner_id, parent_id, is_deleted, node_type.desc(), name),
+        # 每个用户有独立的路径命名空间，同时用于按路径查找节点
+        Index('uq_file_nodes_owner_full_path', owner_id, full_path, unique=True),
+        # 回收站清理：按删除时间查找过期节点
+        Index('ix_file_nodes_deleted_at', is_deleted, deleted_at),
+    )
+    
     @property
     def is_file(self) -> bool:
         """是否为文件"""
@@ -51,8 +66,15 @@ class FileNode(Base):
         return self.node_type == 'directory'
     
     @property
-    def physical_path(self) -> str:
-        """获取物理存储路径"""
+    def physical_path(self) -> Optional[str]:
+        """获取本地物理存储路径，内容在其他存储后端时为 None"""
+        if self.blob_id is not None:
+            return self.blob.physical_path
+        return self.legacy_path
+    
+    @property
+    def legacy_path(self) -> str:
+        """获取按目录结构存储时的物理路径"""
         from app.config import STORAGE_DIR, TRASH_DIR
         if self.is_deleted:
             return os.path.join(str(TRASH_DIR), self.full_path.lstrip('/'))
@@ -65,14 +87,6 @@ class FileNode(Base):
             query = [child for child in query if not child.is_deleted]
         return query
     
-    def get_all_descendants(self, include_deleted=False):
-        """递归获取所有后代节点"""
-        descendants = []
-        for child in self.get_children(include_deleted):
-            descendants.append(child)
-            descendants.extend(child.get_all_descendants(include_deleted))
-        return descendants
-    
     def is_effectively_deleted(self):
         """检查节点是否被删除（包括通过父目录的删除状态）"""
         if self.is_deleted:
@@ -0,0 +1,54 @@
+"""
+后台任务数据模型
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, BigInteger
+from app.models.user import Base
+from datetime import datetime
+import json
+
+
+class Job(Base):
+    """后台任务"""
+    __tablename__ = "jobs"
+    
+    id = Column(String(36), primary_key=True)  # 任务ID
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    job_type = Column(String(32), nullable=False)  # 任务类型
+    params_json = Column(Text, nullable=True)  # 任务参数
+    
+    # 状态：queued / running / succeeded / failed
+    status = Column(String(16), nullable=False, default='queued')
+    progress_current = Column(BigInteger, nullable=False, default=0)
+    progress_total = Column(BigInteger, nullable=False, default=0)
+    message = Column(String(255), nullable=True)  # 当前进度说明
+    result_json = Column(Text, nullable=True)  # 任务结果
+    result_path = Column(String(1000), nullable=True)  # 结果文件路径
+    error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    @property
+    def params(self) -> dict:
+        """任务参数"""
+        return json.loads(self.params_json) if self.params_json else {}
+    
+    @params.setter
+    def params(self, value: dict):
+        self.params_json = json.dumps(value, ensure_ascii=False) if value else None
+    
+    @property
+    def result(self):
+        """任务结果"""
+        return json.loads(self.result_json) if self.result_json else None
+    
+    @result.setter
+    def result(self, value):
+        self.result_json = json.dumps(value, ensure_ascii=False) if value is not None else None
+    
+    @property
+    def is_finished(self) -> bool:
+        """任务是否已结束"""
+        return self.status in ('succeeded', 'failed')
@@ -20,11 +20,11 @@ class ShareLink(Base):
     share_id = Column(String(32), unique=True, index=True, nullable=False)  # 公开的分享ID
     
     # 关联的文件/目录
-    file_node_id = Column(Integer, ForeignKey('file_nodes.id'), nullable=False)
+    file_node_id = Column(Integer, ForeignKey('file_nodes.id'), nullable=False, index=True)
     file_node = relationship("FileNode", backref="share_links")
     
     # 创建者
-    creator_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    creator_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     creator = relationship("User", backref="created_shares")
     
     # 分享设置
@@ -0,0 +1,62 @@
+"""
+分片上传会话数据模型
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, BigInteger
+from app.models.user import Base
+from datetime import datetime
+import json
+
+
+class UploadSession(Base):
+    """分片上传会话"""
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String(36), primary_key=True)  # 上传ID
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    
+    # 目标文件信息
+    filename = Column(String(255), nullable=False)
+    path = Column(String(1000), nullable=False)  # 上传目录
+    file_size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    total_chunks = Column(Integer, nullable=False)
+    
+    # 校验信息
+    file_hash = Column(String(128), nullable=True)
+    hash_algorithm = Column(String(16), nullable=False, default='md5')
+    file_metadata_json = Column(Text, nullable=True)  # 原始文件元数据
+    
+    # 进度和状态：uploading / completing / completed / failed / cancelled
+    uploaded_count = Column(Integer, nullable=False, default=0)
+    status = Column(String(16), nullable=False, default='uploading')
+    error = Column(Text, nullable=True)
+    file_id = Column(Integer, nullable=True)  # 完成后生成的文件节点ID
+    
+    # 存储后端支持分片写入时，分片直接写入后端而不是本地暂存文件
+    storage_backend = Column(String(16), nullable=True)
+    storage_key = Column(String(64), nullable=True)
+    multipart_id = Column(String(255), nullable=True)  # 后端的分片上传标识
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    @property
+    def file_metadata(self):
+        """原始文件元数据"""
+        if not self.file_metadata_json:
+            return None
+        return json.loads(self.file_metadata_json)
+    
+    @file_metadata.setter
+    def file_metadata(self, value):
+        self.file_metadata_json = json.dumps(value, ensure_ascii=False) if value else None
+
+
+class UploadChunk(Base):
+    """已接收的分片，每个分片一行，写入为单行插入"""
+    __tablename__ = "upload_chunks"
+    
+    upload_id = Column(String(36), ForeignKey('upload_sessions.id'), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True, autoincrement=False)
@@ -16,6 +16,8 @@ from app.utils.auth import (
     get_current_user,
     get_current_user_optional
 )
+from app.utils.executors import run_in_db_pool
+from app.utils.http_cache import page_response
 from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter()
@@ -25,10 +27,10 @@ templates = Jinja2Templates(directory="templates")
 @router.get("/login")
 async def login_page(request: Request):
     """登录页面"""
-    return templates.TemplateResponse("auth/login.html", {
+    return page_response(request, templates.TemplateResponse("auth/login.html", {
         "request": request,
         "title": "登录 - 个人网盘系统"
-    })
+    }))
 
 
 @router.post("/login", response_model=LoginResponse)
@@ -38,7 +40,7 @@ async def login(
 ):
     """用户登录"""
     # 验证用户
-    user = authenticate_user(db, login_data.username, login_data.password)
+    user = await run_in_db_pool(authenticate_user, db, login_data.username, login_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -60,7 +62,7 @@ async def login(
     
     # 更新最后登录时间
     user.last_login = datetime.utcnow()
-    db.commit()
+    await run_in_db_pool(db.commit)
     
     return LoginResponse(
         access_token=access_token,
@@ -98,15 +100,15 @@ async def change_password(
 ):
     """修改密码"""
     # 验证当前密码
-    if not current_user.verify_password(password_data.current_password):
+    if not await run_in_db_pool(current_user.verify_password, password_data.current_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="旧密码错误"
         )
     
     # 更新密码
-    current_user.hashed_password = User.hash_password(password_data.new_password)
-    db.commit()
+    current_user.hashed_password = await run_in_db_pool(User.hash_password, password_data.new_password)
+    await run_in_db_pool(db.commit)
     
     return {"message": "密码修改成功"}
 
@@ -3,23 +3,30 @@
 """
 
 import os
-from typing import List
+from typing import List, Optional
 from urllib.parse import quote
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request
 import json
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.user import User
 from app.models.file import FileNode
 from app.services.file_service import FileService
 from app.services.chunk_upload_service import ChunkUploadService
-from app.utils.auth import get_current_user
+from app.services.job_service import JobService
+from app.services.thumbnail_service import (
+    thumbnails_available, has_thumbnail, thumbnail_size, open_node_source, get_thumbnail
+)
+from app.utils.auth import get_current_user, get_preview_user, create_media_token
+from app.utils.executors import run_in_disk_pool, run_in_db_pool, run_in_thumbnail_pool
 from app.utils.file_utils import (
-    get_file_content, get_text_content, create_zip_from_nodes,
+    get_file_content, iter_zip_from_nodes, content_version,
     format_file_size, get_file_icon, can_preview, sanitize_filename,
-    is_audio, is_video
+    is_audio, is_video, media_type_for
 )
+from app.utils.media_stream import content_response, text_preview_response
+from app.utils.http_cache import node_validators, not_modified_response
 from app.schemas.file import (
     FileUploadResponse, DirectoryCreateRequest, FileNodeResponse,
     DirectoryListResponse, RenameRequest, MoveRequest,
@@ -28,8 +35,10 @@ from app.schemas.file import (
     ChunkUploadRequest, ChunkUploadResponse,
     ChunkUploadCompleteRequest, ChunkUploadCompleteResponse
 )
-from app.config import MAX_FILE_SIZE
-import io
+from app.config import (
+    MAX_FILE_SIZE, MEDIA_TOKEN_EXPIRE_MINUTES, THUMBNAIL_DEFAULT_SIZE, PREVIEW_TEXT_DEFAULT_SIZE, PREVIEW_TEXT_MAX_SIZE,
+    PREVIEW_TEXT_DEFAULT_LINES, PREVIEW_TEXT_MAX_LINES, CACHE_CONTROL_FILES
+)
 
 router = APIRouter()
 
@@ -61,14 +70,14 @@ async def browse_directory(
     
     # 验证目录是否存在（除了根目录）
     if path != "/":
-        parent_node = file_service.get_node_by_path(path, current_user)
+        parent_node = await run_in_db_pool(file_service.get_node_by_path, path, current_user)
         if not parent_node:
             raise HTTPException(status_code=404, detail=f"目录不存在: {path}")
         if not parent_node.is_directory:
             raise HTTPException(status_code=400, detail=f"路径不是目录: {path}")
     
     # 获取目录内容
-    children = file_service.get_children(path, current_user)
+    children = await run_in_db_pool(file_service.get_children, path, current_user)
     
     # 转换为响应模型
     items = []
@@ -76,6 +85,7 @@ async def browse_directory(
         item_data = file_service.get_node_info(child)
         item_data['can_preview'] = can_preview(child)
         item_data['icon'] = get_file_icon(child)
+        item_data['has_thumbnail'] = has_thumbnail(child)
         if child.is_file and child.file_size:
             item_data['formatted_size'] = format_file_size(child.file_size)
         items.append(FileNodeResponse(**item_data))
@@ -118,9 +128,8 @@ async def upload_files(
     
     for i, file in enumerate(files):
         try:
-            # 检查文件大小
-            content = await file.read()
-            if len(content) > MAX_FILE_SIZE:
+            # 检查文件大小（流式保存时还会再次按实际写入量检查）
+            if file.size is not None and file.size > MAX_FILE_SIZE:
                 errors.append(f"{file.filename}: 文件过大")
                 continue
             
@@ -145,14 +154,17 @@ async def upload_files(
             # 确保所有必要的目录都存在
             dir_path = os.path.dirname(file_path)
             if dir_path and dir_path != '/':
-                file_service.ensure_directory_exists(dir_path, current_user)
+                await run_in_db_pool(file_service.ensure_directory_exists, dir_path, current_user)
             
-            # 保存文件
-            file_node = file_service.save_uploaded_file(file_path, content, current_user)
+            # 保存文件（从上传的临时文件分块复制，不整体读入内存）
+            file_node = await run_in_disk_pool(
+                file_service.save_uploaded_stream,
+                file_path, file.file, current_user, max_size=MAX_FILE_SIZE
+            )
             file_info = file_service.get_node_info(file_node)
             file_info['formatted_size'] = format_file_size(file_node.file_size)
             uploaded_files.append(file_info)
-            
+        
         except Exception as e:
             errors.append(f"{file.filename}: {str(e)}")
     
@@ -181,7 +193,7 @@ async def create_directory(
     """创建目录"""
     try:
         file_service = FileService(db)
-        dir_node = file_service.create_directory(request.path, current_user)
+        dir_node = await run_in_db_pool(file_service.create_directory, request.path, current_user)
         
         return FileUploadResponse(
             success=True,
@@ -204,81 +216,24 @@ async def download_file(
 ):
     """下载文件（支持断点续传）"""
     file_service = FileService(db)
-    node = file_service.get_node_by_id(node_id, current_user)
+    node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
     
     if not node:
         raise HTTPException(status_code=404, detail="文件不存在")
     
     if node.is_file:
-        # 下载单个文件（支持Range请求）
-        file_path = node.physical_path
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        file_size = os.path.getsize(file_path)
-        range_header = request.headers.get('Range')
-        
-        if range_header:
-            # 处理Range请求
-            try:
-                ranges = range_header.replace('bytes=', '').split('-')
-                start = int(ranges[0]) if ranges[0] else 0
-                end = int(ranges[1]) if ranges[1] else file_size - 1
-                
-                # 验证范围
-                if start >= file_size or end >= file_size or start > end:
-                    raise HTTPException(status_code=416, detail="Range Not Satisfiable")
-                
-                content_length = end - start + 1
-                
-                def iterfile(start: int, end: int):
-                    with open(file_path, 'rb') as file:
-                        file.seek(start)
-                        remaining = end - start + 1
-                        while remaining > 0:
-                            chunk_size = min(8192, remaining)
-                            chunk = file.read(chunk_size)
-                            if not chunk:
-                                break
-                            remaining -= len(chunk)
-                            yield chunk
-                
-                headers = {
-                    'Content-Range': f'bytes {start}-{end}/{file_size}',
-                    'Accept-Ranges': 'bytes',
-                    'Content-Length': str(content_length),
-                    'Content-Disposition': encode_filename_for_content_disposition(node.name)
-                }
-                
-                return StreamingResponse(
-                    iterfile(start, end),
-                    status_code=206,
-                    headers=headers,
-                    media_type='application/octet-stream'
-                )
-            except (ValueError, IndexError):
-                raise HTTPException(status_code=400, detail="Invalid Range header")
-        else:
-            # 普通下载
-            headers = {
-                'Accept-Ranges': 'bytes',
-                'Content-Disposition': encode_filename_for_content_disposition(node.name)
-            }
-            return FileResponse(
-                file_path,
-                media_type='application/octet-stream',
-                headers=headers
-            )
+        # 下载单个文件（支持Range请求和条件请求）
+        return await content_response(request, node, 'application/octet-stream', filename=node.name)
     
     elif node.is_directory:
-        # 打包目录为ZIP下载
-        # 只传递根节点，递归逻辑在 _add_node_to_zip 中处理
-        zip_content = create_zip_from_nodes([node])
+        # 打包目录为ZIP下载（边打包边发送）
+        # 只传递根节点，递归逻辑在 _collect_zip_entries 中处理
+        zip_stream = await run_in_db_pool(iter_zip_from_nodes, [node])
         
         zip_filename = f"{node.name}.zip"
         
         return StreamingResponse(
-            io.BytesIO(zip_content),
+            zip_stream,
             media_type='application/zip',
             headers={"Content-Disposition": encode_filename_for_content_disposition(zip_filename)}
         )
@@ -294,13 +249,13 @@ async def rename_file(
     """重命名文件/目录"""
     try:
         file_service = FileService(db)
-        node = file_service.get_node_by_id(node_id, current_user)
+        node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
         
         if not node:
             raise HTTPException(status_code=404, detail="文件不存在")
         
         old_name = node.name
-        file_service.rename_node(node, request.new_name)
+        await run_in_db_pool(file_service.rename_node, node, request.new_name)
         
         return {
             "success": True,
@@ -313,6 +268,31 @@ async def rename_file(
         }
 
 
+@router.post("/move")
+async def move_files(
+    request: MoveRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量移动文件/目录到目标目录"""
+    try:
+        file_service = FileService(db)
+        moved_count = await run_in_db_pool(
+            file_service.move_nodes, request.node_ids, request.target_path, current_user
+        )
+        
+        return {
+            "success": True,
+            "message": f"已移动 {moved_count} 个项目到 '{request.target_path}'",
+            "moved_count": moved_count
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"移动失败: {str(e)}"
+        }
+
+
 @router.delete("/delete/{node_id}")
 async def delete_file(
     node_id: int,
@@ -322,12 +302,12 @@ async def delete_file(
     """删除文件/目录（移入回收站）"""
     try:
         file_service = FileService(db)
-        node = file_service.get_node_by_id(node_id, current_user)
+        node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
         
         if not node:
             raise HTTPException(status_code=404, detail="文件不存在")
         
-        if file_service.move_to_trash(node):
+        if await run_in_disk_pool(file_service.move_to_trash, node):
             return {
                 "success": True,
                 "message": f"'{node.name}' 已移入回收站"
@@ -347,12 +327,21 @@ async def delete_file(
 @router.get("/preview/{node_id}")
 async def preview_file(
     node_id: int,
-    current_user: User = Depends(get_current_user),
+    request: Request,
+    offset: Optional[int] = Query(None, ge=0, description="文本预览：起始字节偏移"),
+    limit: int = Query(PREVIEW_TEXT_DEFAULT_SIZE, ge=16, le=PREVIEW_TEXT_MAX_SIZE, description="文本预览：最多返回的字节数"),
+    line: Optional[int] = Query(None, ge=0, description="文本预览：按行读取时的起始行号（从0开始）"),
+    lines: int = Query(PREVIEW_TEXT_DEFAULT_LINES, ge=1, le=PREVIEW_TEXT_MAX_LINES, description="文本预览：按行读取时的行数"),
+    current_user: User = Depends(get_preview_user),
     db: Session = Depends(get_db)
 ):
-    """预览文件"""
+    """预览文件
+    
+    图片、PDF和音视频返回文件内容，支持Range请求和条件请求；
+    音视频元素不能携带 Authorization 头，可以使用 /files/media-url 返回的带令牌地址。
+    """
     file_service = FileService(db)
-    node = file_service.get_node_by_id(node_id, current_user)
+    node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
     
     if not node or not node.is_file:
         raise HTTPException(status_code=404, detail="文件不存在")
@@ -363,67 +352,90 @@ async def preview_file(
     try:
         if node.mime_type and node.mime_type.startswith('image/'):
             # 图片文件直接返回
-            return FileResponse(
-                node.physical_path,
-                media_type=node.mime_type,
-                filename=node.name
-            )
+            return await content_response(request, node, node.mime_type, filename=node.name, inline=True)
         elif node.file_extension in ['.txt', '.md', '.json', '.xml', '.html', '.css', '.js', '.py']:
-            # 文本文件返回JSON
-            content = get_text_content(node)
-            return {
-                "type": "text",
-                "content": content,
-                "filename": node.name,
-                "size": node.file_size
-            }
+            # 文本文件按窗口返回JSON，不读取整个文件
+            return await text_preview_response(request, node, offset, limit, line, lines)
         elif node.file_extension == '.pdf':
             # PDF文件直接返回
-            return FileResponse(
-                node.physical_path,
-                media_type='application/pdf',
-                filename=node.name
-            )
-        elif is_audio(node):
-            # 音频文件直接返回
-            audio_mime_types = {
-                '.mp3': 'audio/mpeg',
-                '.wav': 'audio/wav',
-                '.flac': 'audio/flac',
-                '.aac': 'audio/aac',
-                '.ogg': 'audio/ogg',
-                '.m4a': 'audio/mp4'
-            }
-            mime_type = audio_mime_types.get(node.file_extension, 'audio/mpeg')
-            return FileResponse(
-                node.physical_path,
-                media_type=mime_type,
-                filename=node.name
-            )
-        elif is_video(node):
-            # 视频文件直接返回
-            video_mime_types = {
-                '.mp4': 'video/mp4',
-                '.avi': 'video/x-msvideo',
-                '.mkv': 'video/x-matroska',
-                '.mov': 'video/quicktime',
-                '.wmv': 'video/x-ms-wmv',
-                '.webm': 'video/webm',
-                '.m4v': 'video/mp4'
-            }
-            mime_type = video_mime_types.get(node.file_extension, 'video/mp4')
-            return FileResponse(
-                node.physical_path,
-                media_type=mime_type,
-                filename=node.name
-            )
+            return await content_response(request, node, 'application/pdf', filename=node.name, inline=True)
+        elif is_audio(node) or is_video(node):
+            # 音视频文件直接返回，播放器拖动进度时按范围读取
+            return await content_response(request, node, media_type_for(node), filename=node.name, inline=True)
         else:
             raise HTTPException(status_code=400, detail="不支持的预览类型")
     
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预览失败: {str(e)}")
 
 
+@router.get("/media-url/{node_id}")
+async def get_media_url(
+    node_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取可以直接交给 <video>/<audio> 元素的预览地址，地址中带有只能预览该文件的短期令牌"""
+    file_service = FileService(db)
+    node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
+    
+    if not node or not node.is_file:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if not can_preview(node):
+        raise HTTPException(status_code=400, detail="文件不支持预览")
+    
+    token = create_media_token(current_user.username, node.id)
+    return {
+        "success": True,
+        "url": f"/files/preview/{node.id}?token={token}",
+        "expires_in": MEDIA_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+
+@router.get("/thumbnail/{node_id}")
+async def thumbnail_file(
+    node_id: int,
+    request: Request,
+    size: int = Query(THUMBNAIL_DEFAULT_SIZE, ge=1, description="缩略图最长边的像素数"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取图片文件的缩略图
+    
+    缩略图生成一次后缓存在磁盘上，请求的尺寸向上取到最接近的一档。
+    读取缩略图不算作读取文件内容，不会把冷数据层中的数据块提升回热数据层。
+    """
+    if not thumbnails_available():
+        raise HTTPException(status_code=501, detail="服务器未安装 Pillow，不支持缩略图")
+    
+    file_service = FileService(db)
+    node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
+    
+    if not node or not node.is_file or not has_thumbnail(node):
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    
+    size = thumbnail_size(size)
+    version = await run_in_db_pool(content_version, node)
+    # 内容版本不变时缩略图不变，浏览器重新验证时不需要生成或读取缩略图
+    headers = node_validators(node, CACHE_CONTROL_FILES, str(size))
+    not_modified = not_modified_response(request, headers)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        content = await run_in_thumbnail_pool(
+            get_thumbnail, node.id, version, size, lambda: open_node_source(node)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成缩略图失败: {str(e)}")
+    
+    return Response(content, media_type='image/webp', headers=headers)
+
+
 @router.get("/search", response_model=SearchResponse)
 async def search_files(
     keyword: str = Query(..., description="搜索关键词"),
@@ -443,7 +455,7 @@ async def search_files(
     if path != '/':
         query = query.filter(FileNode.full_path.startswith(path))
     
-    results = query.limit(100).all()
+    results = await run_in_db_pool(query.limit(100).all)
     
     # 转换为响应模型
     file_service = FileService(db)
@@ -452,6 +464,7 @@ async def search_files(
         item_data = file_service.get_node_info(node)
         item_data['can_preview'] = can_preview(node)
         item_data['icon'] = get_file_icon(node)
+        item_data['has_thumbnail'] = has_thumbnail(node)
         items.append(FileNodeResponse(**item_data))
     
     return SearchResponse(
@@ -473,16 +486,16 @@ async def batch_download(
     # 获取所有文件节点
     nodes = []
     for file_id in request.file_ids:
-        node = file_service.get_node_by_id(file_id, current_user)
+        node = await run_in_db_pool(file_service.get_node_by_id, file_id, current_user)
         if node:
             nodes.append(node)
     
     if not nodes:
         raise HTTPException(status_code=404, detail="没有找到指定的文件")
     
-    # 生成ZIP文件
+    # 生成ZIP文件流
     try:
-        zip_content = create_zip_from_nodes(nodes)
+        zip_stream = await run_in_db_pool(iter_zip_from_nodes, nodes)
         
         # 生成ZIP文件名
         if len(nodes) == 1:
@@ -491,15 +504,46 @@ async def batch_download(
             zip_filename = f"batch_download_{len(nodes)}_files.zip"
         
         return StreamingResponse(
-            io.BytesIO(zip_content),
+            zip_stream,
             media_type='application/zip',
             headers={"Content-Disposition": encode_filename_for_content_disposition(zip_filename)}
         )
-        
+    
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"打包失败: {str(e)}")
 
 
+@router.post("/archive")
+async def create_archive(
+    request: BatchDownloadRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """在后台打包文件（ZIP），完成后通过 /jobs/{job_id}/download 下载"""
+    try:
+        file_service = FileService(db)
+        node_ids = [
+            node_id for node_id in request.file_ids
+            if await run_in_db_pool(file_service.get_node_by_id, node_id, current_user)
+        ]
+        
+        if not node_ids:
+            raise HTTPException(status_code=404, detail="没有找到指定的文件")
+        
+        job = await run_in_db_pool(JobService(db).create_job, current_user, 'zip_archive', {'node_ids': node_ids})
+        
+        return {
+            "success": True,
+            "message": "正在打包",
+            "job_id": job.id
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"打包失败: {str(e)}"
+        }
+
+
 # 分片上传相关端点
 
 @router.post("/chunk/init", response_model=ChunkUploadInitResponse)
@@ -511,24 +555,73 @@ async def init_chunk_upload(
     """初始化分片上传"""
     try:
         chunk_service = ChunkUploadService(db)
-        upload_id, total_chunks, uploaded_chunks = chunk_service.init_chunk_upload(
+        file_metadata = request.file_metadata.dict() if request.file_metadata else None
+        
+        if request.instant_token:
+            # 持有证明正确时直接创建文件（秒传），否则按普通上传处理
+            file_info = await run_in_disk_pool(
+                chunk_service.try_instant_upload,
+                request.filename,
+                request.file_size,
+                request.path,
+                current_user,
+                request.instant_token,
+                request.instant_proof,
+                file_metadata
+            )
+            if file_info:
+                return ChunkUploadInitResponse(
+                    success=True,
+                    message="秒传成功",
+                    hash_algorithm=request.hash_algorithm,
+                    instant=True,
+                    file_info=file_info
+                )
+        else:
+            # 服务器上已有相同内容时，要求客户端证明持有内容后才能秒传
+            challenge = await run_in_db_pool(
+                chunk_service.instant_upload_challenge,
+                request.file_size,
+                current_user,
+                request.file_hash,
+                request.hash_algorithm
+            )
+            if challenge:
+                return ChunkUploadInitResponse(
+                    success=True,
+                    message="请提交持有证明",
+                    hash_algorithm=request.hash_algorithm,
+                    instant_challenge=challenge
+                )
+        
+        # 客户端未指定分片大小时使用服务器推荐值
+        chunk_size = request.chunk_size or chunk_service.recommend_chunk_size(request.file_size)
+        
+        upload_id, total_chunks, uploaded_chunks = await run_in_disk_pool(
+            chunk_service.init_chunk_upload,
             request.filename,
             request.file_size,
-            request.chunk_size,
+            chunk_size,
             request.path,
             current_user,
             request.file_hash,
-            request.file_metadata.dict() if request.file_metadata else None
+            file_metadata,
+            request.hash_algorithm
         )
+        # 推荐并发数需要查询活跃的上传会话
+        max_concurrency = await run_in_db_pool(chunk_service.recommend_concurrency, total_chunks)
         
         return ChunkUploadInitResponse(
             success=True,
             message="分片上传初始化成功",
             upload_id=upload_id,
             total_chunks=total_chunks,
-            uploaded_chunks=uploaded_chunks
+            uploaded_chunks=uploaded_chunks,
+            hash_algorithm=request.hash_algorithm,
+            chunk_size=chunk_size,
+            max_concurrency=max_concurrency
         )
-        
+    
     except Exception as e:
         return ChunkUploadInitResponse(
             success=False,
@@ -573,7 +666,8 @@ async def upload_chunk(
         chunk_data = await chunk_file.read()
         
         # 上传分片
-        success = chunk_service.upload_chunk(
+        success = await run_in_disk_pool(
+            chunk_service.upload_chunk,
             upload_id,
             chunk_index_int,
             chunk_data,
@@ -587,7 +681,7 @@ async def upload_chunk(
             chunk_index=chunk_index_int,
             received=True
         )
-        
+    
     except Exception as e:
         chunk_index_int = 0
         try:
@@ -613,7 +707,8 @@ async def complete_chunk_upload(
         chunk_service = ChunkUploadService(db)
         
         # 完成上传
-        file_info = chunk_service.complete_chunk_upload(
+        file_info = await run_in_disk_pool(
+            chunk_service.complete_chunk_upload,
             request.upload_id,
             current_user,
             request.file_hash
@@ -624,7 +719,7 @@ async def complete_chunk_upload(
             message="文件上传完成",
             file_info=file_info
         )
-        
+    
     except Exception as e:
         return ChunkUploadCompleteResponse(
             success=False,
@@ -641,9 +736,9 @@ async def get_chunk_upload_status(
     """获取分片上传状态"""
     try:
         chunk_service = ChunkUploadService(db)
-        status = chunk_service.get_upload_status(upload_id, current_user)
+        status = await run_in_db_pool(chunk_service.get_upload_status, upload_id, current_user)
         return {"success": True, "data": status}
-        
+    
     except Exception as e:
         return {"success": False, "message": str(e)}
 
@@ -657,12 +752,12 @@ async def cancel_chunk_upload(
     """取消分片上传"""
     try:
         chunk_service = ChunkUploadService(db)
-        success = chunk_service.cancel_upload(upload_id, current_user)
+        success = await run_in_disk_pool(chunk_service.cancel_upload, upload_id, current_user)
         
         if success:
             return {"success": True, "message": "上传已取消"}
         else:
             return {"success": False, "message": "上传会话不存在"}
-            
+    
     except Exception as e:
         return {"success": False, "message": str(e)}
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+后台任务相关路由
+"""
+
+import os
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models.user import User
+from app.services.job_service import JobService
+from app.utils.auth import get_current_user
+from app.utils.executors import run_in_disk_pool, run_in_db_pool
+from app.routers.files import encode_filename_for_content_disposition
+
+router = APIRouter()
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """查询任务状态和进度"""
+    job_service = JobService(db)
+    job = await run_in_db_pool(job_service.get_job, job_id, current_user)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    return {
+        "success": True,
+        "job": job_service.get_job_info(job)
+    }
+
+
+@router.get("/{job_id}/download")
+async def download_job_result(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """下载任务生成的结果文件"""
+    job = await run_in_db_pool(JobService(db).get_job, job_id, current_user)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if job.status != 'succeeded' or not job.result_path or not await run_in_disk_pool(os.path.exists, job.result_path):
+        raise HTTPException(status_code=404, detail="任务结果不存在")
+    
+    filename = (job.result or {}).get('filename') or os.path.basename(job.result_path)
+    return FileResponse(
+        job.result_path,
+        media_type='application/octet-stream',
+        headers={"Content-Disposition": encode_filename_for_content_disposition(filename)}
+    )
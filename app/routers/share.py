@@ -2,12 +2,11 @@
 分享系统相关路由
 """
 
-import os
 from typing import List, Optional
 from datetime import datetime, timedelta
 from urllib.parse import quote
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from app.database import get_db
@@ -16,15 +15,22 @@ from app.models.file import FileNode
 from app.models.share import ShareLink
 from app.services.file_service import FileService
 from app.utils.auth import get_current_user, get_current_user_optional
+from app.utils.executors import run_in_db_pool
 from app.utils.file_utils import (
-    get_file_content, get_text_content, create_zip_from_nodes,
-    format_file_size, get_file_icon, can_preview
+    get_file_content, iter_zip_from_nodes,
+    format_file_size, get_file_icon, can_preview, is_audio, is_video, media_type_for
 )
+from app.utils.media_stream import content_response, content_not_modified, serves_content, text_preview_response
+from app.utils.http_cache import node_validators, page_response
 from app.schemas.share import (
     CreateShareRequest, ShareResponse, ShareInfoResponse, ShareListResponse,
     ShareAccessRequest, ShareDeleteRequest, UpdateShareRequest
 )
-import io
+
+from app.config import (
+    PREVIEW_TEXT_DEFAULT_SIZE, PREVIEW_TEXT_MAX_SIZE, PREVIEW_TEXT_DEFAULT_LINES, PREVIEW_TEXT_MAX_LINES,
+    CACHE_CONTROL_FILES, CACHE_CONTROL_SHARES
+)
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -46,6 +52,19 @@ def encode_filename_for_content_disposition(filename: str) -> str:
         return f"attachment; filename*=UTF-8''{encoded_filename}"
 
 
+def _share_cache_control(share_link: ShareLink) -> str:
+    """分享内容的 Cache-Control，有密码的分享不允许 CDN 等共享缓存保存"""
+    return CACHE_CONTROL_FILES if share_link.password is not None else CACHE_CONTROL_SHARES
+
+
+def _find_share_link(db: Session, share_id: str, creator_id: Optional[int] = None) -> Optional[ShareLink]:
+    """按分享ID查找分享链接，指定 creator_id 时只查找该用户创建的链接"""
+    query = db.query(ShareLink).filter(ShareLink.share_id == share_id)
+    if creator_id is not None:
+        query = query.filter(ShareLink.creator_id == creator_id)
+    return query.first()
+
+
 @router.post("/create", response_model=ShareResponse)
 async def create_share(
     request: CreateShareRequest,
@@ -57,7 +76,7 @@ async def create_share(
         file_service = FileService(db)
         
         # 获取文件节点
-        node = file_service.get_node_by_id(request.file_node_id, current_user)
+        node = await run_in_db_pool(file_service.get_node_by_id, request.file_node_id, current_user)
         if not node:
             raise HTTPException(status_code=404, detail="文件不存在")
         
@@ -120,7 +139,7 @@ async def create_share(
             description=share_link.description,
             file_info=file_service.get_node_info(node)
         )
-        
+    
     except HTTPException:
         raise
     except Exception as e:
@@ -173,20 +192,20 @@ async def access_share_page(
 ):
     """访问分享页面"""
     # 查找分享链接
-    share_link = db.query(ShareLink).filter(ShareLink.share_id == share_id).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id)
     
     if not share_link:
-        return templates.TemplateResponse("share/not_found.html", {
+        return page_response(request, templates.TemplateResponse("share/not_found.html", {
             "request": request,
             "message": "分享链接不存在"
-        })
+        }))
     
     if not share_link.is_accessible:
         reason = "分享链接已过期" if share_link.is_expired else "下载次数已用完"
-        return templates.TemplateResponse("share/expired.html", {
+        return page_response(request, templates.TemplateResponse("share/expired.html", {
             "request": request,
             "message": reason
-        })
+        }))
     
     file_service = FileService(db)
     file_info = file_service.get_node_info(share_link.file_node)
@@ -195,7 +214,7 @@ async def access_share_page(
     if share_link.file_node.is_file and share_link.file_node.file_size:
         file_info['formatted_size'] = format_file_size(share_link.file_node.file_size)
     
-    return templates.TemplateResponse("share/access.html", {
+    return page_response(request, templates.TemplateResponse("share/access.html", {
         "request": request,
         "share": {
             "share_id": share_link.share_id,
@@ -208,7 +227,7 @@ async def access_share_page(
             "max_downloads": share_link.max_downloads
         },
         "file": file_info
-    })
+    }))
 
 
 @router.post("/{share_id}/access")
@@ -218,13 +237,13 @@ async def verify_share_access(
     db: Session = Depends(get_db)
 ):
     """验证分享访问权限"""
-    share_link = db.query(ShareLink).filter(ShareLink.share_id == share_id).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id)
     
     if not share_link or not share_link.is_accessible:
         raise HTTPException(status_code=404, detail="分享链接不可用")
     
     # 验证密码
-    if not share_link.verify_password(access_request.password or ""):
+    if not await run_in_db_pool(share_link.verify_password, access_request.password or ""):
         raise HTTPException(status_code=401, detail="密码错误")
     
     return {"success": True, "message": "验证成功"}
@@ -233,49 +252,49 @@ async def verify_share_access(
 @router.get("/{share_id}/download")
 async def download_shared_file(
     share_id: str,
+    request: Request,
     password: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
     """下载分享文件"""
-    share_link = db.query(ShareLink).filter(ShareLink.share_id == share_id).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id)
     
     if not share_link or not share_link.is_accessible:
         raise HTTPException(status_code=404, detail="分享链接不可用")
     
     # 验证密码
-    if not share_link.verify_password(password or ""):
+    if not await run_in_db_pool(share_link.verify_password, password or ""):
         raise HTTPException(status_code=401, detail="密码错误")
     
     node = share_link.file_node
+    cache_control = _share_cache_control(share_link)
     
-    # 增加下载计数
-    share_link.increment_download_count()
-    db.commit()
-    
+    # 每个发送内容的响应都计入下载次数，包括范围请求，否则分段请求可以绕过次数限制；
+    # 缓存验证通过（304）和范围无法满足（416）的请求不计数。
+    # 分享页面的播放器通过预览接口读取，拖动进度不消耗下载次数；目录打包为ZIP时忽略 Range
+    counted = True
     if node.is_file:
-        # 下载单个文件
-        file_path = node.physical_path
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        headers = {
-            'Content-Disposition': encode_filename_for_content_disposition(node.name)
-        }
-        return FileResponse(
-            file_path,
-            media_type='application/octet-stream',
-            headers=headers
+        validators = await run_in_db_pool(node_validators, node, cache_control)
+        counted = not content_not_modified(request, validators) and serves_content(
+            request, node.file_size or 0, validators['ETag'], validators.get('Last-Modified')
         )
+    if counted:
+        share_link.increment_download_count()
+        await run_in_db_pool(db.commit)
+    
+    if node.is_file:
+        # 下载单个文件（支持Range请求和条件请求）
+        return await content_response(request, node, 'application/octet-stream', filename=node.name,
+                                      cache_control=cache_control)
     
     elif node.is_directory:
-        # 打包目录为ZIP下载
-        children = [node] + node.get_all_descendants()
-        zip_content = create_zip_from_nodes(children)
+        # 打包目录为ZIP下载（边打包边发送）
+        zip_stream = await run_in_db_pool(iter_zip_from_nodes, [node])
         
         zip_filename = f"{node.name}.zip"
         
         return StreamingResponse(
-            io.BytesIO(zip_content),
+            zip_stream,
             media_type='application/zip',
             headers={"Content-Disposition": encode_filename_for_content_disposition(zip_filename)}
         )
@@ -284,17 +303,22 @@ async def download_shared_file(
 @router.get("/{share_id}/preview")
 async def preview_shared_file(
     share_id: str,
+    request: Request,
     password: Optional[str] = Query(None),
+    offset: Optional[int] = Query(None, ge=0, description="文本预览：起始字节偏移"),
+    limit: int = Query(PREVIEW_TEXT_DEFAULT_SIZE, ge=16, le=PREVIEW_TEXT_MAX_SIZE, description="文本预览：最多返回的字节数"),
+    line: Optional[int] = Query(None, ge=0, description="文本预览：按行读取时的起始行号（从0开始）"),
+    lines: int = Query(PREVIEW_TEXT_DEFAULT_LINES, ge=1, le=PREVIEW_TEXT_MAX_LINES, description="文本预览：按行读取时的行数"),
     db: Session = Depends(get_db)
 ):
     """预览分享文件"""
-    share_link = db.query(ShareLink).filter(ShareLink.share_id == share_id).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id)
     
     if not share_link or not share_link.is_accessible:
         raise HTTPException(status_code=404, detail="分享链接不可用")
     
     # 验证密码
-    if not share_link.verify_password(password or ""):
+    if not await run_in_db_pool(share_link.verify_password, password or ""):
         raise HTTPException(status_code=401, detail="密码错误")
     
     node = share_link.file_node
@@ -302,33 +326,30 @@ async def preview_shared_file(
     if not node.is_file or not can_preview(node):
         raise HTTPException(status_code=400, detail="文件不支持预览")
     
+    cache_control = _share_cache_control(share_link)
     try:
         if node.mime_type and node.mime_type.startswith('image/'):
             # 图片文件直接返回
-            return FileResponse(
-                node.physical_path,
-                media_type=node.mime_type,
-                filename=node.name
-            )
+            return await content_response(request, node, node.mime_type, filename=node.name, inline=True,
+                                          cache_control=cache_control)
         elif node.file_extension in ['.txt', '.md', '.json', '.xml', '.html', '.css', '.js', '.py']:
-            # 文本文件返回JSON
-            content = get_text_content(node)
-            return {
-                "type": "text",
-                "content": content,
-                "filename": node.name,
-                "size": node.file_size
-            }
+            # 文本文件按窗口返回JSON，不读取整个文件
+            return await text_preview_response(request, node, offset, limit, line, lines, cache_control)
         elif node.file_extension == '.pdf':
             # PDF文件直接返回
-            return FileResponse(
-                node.physical_path,
-                media_type='application/pdf',
-                filename=node.name
-            )
+            return await content_response(request, node, 'application/pdf', filename=node.name, inline=True,
+                                          cache_control=cache_control)
+        elif is_audio(node) or is_video(node):
+            # 音视频文件直接返回，播放器拖动进度时按范围读取
+            return await content_response(request, node, media_type_for(node), filename=node.name, inline=True,
+                                          cache_control=cache_control)
         else:
             raise HTTPException(status_code=400, detail="不支持的预览类型")
     
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预览失败: {str(e)}")
 
@@ -341,10 +362,7 @@ async def update_share(
     db: Session = Depends(get_db)
 ):
     """更新分享链接设置"""
-    share_link = db.query(ShareLink).filter(
-        ShareLink.share_id == share_id,
-        ShareLink.creator_id == current_user.id
-    ).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id, current_user.id)
     
     if not share_link:
         raise HTTPException(status_code=404, detail="分享链接不存在")
@@ -378,7 +396,7 @@ async def update_share(
             "success": True,
             "message": "分享链接更新成功"
         }
-        
+    
     except Exception as e:
         return {
             "success": False,
@@ -393,10 +411,7 @@ async def delete_share(
     db: Session = Depends(get_db)
 ):
     """删除分享链接"""
-    share_link = db.query(ShareLink).filter(
-        ShareLink.share_id == share_id,
-        ShareLink.creator_id == current_user.id
-    ).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id, current_user.id)
     
     if not share_link:
         raise HTTPException(status_code=404, detail="分享链接不存在")
@@ -409,7 +424,7 @@ async def delete_share(
             "success": True,
             "message": "分享链接已删除"
         }
-        
+    
     except Exception as e:
         return {
             "success": False,
@@ -424,10 +439,7 @@ async def get_share_info(
     db: Session = Depends(get_db)
 ):
     """获取分享链接信息"""
-    share_link = db.query(ShareLink).filter(
-        ShareLink.share_id == share_id,
-        ShareLink.creator_id == current_user.id
-    ).first()
+    share_link = await run_in_db_pool(_find_share_link, db, share_id, current_user.id)
     
     if not share_link:
         raise HTTPException(status_code=404, detail="分享链接不存在")
@@ -10,7 +10,9 @@ from app.database import get_db
 from app.models.user import User
 from app.models.file import FileNode
 from app.services.file_service import FileService
+from app.services.job_service import JobService
 from app.utils.auth import get_current_user
+from app.utils.executors import run_in_disk_pool, run_in_db_pool
 from app.utils.file_utils import get_file_icon, can_preview, format_file_size
 from app.schemas.file import FileNodeResponse, DirectoryListResponse
 from app.config import TRASH_RETENTION_DAYS
@@ -18,15 +20,10 @@ from app.config import TRASH_RETENTION_DAYS
 router = APIRouter()
 
 
-@router.get("/list", response_model=DirectoryListResponse)
-async def list_trash(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """获取回收站文件列表"""
-    # 查询用户顶级删除的文件（只显示没有被删除父目录的项目）
+def _get_top_level_deleted(db: Session, user: User) -> List[FileNode]:
+    """查询用户顶级删除的文件（只返回没有被删除父目录的项目），按删除时间倒序"""
     deleted_files = db.query(FileNode).filter(
-        FileNode.owner_id == current_user.id,
+        FileNode.owner_id == user.id,
         FileNode.is_deleted == True
     ).all()
     
@@ -47,7 +44,16 @@ async def list_trash(
     
     # 按删除时间排序
     top_level_deleted.sort(key=lambda x: x.deleted_at, reverse=True)
-    deleted_files = top_level_deleted
+    return top_level_deleted
+
+
+@router.get("/list", response_model=DirectoryListResponse)
+async def list_trash(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取回收站文件列表"""
+    deleted_files = await run_in_db_pool(_get_top_level_deleted, db, current_user)
     
     # 转换为响应模型
     file_service = FileService(db)
@@ -84,7 +90,7 @@ async def restore_file(
     """从回收站恢复文件"""
     try:
         file_service = FileService(db)
-        node = file_service.get_node_by_id(node_id, current_user, include_deleted=True)
+        node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user, include_deleted=True)
         
         if not node:
             raise HTTPException(status_code=404, detail="文件不存在")
@@ -92,7 +98,7 @@ async def restore_file(
         if not node.is_deleted:
             raise HTTPException(status_code=400, detail="文件不在回收站中")
         
-        if file_service.restore_from_trash(node):
+        if await run_in_disk_pool(file_service.restore_from_trash, node):
             return {
                 "success": True,
                 "message": f"'{node.name}' 恢复成功"
@@ -118,7 +124,7 @@ async def permanent_delete(
     """永久删除文件"""
     try:
         file_service = FileService(db)
-        node = file_service.get_node_by_id(node_id, current_user, include_deleted=True)
+        node = await run_in_db_pool(file_service.get_node_by_id, node_id, current_user, include_deleted=True)
         
         if not node:
             raise HTTPException(status_code=404, detail="文件不存在")
@@ -126,7 +132,7 @@ async def permanent_delete(
         if not node.is_deleted:
             raise HTTPException(status_code=400, detail="文件不在回收站中")
         
-        if file_service.permanent_delete(node):
+        if await run_in_db_pool(file_service.permanent_delete, node):
             return {
                 "success": True,
                 "message": f"'{node.name}' 已永久删除"
@@ -150,36 +156,14 @@ async def empty_trash(
 ):
     """清空回收站"""
     try:
-        file_service = FileService(db)
+        # 交给后台任务删除，通过 /jobs/{job_id} 查询进度
+        job = await run_in_db_pool(JobService(db).create_job, current_user, 'purge_trash')
         
-        # 获取所有已删除的文件
-        deleted_files = db.query(FileNode).filter(
-            FileNode.owner_id == current_user.id,
-            FileNode.is_deleted == True
-        ).all()
-        
-        success_count = 0
-        error_count = 0
-        
-        for node in deleted_files:
-            try:
-                if file_service.permanent_delete(node):
-                    success_count += 1
-                else:
-                    error_count += 1
-            except Exception:
-                error_count += 1
-        
-        if error_count == 0:
-            return {
-                "success": True,
-                "message": f"回收站已清空，删除了 {success_count} 个项目"
-            }
-        else:
-            return {
-                "success": True,
-                "message": f"回收站清理完成，删除了 {success_count} 个项目，{error_count} 个项目删除失败"
-            }
+        return {
+            "success": True,
+            "message": "正在清空回收站",
+            "job_id": job.id
+        }
             
     except Exception as e:
         return {
@@ -195,40 +179,20 @@ async def auto_clean_trash(
 ):
     """自动清理过期文件"""
     try:
-        file_service = FileService(db)
-        
         # 计算过期时间
         expire_date = datetime.utcnow() - timedelta(days=TRASH_RETENTION_DAYS)
         
-        # 查询过期的已删除文件
-        expired_files = db.query(FileNode).filter(
-            FileNode.owner_id == current_user.id,
-            FileNode.is_deleted == True,
-            FileNode.deleted_at <= expire_date
-        ).all()
-        
-        success_count = 0
-        error_count = 0
+        # 交给后台任务删除过期文件，通过 /jobs/{job_id} 查询进度
+        job = await run_in_db_pool(
+            JobService(db).create_job,
+            current_user, 'purge_trash', {'deleted_before': expire_date.isoformat()}
+        )
         
-        for node in expired_files:
-            try:
-                if file_service.permanent_delete(node):
-                    success_count += 1
-                else:
-                    error_count += 1
-            except Exception:
-                error_count += 1
-        
-        if success_count > 0:
-            return {
-                "success": True,
-                "message": f"自动清理完成，删除了 {success_count} 个过期文件"
-            }
-        else:
-            return {
-                "success": True,
-                "message": "没有过期文件需要清理"
-            }
+        return {
+            "success": True,
+            "message": "正在清理过期文件",
+            "job_id": job.id
+        }
             
     except Exception as e:
         return {
@@ -55,6 +55,7 @@ class FileNodeResponse(BaseModel):
     deleted_at: Optional[datetime] = None
     can_preview: bool = False
     icon: str = "📄"
+    has_thumbnail: bool = False
     # 回收站相关字段
     days_remaining: Optional[int] = None
     will_delete_at: Optional[str] = None
@@ -97,8 +98,15 @@ class RenameRequest(BaseModel):
 
 class MoveRequest(BaseModel):
     """移动请求"""
+    node_ids: List[int]  # 要移动的文件/目录ID
     target_path: str
     
+    @validator('node_ids')
+    def validate_node_ids(cls, v):
+        if not v:
+            raise ValueError('文件ID列表不能为空')
+        return list(dict.fromkeys(v))  # 去重并保持顺序
+    
     @validator('target_path')
     def validate_path(cls, v):
         if not v or not v.strip():
@@ -167,10 +175,13 @@ class ChunkUploadInitRequest(BaseModel):
     """分片上传初始化请求"""
     filename: str
     file_size: int
-    chunk_size: int
+    chunk_size: Optional[int] = None  # 不指定时由服务器推荐
     path: str = "/"
-    file_hash: Optional[str] = None  # 文件MD5哈希，用于校验
+    file_hash: Optional[str] = None  # 文件哈希，用于校验；blake2b 哈希还可用于秒传
+    hash_algorithm: str = "md5"  # 文件和分片哈希算法：md5 或 blake2b
     file_metadata: Optional[FileMetadata] = None  # 文件元数据
+    instant_token: Optional[str] = None  # 秒传：上次初始化返回的挑战令牌
+    instant_proof: Optional[str] = None  # 秒传：对挑战范围计算的持有证明
     
     @validator('filename')
     def validate_filename(cls, v):
@@ -185,6 +196,13 @@ class ChunkUploadInitRequest(BaseModel):
         
         return v.strip()
     
+    @validator('hash_algorithm')
+    def validate_hash_algorithm(cls, v):
+        v = (v or 'md5').strip().lower()
+        if v not in ('md5', 'blake2b'):
+            raise ValueError('哈希算法只支持 md5 或 blake2b')
+        return v
+    
     @validator('file_size')
     def validate_file_size(cls, v):
         if v <= 0:
@@ -195,6 +213,8 @@ class ChunkUploadInitRequest(BaseModel):
     
     @validator('chunk_size')
     def validate_chunk_size(cls, v):
+        if v is None:
+            return v
         if v <= 0:
             raise ValueError('分片大小必须大于0')
         if v > 50 * 1024 * 1024:  # 限制50MB per chunk
@@ -209,13 +229,19 @@ class ChunkUploadInitResponse(BaseModel):
     upload_id: Optional[str] = None
     total_chunks: Optional[int] = None
     uploaded_chunks: Optional[List[int]] = None  # 已上传的分片索引
+    hash_algorithm: Optional[str] = None  # 本次上传使用的哈希算法
+    chunk_size: Optional[int] = None  # 本次上传使用的分片大小
+    max_concurrency: Optional[int] = None  # 建议同时上传的分片数
+    instant: bool = False  # 服务器已有相同内容，文件已直接创建（秒传）
+    instant_challenge: Optional[dict] = None  # 服务器已有相同内容，需要提交持有证明才能秒传
+    file_info: Optional[dict] = None  # 秒传成功时的文件信息
 
 
 class ChunkUploadRequest(BaseModel):
     """分片上传请求"""
     upload_id: str
     chunk_index: int
-    chunk_hash: Optional[str] = None  # 分片MD5哈希
+    chunk_hash: Optional[str] = None  # 分片哈希，算法与初始化时一致
     
     @validator('chunk_index')
     def validate_chunk_index(cls, v):
@@ -0,0 +1,182 @@
+"""
+数据块存储服务
+"""
+
+import os
+import uuid
+import hashlib
+import mimetypes
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.blob import Blob
+from app.services.storage_backend import StorageBackend, get_storage_backend
+from app.utils.compression import ENCODING_GZIP_FRAMES, try_compress_file
+from app.database import SQL_IN_BATCH_SIZE, batched
+import magic
+
+# 数据块按内容哈希去重，使用抗碰撞的BLAKE2b而不是MD5
+CONTENT_HASH_ALGORITHM = 'blake2b'
+
+
+def new_content_hasher():
+    """创建用于计算内容哈希的哈希对象"""
+    return hashlib.new(CONTENT_HASH_ALGORITHM)
+
+
+def detect_mime_type(head: bytes, file_name: str) -> Optional[str]:
+    """根据文件开头的数据检测MIME类型"""
+    try:
+        return magic.from_buffer(head, mime=True)
+    except Exception:
+        # 如果magic失败，使用mimetypes模块
+        mime_type, _ = mimetypes.guess_type(file_name)
+        return mime_type
+
+
+class BlobService:
+    """数据块存储服务类
+    
+    相同内容（哈希和大小都相同）只保存一份物理文件，
+    文件节点通过引用计数共享数据块。新数据块写入默认的存储后端。
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.storage = get_storage_backend()
+    
+    def find_blob(self, content_hash: str, size: int) -> Optional[Blob]:
+        """根据内容哈希和大小查找数据块"""
+        return self.db.query(Blob).filter(
+            Blob.content_hash == content_hash.lower(),
+            Blob.size == size
+        ).first()
+    
+    def acquire(self, blob: Blob) -> bool:
+        """增加数据块的引用计数，数据块已被回收时返回False"""
+        result = self.db.execute(
+            update(Blob).where(Blob.id == blob.id).values(ref_count=Blob.ref_count + 1)
+        )
+        return result.rowcount == 1
+    
+    def _add_blob(self, blob: Blob) -> Tuple[Blob, bool]:
+        """插入新的数据块记录，返回值与 store_file 相同
+        
+        查找和插入之间相同内容的数据块可能已被并发的上传插入，
+        此时唯一索引拒绝插入，改为引用已有的数据块。
+        """
+        try:
+            with self.db.begin_nested():
+                self.db.add(blob)
+        except IntegrityError:
+            existing = self.find_blob(blob.content_hash, blob.size)
+            if existing is None or not self.acquire(existing):
+                raise
+            return existing, False
+        return blob, True
+    
+    def store_file(self, source_path: str, content_hash: str, size: int,
+                   head: bytes, file_name: str) -> Tuple[Blob, bool]:
+        """将已落盘的文件保存为数据块
+        
+        内容已存在时直接复用并删除源文件，否则把源文件移入存储后端；
+        文本类文件压缩效果明显时以可按范围读取的压缩格式存放。
+        返回的数据块已计入一次引用，调用方负责提交事务；
+        第二个返回值表示是否新建了数据块。
+        """
+        blob = self.find_blob(content_hash, size)
+        if blob and self.acquire(blob):
+            os.remove(source_path)
+            return blob, False
+        
+        blob = Blob(
+            content_hash=content_hash.lower(),
+            size=size,
+            mime_type=detect_mime_type(head, file_name),
+            storage_key=uuid.uuid4().hex,
+            backend=self.storage.name,
+            ref_count=1
+        )
+        compressed = try_compress_file(source_path, file_name, blob.mime_type, size)
+        if compressed:
+            compressed_path, blob.encoded_size = compressed
+            blob.encoding = ENCODING_GZIP_FRAMES
+            try:
+                self.storage.put_file(compressed_path, blob.storage_key)
+            except BaseException:
+                if os.path.exists(compressed_path):
+                    os.remove(compressed_path)
+                raise
+            os.remove(source_path)
+        else:
+            self.storage.put_file(source_path, blob.storage_key)
+        
+        stored, created = self._add_blob(blob)
+        if not created:
+            self.storage.delete(blob.storage_key)
+        return stored, created
+    
+    def store_object(self, storage: StorageBackend, storage_key: str, content_hash: str, size: int,
+                     head: bytes, file_name: str) -> Tuple[Blob, bool]:
+        """将已写入存储后端的内容登记为数据块，例如通过分片直接上传到对象存储的文件
+        
+        内容已存在时直接复用并删除刚写入的对象。返回值与 store_file 相同。
+        """
+        blob = self.find_blob(content_hash, size)
+        if blob and self.acquire(blob):
+            storage.delete(storage_key)
+            return blob, False
+        
+        blob = Blob(
+            content_hash=content_hash.lower(),
+            size=size,
+            mime_type=detect_mime_type(head, file_name),
+            storage_key=storage_key,
+            backend=storage.name,
+            ref_count=1
+        )
+        stored, created = self._add_blob(blob)
+        if not created:
+            storage.delete(storage_key)
+        return stored, created
+    
+    def release(self, blob_ids: Iterable[int]) -> List[Tuple[str, str]]:
+        """减少数据块的引用计数，删除不再被引用的数据块记录
+        
+        引用次数相同的数据块合并为一条 UPDATE ... IN 语句。
+        返回需要删除的（存储后端，存储标识），调用方应在事务提交后用 delete_contents 删除。
+        """
+        counts = Counter(blob_id for blob_id in blob_ids if blob_id is not None)
+        if not counts:
+            return []
+        
+        ids_by_count = {}
+        for blob_id, count in counts.items():
+            ids_by_count.setdefault(count, []).append(blob_id)
+        for count, ids in ids_by_count.items():
+            for batch in batched(ids, SQL_IN_BATCH_SIZE):
+                self.db.execute(
+                    update(Blob).where(Blob.id.in_(batch)).values(ref_count=Blob.ref_count - count)
+                )
+        
+        contents = []
+        for batch in batched(list(counts), SQL_IN_BATCH_SIZE):
+            orphans = self.db.query(Blob.id, Blob.backend, Blob.storage_key).filter(
+                Blob.id.in_(batch),
+                Blob.ref_count <= 0
+            ).all()
+            if orphans:
+                contents.extend((orphan.backend, orphan.storage_key) for orphan in orphans)
+                self.db.execute(delete(Blob).where(Blob.id.in_([orphan.id for orphan in orphans])))
+        return contents
+    
+    @staticmethod
+    def delete_contents(contents: Iterable[Tuple[str, str]]):
+        """从存储后端删除数据块内容"""
+        for backend, storage_key in contents:
+            try:
+                get_storage_backend(backend).delete(storage_key)
+            except Exception as e:
+                print(f"Warning: Failed to remove blob {backend}:{storage_key}: {e}")
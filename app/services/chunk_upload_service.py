@@ -4,177 +4,373 @@
 
 import os
 import uuid
+import hmac
 import hashlib
-import json
-import tempfile
+import secrets
 import shutil
+import threading
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+from sqlalchemy import delete, or_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
+from app.config import (
+    UPLOAD_TMP_DIR, CHUNK_SIZE_MIN, CHUNK_SIZE_MAX, CHUNK_TARGET_COUNT,
+    CHUNK_MAX_CONCURRENCY, CHUNK_SERVER_CONCURRENCY, CHUNK_ACTIVE_WINDOW_SECONDS,
+    INSTANT_UPLOAD_PROOF_SIZE
+)
+from app.models.upload import UploadSession, UploadChunk
 from app.models.user import User
 from app.services.file_service import FileService
+from app.services.blob_service import CONTENT_HASH_ALGORITHM, new_content_hasher
+from app.services.storage_backend import StorageBackend, get_storage_backend
 from app.utils.file_utils import sanitize_filename, is_safe_path
+from app.utils.auth import create_instant_upload_token, verify_instant_upload_token
+
+# 分片直接写入的目标文件名
+DATA_FILE_NAME = "data"
+# 校验文件哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# 支持的文件哈希算法：md5 兼容现有客户端，blake2b 更快
+SUPPORTED_HASH_ALGORITHMS = ('md5', 'blake2b')
+# 乱序到达、暂未计入哈希的分片在内存中缓存的上限，超出部分完成时从目标文件回读；
+# 分片直接写入存储后端时无法回读单个分片，超出后改为完成时全量计算
+HASH_PENDING_BUFFER_LIMIT = 64 * 1024 * 1024
+# 所有上传会话缓存的乱序分片的总上限，超出后新的乱序分片按单个会话超限的方式处理
+HASH_PENDING_TOTAL_LIMIT = 256 * 1024 * 1024
+
+
+def new_hasher(algorithm: str):
+    """创建指定算法的哈希对象"""
+    if algorithm not in SUPPORTED_HASH_ALGORITHMS:
+        raise ValueError(f"不支持的哈希算法: {algorithm}")
+    return hashlib.new(algorithm)
+
+
+class _UploadHashState:
+    """上传会话的增量哈希状态
+    
+    连续到达的分片立即计入哈希；乱序到达的分片按索引缓存，
+    待前面的分片到齐后再依次计入，完成上传时无需重新读取文件。
+    除客户端指定的校验算法外，始终同时计算用于去重的内容哈希。
+    """
+    
+    def __init__(self, algorithm: str):
+        self.lock = threading.Lock()
+        self.hashers = {name: new_hasher(name) for name in (algorithm, CONTENT_HASH_ALGORITHM)}
+        self.next_index = 0
+        # 分片索引 -> 缓存的数据（None 表示需要从目标文件回读）
+        self.pending: Dict[int, Optional[bytes]] = {}
+        self.pending_bytes = 0
+        # 已计入哈希的分片被重新上传时，增量结果不再可信
+        self.stale = False
+    
+    def update(self, data: bytes):
+        """将数据计入所有哈希"""
+        for hasher in self.hashers.values():
+            hasher.update(data)
+    
+    def hexdigests(self) -> Dict[str, str]:
+        """获取所有哈希的结果"""
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+
+# 进程内的增量哈希状态，进程重启后丢失时完成上传会退化为全量计算
+_hash_states: Dict[str, _UploadHashState] = {}
+_hash_states_lock = threading.Lock()
+# 所有会话缓存的乱序分片的总字节数
+_pending_bytes_total = 0
+
+
+def _reserve_pending(size: int) -> bool:
+    """从全局缓存预算中占用 size 字节，预算不足时返回 False"""
+    global _pending_bytes_total
+    with _hash_states_lock:
+        if _pending_bytes_total + size > HASH_PENDING_TOTAL_LIMIT:
+            return False
+        _pending_bytes_total += size
+        return True
+
+
+def _release_pending(size: int):
+    """归还占用的全局缓存预算"""
+    global _pending_bytes_total
+    if size:
+        with _hash_states_lock:
+            _pending_bytes_total -= size
 
 
 class ChunkUploadService:
-    """分片上传服务"""
+    """分片上传服务
+    
+    默认存储后端支持分片写入（如S3）时，每个分片直接作为后端的一个分片上传，
+    不在本地暂存；否则分片按偏移量写入本地暂存文件，完成时移入数据块目录。
+    """
     
     def __init__(self, db: Session):
         self.db = db
         self.file_service = FileService(db)
-        # 使用临时目录存储分片上传信息
-        self.upload_dir = os.path.join(tempfile.gettempdir(), "netdisk_uploads")
+        self.storage = self.file_service.blob_service.storage
+        # 暂存目录与存储目录在同一文件系统，完成上传时只需重命名
+        self.upload_dir = str(UPLOAD_TMP_DIR)
         os.makedirs(self.upload_dir, exist_ok=True)
     
+    def recommend_chunk_size(self, file_size: int) -> int:
+        """根据文件大小推荐分片大小（按MB取整）"""
+        unit = 1024 * 1024
+        chunk_size = (file_size + CHUNK_TARGET_COUNT - 1) // CHUNK_TARGET_COUNT
+        chunk_size = (chunk_size + unit - 1) // unit * unit
+        chunk_size = max(CHUNK_SIZE_MIN, min(CHUNK_SIZE_MAX, chunk_size))
+        if self.storage.supports_multipart and file_size > chunk_size:
+            # 除最后一个外，后端的每个分片都不能小于最小分片大小
+            chunk_size = max(chunk_size, self.storage.min_part_size)
+        return chunk_size
+    
+    def recommend_concurrency(self, total_chunks: int) -> int:
+        """根据当前活跃的上传会话数推荐单个上传的并发分片数"""
+        active_since = datetime.utcnow() - timedelta(seconds=CHUNK_ACTIVE_WINDOW_SECONDS)
+        active_uploads = self.db.query(UploadSession).filter(
+            UploadSession.status == 'uploading',
+            UploadSession.updated_at >= active_since
+        ).count()
+        
+        # 服务器的并发预算由活跃上传平分
+        share = CHUNK_SERVER_CONCURRENCY // max(1, active_uploads)
+        return max(1, min(CHUNK_MAX_CONCURRENCY, share, total_chunks))
+    
     def init_chunk_upload(self, filename: str, file_size: int, chunk_size: int, 
                          path: str, user: User, file_hash: Optional[str] = None, 
-                         file_metadata: Optional[dict] = None) -> Tuple[str, int, List[int]]:
+                         file_metadata: Optional[dict] = None,
+                         hash_algorithm: str = 'md5') -> Tuple[str, int, List[int]]:
         """初始化分片上传"""
+        if hash_algorithm not in SUPPORTED_HASH_ALGORITHMS:
+            raise ValueError(f"不支持的哈希算法: {hash_algorithm}")
+        
         # 生成上传ID
         upload_id = str(uuid.uuid4())
         
         # 计算总分片数
         total_chunks = (file_size + chunk_size - 1) // chunk_size
         
-        # 创建上传目录
-        upload_path = os.path.join(self.upload_dir, upload_id)
-        os.makedirs(upload_path, exist_ok=True)
-        
-        # 保存上传元数据
-        metadata = {
-            "upload_id": upload_id,
-            "filename": sanitize_filename(filename),
-            "file_size": file_size,
-            "chunk_size": chunk_size,
-            "total_chunks": total_chunks,
-            "path": path,
-            "user_id": user.id,
-            "file_hash": file_hash,
-            "created_at": datetime.now().isoformat(),
-            "uploaded_chunks": [],
-            "status": "uploading",
-            "file_metadata": file_metadata  # 保存原始文件元数据
-        }
-        
-        metadata_file = os.path.join(upload_path, "metadata.json")
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        storage_key = multipart_id = None
+        if self.storage.supports_multipart:
+            if total_chunks > 1 and chunk_size < self.storage.min_part_size:
+                raise ValueError(f"分片大小不能小于 {self.storage.min_part_size} 字节")
+            # 在存储后端创建分片上传，分片直接写入后端
+            storage_key = uuid.uuid4().hex
+            multipart_id = self.storage.create_multipart(storage_key)
+        else:
+            # 创建上传目录
+            upload_path = os.path.join(self.upload_dir, upload_id)
+            os.makedirs(upload_path, exist_ok=True)
+            
+            # 预分配目标文件，分片按偏移量直接写入
+            self._preallocate(os.path.join(upload_path, DATA_FILE_NAME), file_size)
+        
+        # 保存上传会话
+        upload = UploadSession(
+            id=upload_id,
+            user_id=user.id,
+            filename=sanitize_filename(filename),
+            path=path,
+            file_size=file_size,
+            chunk_size=chunk_size,
+            total_chunks=total_chunks,
+            file_hash=file_hash,
+            hash_algorithm=hash_algorithm,
+            status='uploading',
+            storage_backend=self.storage.name if multipart_id else None,
+            storage_key=storage_key,
+            multipart_id=multipart_id
+        )
+        upload.file_metadata = file_metadata  # 保存原始文件元数据
+        self.db.add(upload)
+        self.db.commit()
+        
+        with _hash_states_lock:
+            _hash_states[upload_id] = _UploadHashState(hash_algorithm)
         
         return upload_id, total_chunks, []
     
+    def instant_upload_challenge(self, file_size: int, user: User, file_hash: Optional[str],
+                                 hash_algorithm: str) -> Optional[dict]:
+        """服务器上已有相同内容时，生成秒传的持有证明挑战
+        
+        只知道文件哈希不能证明持有内容，客户端还需要对服务器随机选择的一段内容
+        计算 BLAKE2b(nonce + 内容) 作为证明。只接受抗碰撞的内容哈希，
+        MD5 可被构造碰撞。没有相同内容时返回 None。
+        """
+        if not file_hash or hash_algorithm != CONTENT_HASH_ALGORITHM:
+            return None
+        if not self.file_service.blob_service.find_blob(file_hash, file_size):
+            return None
+        
+        length = min(INSTANT_UPLOAD_PROOF_SIZE, file_size)
+        challenge = {
+            "hash": file_hash.lower(),
+            "size": file_size,
+            "offset": secrets.randbelow(file_size - length + 1),
+            "length": length,
+            "nonce": secrets.token_hex(16),
+        }
+        token = create_instant_upload_token(user.username, challenge)
+        return {
+            "token": token,
+            "offset": challenge["offset"],
+            "length": challenge["length"],
+            "nonce": challenge["nonce"],
+        }
+    
+    def try_instant_upload(self, filename: str, file_size: int, path: str, user: User,
+                           token: str, proof: str,
+                           file_metadata: Optional[dict] = None) -> Optional[dict]:
+        """尝试秒传：验证持有证明后直接引用已有内容创建文件，不需要上传分片
+        
+        返回新文件的信息；令牌无效、证明不正确或内容已被回收时返回 None，按普通上传处理。
+        """
+        challenge = verify_instant_upload_token(token, user.username)
+        if not challenge or challenge["size"] != file_size:
+            return None
+        
+        blob = self.file_service.blob_service.find_blob(challenge["hash"], file_size)
+        if not blob:
+            return None
+        
+        hasher = new_content_hasher()
+        hasher.update(bytes.fromhex(challenge["nonce"]))
+        if challenge["length"]:
+            start = challenge["offset"]
+            for block in blob.storage.iter_range(blob.storage_key, start, start + challenge["length"] - 1):
+                hasher.update(block)
+        if not hmac.compare_digest(hasher.hexdigest(), (proof or "").lower()):
+            return None
+        
+        file_path = os.path.join(path, sanitize_filename(filename))
+        try:
+            file_node = self.file_service.create_file_from_blob(file_path, blob, user, file_metadata)
+        except ValueError as e:
+            if str(e) == "数据块不存在":
+                # 数据块刚好被回收，按普通上传处理
+                return None
+            raise
+        return self.file_service.get_node_info(file_node)
+    
     def upload_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, 
                     user: User, chunk_hash: Optional[str] = None) -> bool:
-        """上传单个分片"""
-        upload_path = os.path.join(self.upload_dir, upload_id)
-        metadata_file = os.path.join(upload_path, "metadata.json")
+        """上传单个分片
         
-        if not os.path.exists(metadata_file):
-            raise ValueError("上传会话不存在")
+        分片写入目标文件的固定偏移量，登记时只插入一行分片记录并原子地累加计数，
+        同一会话的多个分片可以并发上传。
+        """
+        upload = self._get_upload(upload_id, user)
         
-        # 读取元数据
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-        
-        # 验证用户权限
-        if metadata["user_id"] != user.id:
-            raise ValueError("无权限访问此上传会话")
+        if upload.status != 'uploading':
+            raise ValueError("上传会话已结束")
         
         # 检查分片索引
-        if chunk_index < 0 or chunk_index >= metadata["total_chunks"]:
+        if chunk_index < 0 or chunk_index >= upload.total_chunks:
             raise ValueError("分片索引无效")
         
         # 验证分片哈希（如果提供）
         if chunk_hash:
-            actual_hash = hashlib.md5(chunk_data).hexdigest()
+            actual_hash = hashlib.new(upload.hash_algorithm, chunk_data).hexdigest()
             if actual_hash != chunk_hash:
                 raise ValueError("分片数据校验失败")
         
-        # 保存分片
-        chunk_file = os.path.join(upload_path, f"chunk_{chunk_index}")
-        with open(chunk_file, 'wb') as f:
-            f.write(chunk_data)
-        
-        # 更新元数据
-        if chunk_index not in metadata["uploaded_chunks"]:
-            metadata["uploaded_chunks"].append(chunk_index)
-        metadata["uploaded_chunks"].sort()
-        
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        # 检查分片大小（只有最后一个分片可以小于分片大小）
+        offset = chunk_index * upload.chunk_size
+        expected_size = min(upload.chunk_size, upload.file_size - offset)
+        if len(chunk_data) != expected_size:
+            raise ValueError(f"分片大小不正确: 期望 {expected_size}, 实际 {len(chunk_data)}")
+        
+        if upload.multipart_id:
+            # 分片编号从1开始，重传的分片覆盖后端中的同一分片
+            self._upload_storage(upload).upload_part(
+                upload.storage_key, upload.multipart_id, chunk_index + 1, chunk_data
+            )
+        else:
+            # 按偏移量写入目标文件
+            self._write_at(os.path.join(self.upload_dir, upload_id, DATA_FILE_NAME), offset, chunk_data)
+        
+        # 推进增量哈希
+        self._advance_hash(upload, chunk_index, chunk_data)
+        
+        # 登记分片：重复上传的分片不会重复计数
+        inserted = self.db.execute(
+            sqlite_insert(UploadChunk)
+            .values(upload_id=upload_id, chunk_index=chunk_index)
+            .on_conflict_do_nothing()
+        )
+        if inserted.rowcount:
+            self.db.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload_id)
+                .values(uploaded_count=UploadSession.uploaded_count + 1,
+                        updated_at=datetime.utcnow())
+            )
+        self.db.commit()
         
         return True
     
     def complete_chunk_upload(self, upload_id: str, user: User, 
                             file_hash: Optional[str] = None) -> dict:
-        """完成分片上传，合并文件"""
-        upload_path = os.path.join(self.upload_dir, upload_id)
-        metadata_file = os.path.join(upload_path, "metadata.json")
+        """完成分片上传"""
+        upload = self._get_upload(upload_id, user)
         
-        if not os.path.exists(metadata_file):
-            raise ValueError("上传会话不存在")
+        if upload.status != 'uploading':
+            raise ValueError("上传会话已结束")
         
-        # 读取元数据
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        # 检查所有分片是否都已上传
+        if upload.uploaded_count != upload.total_chunks:
+            uploaded = set(self._uploaded_chunk_indexes(upload_id))
+            missing_chunks = [i for i in range(upload.total_chunks) if i not in uploaded]
+            raise ValueError(f"缺少分片: {missing_chunks}")
         
-        # 验证用户权限
-        if metadata["user_id"] != user.id:
-            raise ValueError("无权限访问此上传会话")
+        if upload.multipart_id:
+            return self._complete_multipart_upload(upload, user, file_hash)
         
-        # 检查所有分片是否都已上传
-        expected_chunks = list(range(metadata["total_chunks"]))
-        if set(metadata["uploaded_chunks"]) != set(expected_chunks):
-            missing_chunks = set(expected_chunks) - set(metadata["uploaded_chunks"])
-            raise ValueError(f"缺少分片: {list(missing_chunks)}")
-        
-        # 合并分片
-        temp_file = os.path.join(upload_path, "merged_file")
-        with open(temp_file, 'wb') as output_file:
-            for chunk_index in range(metadata["total_chunks"]):
-                chunk_file = os.path.join(upload_path, f"chunk_{chunk_index}")
-                if os.path.exists(chunk_file):
-                    with open(chunk_file, 'rb') as chunk_f:
-                        output_file.write(chunk_f.read())
-                else:
-                    raise ValueError(f"分片文件缺失: chunk_{chunk_index}")
+        # 分片已按偏移量写入目标文件，无需合并
+        upload_path = os.path.join(self.upload_dir, upload_id)
+        data_file = os.path.join(upload_path, DATA_FILE_NAME)
+        if not os.path.exists(data_file):
+            raise ValueError("上传数据文件缺失")
         
-        # 验证合并后的文件大小
-        merged_size = os.path.getsize(temp_file)
-        if merged_size != metadata["file_size"]:
-            raise ValueError(f"合并后文件大小不匹配: 期望 {metadata['file_size']}, 实际 {merged_size}")
+        # 验证文件大小
+        data_size = os.path.getsize(data_file)
+        if data_size != upload.file_size:
+            raise ValueError(f"文件大小不匹配: 期望 {upload.file_size}, 实际 {data_size}")
         
-        # 验证文件哈希（如果提供）
-        if file_hash or metadata.get("file_hash"):
-            with open(temp_file, 'rb') as f:
-                actual_hash = hashlib.md5(f.read()).hexdigest()
-            expected_hash = file_hash or metadata["file_hash"]
-            if actual_hash != expected_hash:
-                raise ValueError("文件完整性校验失败")
+        # 验证文件哈希（如果提供），内容哈希同时用于去重
+        digests = self._finish_hashes(upload, data_file)
+        expected_hash = file_hash or upload.file_hash
+        if expected_hash and digests[upload.hash_algorithm] != expected_hash.lower():
+            raise ValueError("文件完整性校验失败")
+        
+        self._claim_completion(upload_id)
         
         # 保存到文件系统
         try:
-            with open(temp_file, 'rb') as f:
-                file_content = f.read()
-            
             # 构建文件路径
-            file_path = os.path.join(metadata["path"], metadata["filename"])
+            file_path = os.path.join(upload.path, upload.filename)
             
             # 确保目录存在
             dir_path = os.path.dirname(file_path)
             if dir_path and dir_path != '/':
                 self.file_service.ensure_directory_exists(dir_path, user)
             
-            # 保存文件
-            file_node = self.file_service.save_uploaded_file(file_path, file_content, user, metadata.get('file_metadata'))
-            
-            # 更新元数据状态
-            metadata["status"] = "completed"
-            metadata["completed_at"] = datetime.now().isoformat()
-            metadata["file_id"] = file_node.id
+            # 保存文件（重命名到数据块目录，不复制数据；内容已存在时直接复用）
+            file_node = self.file_service.save_uploaded_file_from_path(
+                file_path, data_file, user, upload.file_metadata,
+                content_hash=digests[CONTENT_HASH_ALGORITHM]
+            )
             
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            # 更新会话状态
+            self.db.refresh(upload)
+            upload.status = 'completed'
+            upload.finished_at = datetime.utcnow()
+            upload.file_id = file_node.id
+            self.db.commit()
             
             # 获取文件信息
             file_info = self.file_service.get_node_info(file_node)
@@ -183,76 +379,301 @@ class ChunkUploadService:
             self._schedule_cleanup(upload_path)
             
             return file_info
-            
+        
         except Exception as e:
-            # 标记为失败
-            metadata["status"] = "failed"
-            metadata["error"] = str(e)
-            metadata["failed_at"] = datetime.now().isoformat()
+            self._mark_failed(upload, e)
+            raise e
+    
+    def _complete_multipart_upload(self, upload: UploadSession, user: User,
+                                   file_hash: Optional[str] = None) -> dict:
+        """完成直接写入存储后端的分片上传
+        
+        后端合并分片后不能再修改，因此先占用会话再合并，校验失败时删除合并后的对象。
+        """
+        self._claim_completion(upload.id)
+        storage = self._upload_storage(upload)
+        
+        try:
+            try:
+                storage.complete_multipart(upload.storage_key, upload.multipart_id, upload.total_chunks)
+            except Exception:
+                self._abort_multipart(upload)
+                raise
+            
+            try:
+                # 验证文件大小
+                data_size = storage.size(upload.storage_key)
+                if data_size != upload.file_size:
+                    raise ValueError(f"文件大小不匹配: 期望 {upload.file_size}, 实际 {data_size}")
+                
+                # 验证文件哈希（如果提供），内容哈希同时用于去重
+                digests = self._finish_hashes(upload, None)
+                expected_hash = file_hash or upload.file_hash
+                if expected_hash and digests[upload.hash_algorithm] != expected_hash.lower():
+                    raise ValueError("文件完整性校验失败")
+                
+                file_path = os.path.join(upload.path, upload.filename)
+                dir_path = os.path.dirname(file_path)
+                if dir_path and dir_path != '/':
+                    self.file_service.ensure_directory_exists(dir_path, user)
+            except Exception:
+                storage.delete(upload.storage_key)
+                raise
+            
+            # 登记为数据块，之后对象由文件服务负责清理
+            file_node = self.file_service.save_uploaded_object(
+                file_path, storage, upload.storage_key,
+                digests[CONTENT_HASH_ALGORITHM], upload.file_size, user, upload.file_metadata
+            )
             
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            self.db.refresh(upload)
+            upload.status = 'completed'
+            upload.finished_at = datetime.utcnow()
+            upload.file_id = file_node.id
+            self.db.commit()
             
+            self._drop_hash_state(upload.id)
+            return self.file_service.get_node_info(file_node)
+        
+        except Exception as e:
+            self._drop_hash_state(upload.id)
+            self._mark_failed(upload, e)
             raise e
     
+    def _claim_completion(self, upload_id: str):
+        """只有一个请求能把会话切换为完成中，防止重复提交"""
+        claimed = self.db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload_id, UploadSession.status == 'uploading')
+            .values(status='completing', updated_at=datetime.utcnow())
+        )
+        self.db.commit()
+        if not claimed.rowcount:
+            raise ValueError("上传会话已结束")
+    
+    def _mark_failed(self, upload: UploadSession, error: Exception):
+        """将上传会话标记为失败"""
+        self.db.rollback()
+        self.db.refresh(upload)
+        upload.status = 'failed'
+        upload.error = str(error)
+        upload.finished_at = datetime.utcnow()
+        self.db.commit()
+    
+    @staticmethod
+    def _upload_storage(upload: UploadSession) -> StorageBackend:
+        """分片直接写入的存储后端"""
+        return get_storage_backend(upload.storage_backend)
+    
     def get_upload_status(self, upload_id: str, user: User) -> dict:
         """获取上传状态"""
-        upload_path = os.path.join(self.upload_dir, upload_id)
-        metadata_file = os.path.join(upload_path, "metadata.json")
-        
-        if not os.path.exists(metadata_file):
-            raise ValueError("上传会话不存在")
-        
-        # 读取元数据
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-        
-        # 验证用户权限
-        if metadata["user_id"] != user.id:
-            raise ValueError("无权限访问此上传会话")
+        upload = self._get_upload(upload_id, user)
         
         return {
             "upload_id": upload_id,
-            "filename": metadata["filename"],
-            "file_size": metadata["file_size"],
-            "total_chunks": metadata["total_chunks"],
-            "uploaded_chunks": metadata["uploaded_chunks"], 
-            "progress": len(metadata["uploaded_chunks"]) / metadata["total_chunks"] * 100,
-            "status": metadata["status"]
+            "filename": upload.filename,
+            "file_size": upload.file_size,
+            "total_chunks": upload.total_chunks,
+            "uploaded_chunks": self._uploaded_chunk_indexes(upload_id),
+            "progress": upload.uploaded_count / upload.total_chunks * 100,
+            "status": upload.status
         }
     
     def cancel_upload(self, upload_id: str, user: User) -> bool:
         """取消上传"""
-        upload_path = os.path.join(self.upload_dir, upload_id)
-        metadata_file = os.path.join(upload_path, "metadata.json")
-        
-        if not os.path.exists(metadata_file):
+        upload = self.db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+        if not upload:
             return False
         
-        # 读取元数据
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-        
         # 验证用户权限
-        if metadata["user_id"] != user.id:
+        if upload.user_id != user.id:
             raise ValueError("无权限访问此上传会话")
         
         # 标记为取消
-        metadata["status"] = "cancelled"
-        metadata["cancelled_at"] = datetime.now().isoformat()
-        
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        was_uploading = upload.status == 'uploading'
+        upload.status = 'cancelled'
+        upload.finished_at = datetime.utcnow()
+        self.db.commit()
         
         # 清理文件
-        self._schedule_cleanup(upload_path)
+        if upload.multipart_id and was_uploading:
+            self._abort_multipart(upload)
+        self._schedule_cleanup(os.path.join(self.upload_dir, upload_id))
         
         return True
     
+    def _get_upload(self, upload_id: str, user: User) -> UploadSession:
+        """获取上传会话并验证权限"""
+        upload = self.db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+        if not upload:
+            raise ValueError("上传会话不存在")
+        
+        # 验证用户权限
+        if upload.user_id != user.id:
+            raise ValueError("无权限访问此上传会话")
+        
+        return upload
+    
+    def _uploaded_chunk_indexes(self, upload_id: str) -> List[int]:
+        """获取已上传的分片索引（升序）"""
+        rows = self.db.query(UploadChunk.chunk_index).filter(
+            UploadChunk.upload_id == upload_id
+        ).order_by(UploadChunk.chunk_index).all()
+        return [row[0] for row in rows]
+    
+    @staticmethod
+    def _preallocate(data_file: str, file_size: int):
+        """创建目标文件并预分配空间"""
+        fd = os.open(data_file, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, file_size)
+            except (AttributeError, OSError):
+                # 平台或文件系统不支持时退化为稀疏文件
+                os.ftruncate(fd, file_size)
+        finally:
+            os.close(fd)
+    
+    @staticmethod
+    def _write_at(data_file: str, offset: int, data: bytes):
+        """在目标文件的指定偏移量写入数据"""
+        fd = os.open(data_file, os.O_WRONLY)
+        try:
+            view = memoryview(data)
+            while view:
+                if hasattr(os, 'pwrite'):
+                    written = os.pwrite(fd, view, offset)
+                else:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    written = os.write(fd, view)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+    
+    def _advance_hash(self, upload: UploadSession, chunk_index: int, chunk_data: bytes):
+        """将新到达的分片计入增量哈希"""
+        upload_id = upload.id
+        with _hash_states_lock:
+            state = _hash_states.get(upload_id)
+        if state is None:
+            # 进程重启后重建状态：之前写入的分片只能从目标文件回读，
+            # 写入存储后端的分片无法回读，完成时全量计算
+            state = _UploadHashState(upload.hash_algorithm)
+            if upload.multipart_id:
+                state.stale = True
+            for index in self._uploaded_chunk_indexes(upload_id):
+                state.pending[index] = None
+            with _hash_states_lock:
+                state = _hash_states.setdefault(upload_id, state)
+        
+        data_file = os.path.join(self.upload_dir, upload_id, DATA_FILE_NAME)
+        with state.lock:
+            if state.stale:
+                return
+            
+            if chunk_index < state.next_index:
+                # 已计入哈希的分片被重传，完成时改为全量计算
+                self._mark_stale(state)
+                return
+            
+            if chunk_index > state.next_index:
+                # 乱序分片先缓存，会话或全局内存超限时只记录索引
+                if chunk_index not in state.pending:
+                    if (state.pending_bytes + len(chunk_data) <= HASH_PENDING_BUFFER_LIMIT
+                            and _reserve_pending(len(chunk_data))):
+                        state.pending[chunk_index] = chunk_data
+                        state.pending_bytes += len(chunk_data)
+                    elif upload.multipart_id:
+                        self._mark_stale(state)
+                    else:
+                        state.pending[chunk_index] = None
+                return
+            
+            state.update(chunk_data)
+            state.next_index += 1
+            
+            # 依次计入已经到达的后续分片
+            while state.next_index in state.pending:
+                buffered = state.pending.pop(state.next_index)
+                if buffered is None:
+                    buffered = self._read_chunk(data_file, upload, state.next_index)
+                else:
+                    state.pending_bytes -= len(buffered)
+                    _release_pending(len(buffered))
+                state.update(buffered)
+                state.next_index += 1
+    
+    def _finish_hashes(self, upload: UploadSession, data_file: Optional[str]) -> Dict[str, str]:
+        """获取完整文件的校验哈希和内容哈希，增量状态可用时无需读取文件
+        
+        data_file 为空时从存储后端读取已合并的对象。
+        """
+        with _hash_states_lock:
+            state = _hash_states.get(upload.id)
+        
+        if state is not None:
+            with state.lock:
+                if not state.stale and state.next_index == upload.total_chunks:
+                    return state.hexdigests()
+        
+        # 增量状态不可用，分块读取目标文件计算
+        state = _UploadHashState(upload.hash_algorithm)
+        if data_file is None:
+            storage = self._upload_storage(upload)
+            for block in storage.iter_range(upload.storage_key, chunk_size=HASH_CHUNK_SIZE):
+                state.update(block)
+            return state.hexdigests()
+        
+        with open(data_file, 'rb') as f:
+            while True:
+                block = f.read(HASH_CHUNK_SIZE)
+                if not block:
+                    break
+                state.update(block)
+        return state.hexdigests()
+    
+    @staticmethod
+    def _read_chunk(data_file: str, upload: UploadSession, chunk_index: int) -> bytes:
+        """从目标文件中读取指定分片"""
+        offset = chunk_index * upload.chunk_size
+        size = min(upload.chunk_size, upload.file_size - offset)
+        with open(data_file, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+    
+    @staticmethod
+    def _mark_stale(state: _UploadHashState):
+        """放弃增量哈希，释放缓存的分片，完成时全量计算（调用方持有 state.lock）"""
+        state.stale = True
+        state.pending.clear()
+        _release_pending(state.pending_bytes)
+        state.pending_bytes = 0
+    
+    @staticmethod
+    def _drop_hash_state(upload_id: str):
+        """丢弃上传会话的增量哈希状态"""
+        with _hash_states_lock:
+            state = _hash_states.pop(upload_id, None)
+        if state is not None:
+            with state.lock:
+                state.pending.clear()
+                _release_pending(state.pending_bytes)
+                state.pending_bytes = 0
+    
+    def _abort_multipart(self, upload: UploadSession):
+        """放弃存储后端中未完成的分片上传"""
+        self._drop_hash_state(upload.id)
+        try:
+            self._upload_storage(upload).abort_multipart(upload.storage_key, upload.multipart_id)
+        except Exception as e:
+            print(f"Warning: Failed to abort multipart upload {upload.id}: {e}")
+    
     def _schedule_cleanup(self, upload_path: str, delay_minutes: int = 5):
         """安排清理任务（简单实现，实际项目中可以使用任务队列）"""
         # 这里简单实现，直接删除
         # 实际项目中应该使用任务队列或定时任务
+        self._drop_hash_state(os.path.basename(upload_path))
         try:
             if os.path.exists(upload_path):
                 shutil.rmtree(upload_path)
@@ -262,34 +683,33 @@ class ChunkUploadService:
     
     def cleanup_expired_uploads(self, hours: int = 24):
         """清理过期的上传会话"""
-        if not os.path.exists(self.upload_dir):
-            return
-        
-        current_time = datetime.now()
-        cutoff_time = current_time - timedelta(hours=hours)
-        
-        for upload_id in os.listdir(self.upload_dir):
-            upload_path = os.path.join(self.upload_dir, upload_id)
-            metadata_file = os.path.join(upload_path, "metadata.json")
-            
-            if not os.path.exists(metadata_file):
-                continue
-            
-            try:
-                with open(metadata_file, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                
-                created_at = datetime.fromisoformat(metadata["created_at"])
-                status = metadata.get("status", "uploading")
-                
-                # 清理过期的或已完成/失败的上传会话
-                if (created_at < cutoff_time or 
-                    status in ["completed", "failed", "cancelled"]):
-                    shutil.rmtree(upload_path)
-                    
-            except Exception:
-                # 如果元数据文件损坏，直接删除
-                try:
-                    shutil.rmtree(upload_path)
-                except Exception:
-                    pass
\ No newline at end of file
+        cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+        
+        # 清理过期的或已完成/失败的上传会话
+        expired = self.db.query(UploadSession).filter(
+            or_(UploadSession.updated_at < cutoff_time,
+                UploadSession.status.in_(["completed", "failed", "cancelled"]))
+        ).all()
+        expired_ids = [upload.id for upload in expired]
+        
+        for upload in expired:
+            if upload.multipart_id and upload.status == 'uploading':
+                # 过期未完成的分片上传，后端中已上传的分片也要放弃
+                self._abort_multipart(upload)
+            self._schedule_cleanup(os.path.join(self.upload_dir, upload.id))
+        
+        if expired_ids:
+            self.db.execute(delete(UploadChunk).where(UploadChunk.upload_id.in_(expired_ids)))
+            self.db.execute(delete(UploadSession).where(UploadSession.id.in_(expired_ids)))
+            self.db.commit()
+        
+        # 清理没有会话记录的残留目录（跳过刚创建、会话可能尚未提交的目录）
+        if os.path.exists(self.upload_dir):
+            known_ids = {row[0] for row in self.db.query(UploadSession.id).all()}
+            for upload_id in os.listdir(self.upload_dir):
+                upload_path = os.path.join(self.upload_dir, upload_id)
+                if upload_id not in known_ids and \
+                        datetime.utcfromtimestamp(os.path.getmtime(upload_path)) < cutoff_time:
+                    self._schedule_cleanup(upload_path)
+        
+        return len(expired_ids)
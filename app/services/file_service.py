@@ -2,16 +2,29 @@
 文件管理服务
 """
 
+import io
 import os
 import shutil
+import tempfile
 from datetime import datetime
-from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session
+from typing import BinaryIO, Callable, List, Optional
+from sqlalchemy import and_, or_, func, literal, select, update, delete
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, aliased
 from app.models.file import FileNode
 from app.models.user import User
-from app.config import STORAGE_DIR, TRASH_DIR
-import mimetypes
-import magic
+from app.models.blob import Blob
+from app.services.blob_service import BlobService, new_content_hasher
+from app.services.storage_backend import StorageBackend
+from app.services.thumbnail_service import remove_thumbnails
+from app.config import STORAGE_DIR, TRASH_DIR, BLOB_DIR
+from app.utils.path_remover import schedule_call, schedule_removal
+from app.database import SQL_IN_BATCH_SIZE, batched
+
+# 流式保存文件时每次复制的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+# 检测MIME类型时只读取文件开头的这部分数据
+MIME_SNIFF_SIZE = 8192
 
 
 class FileService:
@@ -19,7 +32,8 @@ class FileService:
     
     def __init__(self, db: Session):
         self.db = db
-        
+        self.blob_service = BlobService(db)
+    
     def get_node_by_path(self, path: str, user: User, include_deleted: bool = False) -> Optional[FileNode]:
         """根据路径获取文件节点"""
         query = self.db.query(FileNode).filter(
@@ -31,7 +45,7 @@ class FileService:
             # Windows式回收站：只过滤掉直接被标记为删除的项目
             # 子项目的删除状态继承自父项目
             query = query.filter(FileNode.is_deleted == False)
-            
+        
         return query.first()
     
     def get_node_by_id(self, node_id: int, user: User, include_deleted: bool = False) -> Optional[FileNode]:
@@ -45,7 +59,7 @@ class FileService:
             # Windows式回收站：只过滤掉直接被标记为删除的项目
             # 子项目的删除状态继承自父项目
             query = query.filter(FileNode.is_deleted == False)
-            
+        
         return query.first()
     
     def get_children(self, parent_path: str, user: User, include_deleted: bool = False) -> List[FileNode]:
@@ -73,9 +87,46 @@ class FileService:
         
         if not include_deleted:
             query = query.filter(FileNode.is_deleted == False)
-            
+        
         return query.order_by(FileNode.node_type.desc(), FileNode.name).all()
     
+    def get_subtree(self, node: FileNode, include_deleted: bool = False) -> List[Row]:
+        """用一条递归查询获取节点的所有后代（不含节点本身）
+        
+        沿 parent_id 向下展开；不包含已删除节点时，被删除目录下的内容也一并排除。
+        每行包含 id、parent_id、name、full_path、node_type、file_size、
+        is_deleted、blob_id、owner_id 和数据块的 storage_key、backend、encoding、encoded_size，
+        按 full_path 排序（父目录在前）。
+        """
+        subtree = self._subtree_cte(FileNode.parent_id == node.id, include_deleted)
+        query = (
+            select(subtree, Blob.storage_key, Blob.backend, Blob.encoding, Blob.encoded_size)
+            .outerjoin(Blob, Blob.id == subtree.c.blob_id)
+            .order_by(subtree.c.full_path)
+        )
+        return self.db.execute(query).all()
+    
+    @staticmethod
+    def _subtree_cte(anchor_condition, include_deleted: bool, distinct: bool = False):
+        """构造从满足条件的节点开始、沿 parent_id 向下展开的递归CTE
+        
+        distinct 为真时用 UNION 去重，锚点之间存在嵌套时每个节点只出现一次。
+        """
+        def node_columns(entity):
+            return (entity.id, entity.parent_id, entity.name, entity.full_path,
+                    entity.node_type, entity.file_size, entity.is_deleted, entity.blob_id, entity.owner_id)
+        
+        anchor = select(*node_columns(FileNode)).where(anchor_condition)
+        if not include_deleted:
+            anchor = anchor.where(FileNode.is_deleted == False)
+        subtree = anchor.cte('subtree', recursive=True)
+        
+        child = aliased(FileNode)
+        recursive = select(*node_columns(child)).where(child.parent_id == subtree.c.id)
+        if not include_deleted:
+            recursive = recursive.where(child.is_deleted == False)
+        return subtree.union(recursive) if distinct else subtree.union_all(recursive)
+    
     def create_directory(self, path: str, user: User) -> FileNode:
         """创建目录"""
         # 检查路径是否已存在
@@ -95,11 +146,7 @@ class FileService:
                 parent_node = self.create_directory(parent_path, user)
             parent_id = parent_node.id
         
-        # 创建物理目录
-        physical_path = os.path.join(STORAGE_DIR, path.lstrip('/'))
-        os.makedirs(physical_path, exist_ok=True)
-        
-        # 创建数据库记录
+        # 目录只存在于数据库中，文件内容保存在数据块目录
         dir_node = FileNode(
             name=dir_name,
             path=path,
@@ -129,37 +176,150 @@ class FileService:
         return self.create_directory(path, user)
     
     def save_uploaded_file(self, file_path: str, content: bytes, user: User, file_metadata: dict = None) -> FileNode:
-        """保存上传的文件"""
+        """保存上传的文件（内存中的完整内容）"""
+        return self.save_uploaded_stream(file_path, io.BytesIO(content), user, file_metadata)
+    
+    def save_uploaded_stream(self, file_path: str, stream: BinaryIO, user: User,
+                             file_metadata: dict = None, max_size: Optional[int] = None) -> FileNode:
+        """以流的方式保存上传的文件
+        
+        按固定大小分块复制到数据块目录，边复制边统计大小和计算内容哈希，
+        只用开头的少量数据检测MIME类型，内存占用与文件大小无关。
+        """
         # 检查路径是否已存在
         if self.get_node_by_path(file_path, user):
             raise ValueError(f"文件 {file_path} 已存在")
         
-        # 解析路径
-        parent_path = os.path.dirname(file_path)
+        parent_id = self._prepare_file_location(file_path, user)
+        
+        # 先写入数据块目录下的临时文件，完成后再按内容哈希入库
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=str(BLOB_DIR))
+        hasher = new_content_hasher()
+        file_size = 0
+        head = b''
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(head) < MIME_SNIFF_SIZE:
+                        head += chunk[:MIME_SNIFF_SIZE - len(head)]
+                    file_size += len(chunk)
+                    if max_size is not None and file_size > max_size:
+                        raise ValueError("文件过大")
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        return self._store_and_create_node(file_path, parent_id, temp_path, hasher.hexdigest(),
+                                           file_size, head, user, file_metadata)
+    
+    def save_uploaded_file_from_path(self, file_path: str, source_path: str, user: User,
+                                     file_metadata: dict = None, content_hash: str = None) -> FileNode:
+        """将已落盘的文件移入数据块存储
+        
+        同一文件系统内直接重命名，不复制数据；内容已存在时直接复用。
+        content_hash 为调用方已算好的BLAKE2b哈希，未提供时会重新读取文件计算。
+        """
+        # 检查路径是否已存在
+        if self.get_node_by_path(file_path, user):
+            raise ValueError(f"文件 {file_path} 已存在")
+        
+        parent_id = self._prepare_file_location(file_path, user)
+        
+        with open(source_path, 'rb') as f:
+            head = f.read(MIME_SNIFF_SIZE)
+            if content_hash is None:
+                hasher = new_content_hasher()
+                hasher.update(head)
+                for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                content_hash = hasher.hexdigest()
+        file_size = os.path.getsize(source_path)
+        
+        return self._store_and_create_node(file_path, parent_id, source_path, content_hash,
+                                           file_size, head, user, file_metadata)
+    
+    def save_uploaded_object(self, file_path: str, storage: StorageBackend, storage_key: str,
+                             content_hash: str, file_size: int, user: User,
+                             file_metadata: dict = None) -> FileNode:
+        """将分片直接写入存储后端的对象登记为文件
+        
+        对象由本方法接管：内容已存在时复用已有数据块并删除该对象，失败时同样删除。
+        """
         file_name = os.path.basename(file_path)
+        try:
+            # 检查路径是否已存在
+            if self.get_node_by_path(file_path, user):
+                raise ValueError(f"文件 {file_path} 已存在")
+            
+            parent_id = self._prepare_file_location(file_path, user)
+            head = storage.read_range(storage_key, 0, MIME_SNIFF_SIZE - 1)
+            blob, created = self.blob_service.store_object(storage, storage_key, content_hash,
+                                                           file_size, head, file_name)
+        except BaseException:
+            self.db.rollback()
+            storage.delete(storage_key)
+            raise
         
-        # 确保父目录存在
-        parent_node = self.ensure_directory_exists(parent_path, user)
-        parent_id = parent_node.id if parent_node else None
+        try:
+            return self._create_file_node(file_path, parent_id, blob, user, file_metadata)
+        except BaseException:
+            self.db.rollback()
+            if created:
+                BlobService.delete_contents([(blob.backend, blob.storage_key)])
+            raise
+    
+    def create_file_from_blob(self, file_path: str, blob: Blob, user: User,
+                              file_metadata: dict = None) -> FileNode:
+        """直接引用已有数据块创建文件（秒传），不传输也不复制数据"""
+        # 检查路径是否已存在
+        if self.get_node_by_path(file_path, user):
+            raise ValueError(f"文件 {file_path} 已存在")
         
-        # 创建物理文件
-        physical_path = os.path.join(STORAGE_DIR, file_path.lstrip('/'))
-        os.makedirs(os.path.dirname(physical_path), exist_ok=True)
+        parent_id = self._prepare_file_location(file_path, user)
         
-        with open(physical_path, 'wb') as f:
-            f.write(content)
+        if not self.blob_service.acquire(blob):
+            self.db.rollback()
+            raise ValueError("数据块不存在")
         
-        # 获取文件信息
-        file_size = len(content)
-        file_extension = os.path.splitext(file_name)[1].lower()
+        return self._create_file_node(file_path, parent_id, blob, user, file_metadata)
+    
+    def _store_and_create_node(self, file_path: str, parent_id: Optional[int], source_path: str,
+                               content_hash: str, file_size: int, head: bytes, user: User,
+                               file_metadata: dict = None) -> FileNode:
+        """将源文件存为数据块并创建文件节点，失败时清理新写入的数据块"""
+        file_name = os.path.basename(file_path)
+        try:
+            blob, created = self.blob_service.store_file(source_path, content_hash, file_size, head, file_name)
+        except BaseException:
+            self.db.rollback()
+            if os.path.exists(source_path):
+                os.remove(source_path)
+            raise
         
-        # 检测MIME类型
-        mime_type = None
         try:
-            mime_type = magic.from_buffer(content, mime=True)
-        except:
-            # 如果magic失败，使用mimetypes模块
-            mime_type, _ = mimetypes.guess_type(file_name)
+            return self._create_file_node(file_path, parent_id, blob, user, file_metadata)
+        except BaseException:
+            self.db.rollback()
+            if created:
+                BlobService.delete_contents([(blob.backend, blob.storage_key)])
+            raise
+    
+    def _prepare_file_location(self, file_path: str, user: User) -> Optional[int]:
+        """确保父目录存在，返回父目录ID"""
+        parent_node = self.ensure_directory_exists(os.path.dirname(file_path), user)
+        return parent_node.id if parent_node else None
+    
+    def _create_file_node(self, file_path: str, parent_id: Optional[int], blob: Blob,
+                          user: User, file_metadata: dict = None) -> FileNode:
+        """为引用数据块的文件创建数据库记录"""
+        file_name = os.path.basename(file_path)
+        file_extension = os.path.splitext(file_name)[1].lower()
         
         # 创建数据库记录
         file_node = FileNode(
@@ -167,9 +327,10 @@ class FileService:
             path=file_path,
             full_path=file_path,
             node_type='file',
-            file_size=file_size,
-            mime_type=mime_type,
+            file_size=blob.size,
+            mime_type=blob.mime_type,
             file_extension=file_extension,
+            blob_id=blob.id,
             parent_id=parent_id,
             owner_id=user.id
         )
@@ -182,7 +343,6 @@ class FileService:
         if file_metadata and file_metadata.get('lastModified'):
             try:
                 # 将毫秒时间戳转换为datetime
-                from datetime import datetime
                 original_time = datetime.fromtimestamp(file_metadata['lastModified'] / 1000)
                 file_node.created_at = original_time
                 file_node.updated_at = original_time
@@ -198,9 +358,9 @@ class FileService:
         if node.is_deleted:
             return False
         
-        # 移动物理文件
-        old_path = node.physical_path
-        if os.path.exists(old_path):
+        # 移动旧版按路径存储的物理文件，数据块中的内容不需要移动
+        old_path = os.path.join(STORAGE_DIR, node.full_path.lstrip('/'))
+        if os.path.exists(old_path) and self._owns_legacy_path(node.owner_id, node.full_path):
             trash_path = os.path.join(TRASH_DIR, node.full_path.lstrip('/'))
             os.makedirs(os.path.dirname(trash_path), exist_ok=True)
             shutil.move(old_path, trash_path)
@@ -224,9 +384,9 @@ class FileService:
         if self.get_node_by_path(node.full_path, node.owner):
             raise ValueError(f"恢复失败：路径 {node.full_path} 已存在")
         
-        # 移动物理文件
+        # 移动旧版按路径存储的物理文件
         trash_path = os.path.join(TRASH_DIR, node.full_path.lstrip('/'))
-        if os.path.exists(trash_path):
+        if os.path.exists(trash_path) and self._owns_legacy_path(node.owner_id, node.full_path):
             restore_path = os.path.join(STORAGE_DIR, node.full_path.lstrip('/'))
             os.makedirs(os.path.dirname(restore_path), exist_ok=True)
             shutil.move(trash_path, restore_path)
@@ -246,84 +406,103 @@ class FileService:
         if not node.is_deleted:
             return False
         
+        # 记录将被删除，先从会话中移出，调用方仍可读取节点已加载的属性
+        if node in self.db:
+            self.db.expunge(node)
+        
+        try:
+            self._purge(FileNode.id == node.id)
+        except Exception as db_error:
+            print(f"Error: Failed to delete database record for {node.full_path}: {db_error}")
+            return False
+        return True
+    
+    def purge_trash(self, user: Optional[User] = None, deleted_before: Optional[datetime] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """批量永久删除回收站中的项目，返回删除的项目数
+        
+        user 为空时处理所有用户；deleted_before 不为空时只删除在此之前移入回收站的项目。
+        已删除目录中再被单独删除的项目只处理一次。
+        progress 会在每批删除后以（已删除记录数，总记录数）调用。
+        """
+        condition = FileNode.is_deleted == True
+        if user is not None:
+            condition = and_(condition, FileNode.owner_id == user.id)
+        if deleted_before is not None:
+            condition = and_(condition, FileNode.deleted_at <= deleted_before)
+        return self._purge(condition, progress)
+    
+    def _purge(self, root_condition, progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """删除满足条件的节点及其全部后代，返回满足条件的节点数
+        
+        一次递归查询收集所有受影响的节点，分批用 DELETE ... IN 删除分享链接和节点记录，
+        提交后由后台线程删除不再被引用的数据块和旧版按路径存储的物理文件。
+        """
+        from app.models.share import ShareLink
+        
+        roots = self.db.query(FileNode.owner_id, FileNode.full_path).filter(root_condition).all()
+        if not roots:
+            return 0
+        
+        subtree = self._subtree_cte(root_condition, include_deleted=True, distinct=True)
+        rows = self.db.execute(
+            select(subtree.c.id, subtree.c.blob_id, subtree.c.node_type, subtree.c.full_path, subtree.c.owner_id)
+        ).all()
+        node_ids = [row.id for row in rows]
+        
+        # 含有旧版文件的路径（用户ID，路径），只有这些路径对应的物理目录属于被删除的节点
+        legacy_owned = set()
+        for row in rows:
+            if row.node_type == 'file' and row.blob_id is None:
+                path = row.full_path
+                while path != '/':
+                    legacy_owned.add((row.owner_id, path))
+                    path = os.path.dirname(path)
+        
         try:
-            # 先删除关联的分享链接
-            from app.models.share import ShareLink
-            share_links = self.db.query(ShareLink).filter(ShareLink.file_node_id == node.id).all()
-            for share_link in share_links:
-                self.db.delete(share_link)
-            
-            # 如果是目录，也要删除子节点的分享链接
-            if node.is_directory:
-                for child in node.get_all_descendants(include_deleted=True):
-                    child_share_links = self.db.query(ShareLink).filter(ShareLink.file_node_id == child.id).all()
-                    for share_link in child_share_links:
-                        self.db.delete(share_link)
-            
-            # 尝试删除物理文件（从 trash 目录）
-            trash_path = os.path.join(TRASH_DIR, node.full_path.lstrip('/'))
-            if os.path.exists(trash_path):
-                if os.path.isfile(trash_path):
-                    os.remove(trash_path)
-                else:
-                    shutil.rmtree(trash_path)
-            else:
-                # 如果 trash 中没有，检查原始位置
-                original_path = os.path.join(STORAGE_DIR, node.full_path.lstrip('/'))
-                if os.path.exists(original_path):
-                    if os.path.isfile(original_path):
-                        os.remove(original_path)
-                    else:
-                        shutil.rmtree(original_path)
-            
-            # 删除数据库记录（包括所有子节点）
-            if node.is_directory:
-                # 递归删除所有子节点（无论是否被标记为删除）
-                all_children = node.get_all_descendants(include_deleted=True)
-                for child in all_children:
-                    # 先删除子节点的分享链接
-                    from app.models.share import ShareLink
-                    child_share_links = self.db.query(ShareLink).filter(ShareLink.file_node_id == child.id).all()
-                    for share_link in child_share_links:
-                        self.db.delete(share_link)
-                    self.db.delete(child)
+            # 释放数据块引用，不再被引用的数据块在提交后删除
+            orphan_contents = self.blob_service.release(row.blob_id for row in rows)
             
-            self.db.delete(node)
+            # 先删除关联的分享链接，再删除节点记录
+            deleted_count = 0
+            for batch in batched(node_ids, SQL_IN_BATCH_SIZE):
+                self.db.execute(delete(ShareLink).where(ShareLink.file_node_id.in_(batch)))
+                self.db.execute(
+                    delete(FileNode).where(FileNode.id.in_(batch))
+                    .execution_options(synchronize_session=False)
+                )
+                deleted_count += len(batch)
+                if progress:
+                    progress(deleted_count, len(node_ids))
             self.db.commit()
-            return True
-        
-        except Exception as e:
-            # 即使物理文件删除失败，也要清除数据库记录
-            print(f"Warning: Failed to delete physical file for {node.full_path}: {e}")
-            try:
-                # 先删除关联的分享链接
-                from app.models.share import ShareLink
-                share_links = self.db.query(ShareLink).filter(ShareLink.file_node_id == node.id).all()
-                for share_link in share_links:
-                    self.db.delete(share_link)
-                
-                if node.is_directory:
-                    all_children = node.get_all_descendants(include_deleted=True)
-                    for child in all_children:
-                        child_share_links = self.db.query(ShareLink).filter(ShareLink.file_node_id == child.id).all()
-                        for share_link in child_share_links:
-                            self.db.delete(share_link)
-                        self.db.delete(child)
-                
-                self.db.delete(node)
-                self.db.commit()
-                return True
-            except Exception as db_error:
-                print(f"Error: Failed to delete database record for {node.full_path}: {db_error}")
-                self.db.rollback()
-                return False
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        # 旧版按路径存储的物理文件可能在 trash 目录，也可能仍在原始位置
+        legacy_paths = []
+        for owner_id, full_path in roots:
+            if (owner_id, full_path) not in legacy_owned:
+                continue
+            relative_path = full_path.lstrip('/')
+            trash_path = os.path.join(str(TRASH_DIR), relative_path)
+            original_path = os.path.join(str(STORAGE_DIR), relative_path)
+            if os.path.lexists(trash_path):
+                legacy_paths.append(trash_path)
+            elif os.path.lexists(original_path):
+                legacy_paths.append(original_path)
+        
+        schedule_removal(legacy_paths)
+        if orphan_contents:
+            schedule_call(BlobService.delete_contents, orphan_contents)
+        schedule_call(remove_thumbnails, [row.id for row in rows if row.node_type == 'file'])
+        return len(roots)
     
     def rename_node(self, node: FileNode, new_name: str) -> bool:
         """重命名文件/目录"""
         if node.is_deleted:
             return False
         
-        old_name = node.name
         old_path = node.full_path
         new_path = os.path.join(os.path.dirname(old_path), new_name)
         
@@ -331,13 +510,19 @@ class FileService:
         if self.get_node_by_path(new_path, node.owner):
             raise ValueError(f"重命名失败：路径 {new_path} 已存在")
         
-        # 移动物理文件
-        old_physical = node.physical_path
+        # 移动旧版按路径存储的物理文件，数据块中的内容不需要移动
+        old_physical = os.path.join(STORAGE_DIR, old_path.lstrip('/'))
         new_physical = os.path.join(STORAGE_DIR, new_path.lstrip('/'))
         
-        if os.path.exists(old_physical):
+        if os.path.exists(old_physical) and self._owns_legacy_path(node.owner_id, old_path):
+            # 其他用户的旧版文件可能占用同一物理路径
+            if os.path.lexists(new_physical):
+                raise ValueError(f"重命名失败：路径 {new_path} 的物理文件已存在")
             os.rename(old_physical, new_physical)
         
+        # 一条语句改写节点及其所有子节点的路径
+        self._rewrite_subtree_paths(node.owner_id, node.id, old_path, new_path)
+        
         # 更新数据库记录
         node.name = new_name
         node.path = new_path
@@ -347,21 +532,179 @@ class FileService:
             # 更新文件扩展名
             node.file_extension = os.path.splitext(new_name)[1].lower()
         
-        # 如果是目录，更新所有子节点的路径
-        if node.is_directory:
-            self._update_children_paths(node, old_path, new_path)
-        
         self.db.commit()
+        
+        if node.is_file:
+            # 扩展名可能改变，不再是图片的文件不应继续返回旧的缩略图
+            schedule_call(remove_thumbnails, [node.id])
         return True
     
-    def _update_children_paths(self, parent: FileNode, old_parent_path: str, new_parent_path: str):
-        """递归更新子节点路径"""
-        for child in parent.get_all_descendants(include_deleted=True):
-            old_child_path = child.full_path
-            new_child_path = old_child_path.replace(old_parent_path, new_parent_path, 1)
+    def move_nodes(self, node_ids: List[int], target_path: str, user: User) -> int:
+        """批量移动文件/目录到目标目录，返回移动的项目数
+        
+        所有路径改写和父目录更新在一个事务内以集合式 UPDATE 完成，
+        不逐个加载子节点。
+        """
+        target_parent_id = None
+        if target_path != "/":
+            target = self.get_node_by_path(target_path, user)
+            if not target or not target.is_directory or target.is_effectively_deleted():
+                raise ValueError(f"目标目录 {target_path} 不存在")
+            target_parent_id = target.id
+        
+        # 只查询需要的列，不加载完整的ORM对象
+        nodes = []
+        for batch in batched(node_ids, SQL_IN_BATCH_SIZE):
+            nodes.extend(self.db.query(
+                FileNode.id, FileNode.name, FileNode.full_path, FileNode.node_type, FileNode.blob_id
+            ).filter(
+                FileNode.id.in_(batch),
+                FileNode.owner_id == user.id,
+                FileNode.is_deleted == False
+            ).all())
+        if len(nodes) != len(node_ids):
+            raise ValueError("部分文件不存在或已删除")
+        
+        # 已选目录下的项目会随目录一起移动，不再单独处理
+        selected_dirs = {node.full_path for node in nodes if node.node_type == 'directory'}
+        if selected_dirs:
+            nodes = [node for node in nodes if not self._has_ancestor_in(node.full_path, selected_dirs)]
+        
+        moves = []
+        for node in nodes:
+            if node.node_type == 'directory' and (target_path == node.full_path or target_path.startswith(node.full_path + '/')):
+                raise ValueError(f"不能将目录 '{node.name}' 移动到自身或其子目录中")
+            new_path = os.path.join(target_path, node.name)
+            if new_path != node.full_path:
+                moves.append((node, node.full_path, new_path))
+        
+        if not moves:
+            return 0
+        
+        # 一次查询检查所有目标路径是否冲突
+        new_paths = [new_path for _, _, new_path in moves]
+        if len(set(new_paths)) != len(new_paths):
+            raise ValueError("移动失败：选中的项目中存在重名")
+        for batch in batched(new_paths, SQL_IN_BATCH_SIZE):
+            conflict = self.db.query(FileNode.full_path).filter(
+                FileNode.owner_id == user.id,
+                FileNode.full_path.in_(batch)
+            ).first()
+            if conflict:
+                raise ValueError(f"移动失败：路径 {conflict[0]} 已存在")
+        
+        # 需要重命名的旧版物理文件，须在改写路径之前确认归属
+        legacy_moves = []
+        for node, old_path, new_path in moves:
+            if node.blob_id is not None:
+                continue
+            old_physical = os.path.join(STORAGE_DIR, old_path.lstrip('/'))
+            if os.path.exists(old_physical) and (node.node_type == 'file' or self._owns_legacy_path(user.id, old_path)):
+                new_physical = os.path.join(STORAGE_DIR, new_path.lstrip('/'))
+                # 其他用户的旧版文件可能占用同一物理路径
+                if os.path.lexists(new_physical):
+                    raise ValueError(f"移动失败：路径 {new_path} 的物理文件已存在")
+                legacy_moves.append((old_physical, new_physical))
+        
+        moved_legacy = []
+        try:
+            # 文件按来源目录分组，每组一条 UPDATE 改写路径前缀
+            file_groups = {}
+            for node, old_path, _ in moves:
+                if node.node_type == 'file':
+                    file_groups.setdefault(os.path.dirname(old_path), []).append(node.id)
+            target_prefix = target_path.rstrip('/')
+            for source_dir, ids in file_groups.items():
+                new_full_path = literal(target_prefix) + func.substr(FileNode.full_path, len(source_dir.rstrip('/')) + 1)
+                for batch in batched(ids, SQL_IN_BATCH_SIZE):
+                    self.db.execute(
+                        update(FileNode)
+                        .where(FileNode.id.in_(batch))
+                        .values(full_path=new_full_path, path=new_full_path)
+                        .execution_options(synchronize_session=False)
+                    )
+            
+            # 目录连同子树各用一条 UPDATE 改写
+            for node, old_path, new_path in moves:
+                if node.node_type == 'directory':
+                    self._rewrite_subtree_paths(user.id, node.id, old_path, new_path)
             
-            child.path = new_child_path
-            child.full_path = new_child_path
+            # 统一更新父目录
+            moved_ids = [node.id for node, _, _ in moves]
+            for batch in batched(moved_ids, SQL_IN_BATCH_SIZE):
+                self.db.execute(
+                    update(FileNode)
+                    .where(FileNode.id.in_(batch))
+                    .values(parent_id=target_parent_id)
+                    .execution_options(synchronize_session=False)
+                )
+            
+            # 旧版按路径存储的物理文件在同一文件系统内重命名
+            for old_physical, new_physical in legacy_moves:
+                os.makedirs(os.path.dirname(new_physical), exist_ok=True)
+                os.rename(old_physical, new_physical)
+                moved_legacy.append((old_physical, new_physical))
+            
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            # 撤销已完成的物理重命名
+            for old_physical, new_physical in reversed(moved_legacy):
+                try:
+                    os.rename(new_physical, old_physical)
+                except OSError as e:
+                    print(f"Warning: Failed to restore {old_physical}: {e}")
+            raise
+        
+        return len(moves)
+    
+    @staticmethod
+    def _has_ancestor_in(full_path: str, dir_paths: set) -> bool:
+        """检查路径的某个上级目录是否在给定集合中"""
+        parent = os.path.dirname(full_path)
+        while parent != '/':
+            if parent in dir_paths:
+                return True
+            parent = os.path.dirname(parent)
+        return False
+    
+    def _owns_legacy_path(self, owner_id: int, full_path: str) -> bool:
+        """该用户的路径下是否有旧版按路径存储的文件
+        
+        旧版文件存放在 STORAGE_DIR/full_path，没有按用户区分。它们都创建于路径全局唯一的时期，
+        因此磁盘上的一个路径只属于在该路径下拥有旧版文件的用户，其他用户的同名路径不能移动或删除它。
+        """
+        return self.db.query(FileNode.id).filter(
+            FileNode.owner_id == owner_id,
+            FileNode.node_type == 'file',
+            FileNode.blob_id.is_(None),
+            or_(FileNode.full_path == full_path, self._subtree_path_filter(full_path))
+        ).first() is not None
+    
+    @staticmethod
+    def _subtree_path_filter(full_path: str):
+        """匹配某个路径下所有后代节点的条件
+        
+        使用 [path + '/', path + '0') 的范围比较而不是 LIKE，
+        可以利用 full_path 上的索引，并且区分大小写。
+        """
+        return and_(FileNode.full_path > full_path + '/', FileNode.full_path < full_path + '0')
+    
+    def _rewrite_subtree_paths(self, owner_id: int, node_id: int, old_path: str, new_path: str):
+        """将节点及其所有后代的路径前缀从 old_path 改为 new_path
+        
+        物理内容按数据块存储，与路径无关，只需一条集合式的 UPDATE。
+        """
+        new_full_path = literal(new_path) + func.substr(FileNode.full_path, len(old_path) + 1)
+        self.db.execute(
+            update(FileNode)
+            .where(
+                FileNode.owner_id == owner_id,
+                or_(FileNode.id == node_id, self._subtree_path_filter(old_path))
+            )
+            .values(full_path=new_full_path, path=new_full_path)
+            .execution_options(synchronize_session=False)
+        )
     
     def get_node_info(self, node: FileNode) -> dict:
         """获取节点详细信息"""
@@ -0,0 +1,227 @@
+"""
+后台任务服务
+"""
+
+import os
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.config import JOB_DIR, JOB_WORKERS, JOB_RETENTION_HOURS
+from app.database import get_db_context
+from app.models.job import Job
+from app.models.user import User
+from app.services.file_service import FileService
+
+# 运行中任务的进度只保存在内存中，避免与任务自身的写事务争用SQLite写锁
+_job_progress: Dict[str, Tuple[int, int, Optional[str]]] = {}
+_job_progress_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """按需创建任务工作线程池"""
+    global _executor
+    
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="job-worker")
+        return _executor
+
+
+def shutdown_job_workers():
+    """停止任务工作线程池，未开始的任务会在下次启动时标记为中断"""
+    global _executor
+    
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+class JobContext:
+    """传给任务处理函数的上下文，用于报告进度和登记结果文件"""
+    
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.result_path = None
+    
+    def report(self, current: int, total: int, message: Optional[str] = None):
+        """更新任务进度"""
+        with _job_progress_lock:
+            _job_progress[self.job_id] = (current, total, message)
+    
+    def result_file(self, suffix: str = "") -> str:
+        """分配任务结果文件的路径"""
+        os.makedirs(str(JOB_DIR), exist_ok=True)
+        self.result_path = os.path.join(str(JOB_DIR), f"{self.job_id}{suffix}")
+        return self.result_path
+
+
+class JobService:
+    """后台任务服务类"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def create_job(self, user: User, job_type: str, params: dict = None) -> Job:
+        """创建任务并交给工作线程执行"""
+        if job_type not in _JOB_HANDLERS:
+            raise ValueError(f"未知的任务类型: {job_type}")
+        
+        job = Job(id=str(uuid.uuid4()), user_id=user.id, job_type=job_type, status='queued')
+        job.params = params
+        self.db.add(job)
+        self.db.commit()
+        
+        _get_executor().submit(_run_job, job.id)
+        return job
+    
+    def get_job(self, job_id: str, user: User) -> Optional[Job]:
+        """获取用户的任务"""
+        return self.db.query(Job).filter(Job.id == job_id, Job.user_id == user.id).first()
+    
+    def get_job_info(self, job: Job) -> dict:
+        """获取任务详细信息，运行中的任务使用内存中的最新进度"""
+        current, total, message = job.progress_current, job.progress_total, job.message
+        if not job.is_finished:
+            with _job_progress_lock:
+                live = _job_progress.get(job.id)
+            if live:
+                current, total = live[0], live[1]
+                message = live[2] or message
+        
+        info = {
+            'id': job.id,
+            'type': job.job_type,
+            'status': job.status,
+            'progress': {
+                'current': current,
+                'total': total,
+                'percent': round(current / total * 100, 1) if total else (100.0 if job.status == 'succeeded' else 0.0)
+            },
+            'message': message,
+            'result': job.result,
+            'error': job.error,
+            'created_at': job.created_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
+        if job.status == 'succeeded' and job.result_path:
+            info['download_url'] = f"/jobs/{job.id}/download"
+        return info
+    
+    @staticmethod
+    def recover_interrupted_jobs() -> int:
+        """将上次运行时未完成的任务标记为失败"""
+        with get_db_context() as db:
+            result = db.execute(
+                update(Job)
+                .where(Job.status.in_(['queued', 'running']))
+                .values(status='failed', error='服务重启，任务已中断', finished_at=datetime.utcnow())
+            )
+            db.commit()
+            return result.rowcount
+    
+    def cleanup_expired_jobs(self, hours: int = JOB_RETENTION_HOURS) -> int:
+        """删除过期的已结束任务及其结果文件"""
+        cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+        expired_jobs = self.db.query(Job).filter(
+            Job.status.in_(['succeeded', 'failed']),
+            Job.finished_at < cutoff_time
+        ).all()
+        
+        for job in expired_jobs:
+            if job.result_path and os.path.exists(job.result_path):
+                os.remove(job.result_path)
+            self.db.delete(job)
+        self.db.commit()
+        return len(expired_jobs)
+
+
+def _run_job(job_id: str):
+    """在工作线程中执行任务"""
+    context = JobContext(job_id)
+    with get_db_context() as db:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if job is None:
+            return
+        
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.commit()
+        
+        try:
+            user = db.query(User).filter(User.id == job.user_id).first()
+            handler = _JOB_HANDLERS[job.job_type]
+            result = handler(db, user, context, **job.params)
+            
+            db.refresh(job)
+            job.status = 'succeeded'
+            job.result = result
+            job.result_path = context.result_path
+        except Exception as e:
+            db.rollback()
+            db.refresh(job)
+            job.status = 'failed'
+            job.error = str(e)
+            if context.result_path and os.path.exists(context.result_path):
+                os.remove(context.result_path)
+        finally:
+            with _job_progress_lock:
+                live = _job_progress.pop(job_id, None)
+        
+        if live:
+            job.progress_current, job.progress_total = live[0], live[1]
+            job.message = live[2] or job.message
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+
+def _purge_trash_job(db: Session, user: User, context: JobContext, deleted_before: str = None) -> dict:
+    """清空回收站，deleted_before 不为空时只清理在此之前删除的项目"""
+    expire_date = datetime.fromisoformat(deleted_before) if deleted_before else None
+    
+    def progress(current, total):
+        context.report(current, total, f"已删除 {current}/{total} 条记录")
+    
+    count = FileService(db).purge_trash(user, deleted_before=expire_date, progress=progress)
+    return {'deleted_count': count}
+
+
+def _zip_archive_job(db: Session, user: User, context: JobContext, node_ids: List[int]) -> dict:
+    """将文件和目录打包为ZIP结果文件"""
+    from app.utils.file_utils import iter_zip_from_nodes, calculate_directory_size
+    
+    file_service = FileService(db)
+    nodes = [node for node in (file_service.get_node_by_id(node_id, user) for node_id in node_ids) if node]
+    if not nodes:
+        raise ValueError("没有找到指定的文件")
+    
+    total = sum(calculate_directory_size(node) for node in nodes)
+    
+    def progress(current):
+        context.report(current, total, "正在打包")
+    
+    result_path = context.result_file('.zip')
+    with open(result_path, 'wb') as f:
+        for data in iter_zip_from_nodes(nodes, progress=progress):
+            f.write(data)
+    
+    if len(nodes) == 1:
+        filename = f"{nodes[0].name}.zip"
+    else:
+        filename = f"batch_download_{len(nodes)}_files.zip"
+    return {'filename': filename, 'size': os.path.getsize(result_path)}
+
+
+# 任务类型 -> 处理函数，处理函数的返回值作为任务结果保存
+_JOB_HANDLERS: Dict[str, Callable] = {
+    'purge_trash': _purge_trash_job,
+    'zip_archive': _zip_archive_job,
+}
@@ -0,0 +1,537 @@
+"""
+数据块物理存储后端
+
+数据块的读写都通过 StorageBackend 进行，调用方只使用存储标识（storage_key），
+不关心内容位于本地磁盘还是对象存储。每个数据块记录自己所在的后端，
+新数据块写入 STORAGE_BACKEND 指定的后端。
+"""
+
+import io
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from app.config import (
+    BLOB_DIR, BLOB_FANOUT_LEVELS, STORAGE_BACKEND, COLD_BLOB_DIR, COLD_COMPRESSION_LEVEL,
+    S3_ENDPOINT_URL, S3_BUCKET, S3_PREFIX, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY,
+    S3_MULTIPART_MIN_PART_SIZE
+)
+from app.utils.compression import ENCODING_GZIP_FRAMES, iter_decompressed_range, parse_frame_index
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # 只使用本地存储时不需要 boto3
+    boto3 = None
+    ClientError = None
+
+# 存储标识为32位十六进制（uuid4().hex），用于识别旧版平铺存放的数据块
+_STORAGE_KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+# 流式读取时每次产出的块大小
+STREAM_CHUNK_SIZE = 1024 * 1024
+# 压缩存储的文件头：魔数 + 原始大小（8字节，大端）
+_COMPRESSED_MAGIC = b'NDZ1'
+_COMPRESSED_HEADER = struct.Struct('>4sQ')
+
+
+def shard_path(storage_key: str, fanout_levels: int = BLOB_FANOUT_LEVELS) -> List[str]:
+    """将存储标识分散到多级子目录，如 ab/cd/<key>"""
+    shards = [storage_key[level * 2:level * 2 + 2] for level in range(fanout_levels)]
+    return shards + [storage_key]
+
+
+def iter_file_range(file_path: str, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """按块读取本地文件中 [start, end] 的字节
+    
+    第一次读取到下一个 chunk_size 的整数倍为止，之后每次读取都从对齐的位置开始，
+    并提示内核按顺序预读，拖动播放进度产生的范围请求也能以整块读取磁盘。
+    """
+    with open(file_path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            length = 0 if end is None else end - start + 1
+            os.posix_fadvise(f.fileno(), start, length, os.POSIX_FADV_SEQUENTIAL)
+        f.seek(start)
+        position = start
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            size = chunk_size - position % chunk_size
+            if remaining is not None:
+                size = min(size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            position += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class StorageBackend:
+    """存储后端接口
+    
+    end 参数均为包含在内的结束偏移量，与 HTTP Range 的语义一致；为空表示读到末尾。
+    """
+    
+    # 写入数据块记录的后端名称
+    name = ""
+    # 是否支持把分片上传的各个分片直接写入存储（如 S3 multipart upload）
+    supports_multipart = False
+    # 分片上传时除最后一个分片外每个分片的最小大小
+    min_part_size = 0
+    
+    def local_path(self, storage_key: str) -> Optional[str]:
+        """数据块在本地磁盘上的路径，内容不在本地时返回 None"""
+        return None
+    
+    def put_file(self, source_path: str, storage_key: str):
+        """将已落盘的文件移入存储，完成后源文件不再存在"""
+        raise NotImplementedError
+    
+    def put_stream(self, storage_key: str, stream: BinaryIO):
+        """从文件对象流式写入数据块"""
+        raise NotImplementedError
+    
+    def iter_range(self, storage_key: str, start: int = 0, end: Optional[int] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """流式读取数据块的指定范围"""
+        raise NotImplementedError
+    
+    def read_range(self, storage_key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """读取数据块的指定范围"""
+        return b''.join(self.iter_range(storage_key, start, end))
+    
+    def size(self, storage_key: str) -> int:
+        """获取数据块大小"""
+        raise NotImplementedError
+    
+    def exists(self, storage_key: str) -> bool:
+        """检查数据块是否存在"""
+        raise NotImplementedError
+    
+    def delete(self, storage_key: str):
+        """删除数据块，不存在时忽略"""
+        raise NotImplementedError
+    
+    def rename(self, storage_key: str, new_storage_key: str):
+        """修改数据块的存储标识"""
+        raise NotImplementedError
+    
+    def create_multipart(self, storage_key: str) -> str:
+        """开始分片写入，返回后端的上传标识"""
+        raise NotImplementedError
+    
+    def upload_part(self, storage_key: str, upload_token: str, part_number: int, data: bytes):
+        """写入一个分片，part_number 从1开始，可以乱序和并发写入"""
+        raise NotImplementedError
+    
+    def complete_multipart(self, storage_key: str, upload_token: str, part_count: int):
+        """按分片编号顺序合并所有分片"""
+        raise NotImplementedError
+    
+    def abort_multipart(self, storage_key: str, upload_token: str):
+        """放弃分片写入并清理已写入的分片"""
+        raise NotImplementedError
+
+
+class LocalStorageBackend(StorageBackend):
+    """本地磁盘存储后端
+    
+    数据块按存储标识分散到多级子目录（如 ab/cd/<key>），与逻辑目录结构无关，
+    单个目录中的条目数不会随文件数量无限增长。
+    """
+    
+    name = "local"
+    
+    def __init__(self, root: str = str(BLOB_DIR), fanout_levels: int = BLOB_FANOUT_LEVELS):
+        self.root = root
+        self.fanout_levels = fanout_levels
+        os.makedirs(self.root, exist_ok=True)
+    
+    def path_for(self, storage_key: str) -> str:
+        """根据存储标识计算物理路径"""
+        return os.path.join(self.root, *shard_path(storage_key, self.fanout_levels))
+    
+    def local_path(self, storage_key: str) -> Optional[str]:
+        return self.path_for(storage_key)
+    
+    def put_file(self, source_path: str, storage_key: str):
+        """将已落盘的文件移入存储，同一文件系统内只是重命名"""
+        target_path = self.path_for(storage_key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.move(source_path, target_path)
+    
+    def put_stream(self, storage_key: str, stream: BinaryIO):
+        # 先写入临时文件，完整写入后再重命名，读取方不会看到写了一半的数据块
+        fd, temp_path = tempfile.mkstemp(prefix='.put-', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, STREAM_CHUNK_SIZE)
+            self.put_file(temp_path, storage_key)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def iter_range(self, storage_key: str, start: int = 0, end: Optional[int] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        return iter_file_range(self.path_for(storage_key), start, end, chunk_size)
+    
+    def size(self, storage_key: str) -> int:
+        return os.path.getsize(self.path_for(storage_key))
+    
+    def exists(self, storage_key: str) -> bool:
+        return os.path.exists(self.path_for(storage_key))
+    
+    def delete(self, storage_key: str):
+        try:
+            os.remove(self.path_for(storage_key))
+        except FileNotFoundError:
+            pass
+    
+    def rename(self, storage_key: str, new_storage_key: str):
+        target_path = self.path_for(new_storage_key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(self.path_for(storage_key), target_path)
+    
+    def iter_flat_keys(self) -> Iterator[str]:
+        """列出旧版直接存放在根目录下的数据块"""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and _STORAGE_KEY_PATTERN.match(entry.name):
+                    yield entry.name
+    
+    def migrate_flat_layout(self) -> int:
+        """把根目录下平铺的数据块移入分层目录，返回移动的数量
+        
+        迁移完成后根目录只剩分层子目录和上传中的临时文件，再次执行的开销很小。
+        """
+        moved = 0
+        for storage_key in list(self.iter_flat_keys()):
+            target_path = self.path_for(storage_key)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(os.path.join(self.root, storage_key), target_path)
+            moved += 1
+        return moved
+
+
+class CompressedLocalStorageBackend(LocalStorageBackend):
+    """压缩存放在本地磁盘的存储后端，用作冷数据层
+    
+    文件由文件头和 zlib 压缩流组成，读取任意范围都需要从头解压，
+    因此只适合很少被读取的数据块，被访问的数据块会提升回热数据层。
+    """
+    
+    name = "cold"
+    
+    def __init__(self, root: str = str(COLD_BLOB_DIR), fanout_levels: int = BLOB_FANOUT_LEVELS,
+                 compression_level: int = COLD_COMPRESSION_LEVEL):
+        super().__init__(root, fanout_levels)
+        self.compression_level = compression_level
+    
+    def local_path(self, storage_key: str) -> Optional[str]:
+        # 磁盘上是压缩后的数据，不能直接作为文件内容发送
+        return None
+    
+    def put_file(self, source_path: str, storage_key: str):
+        with open(source_path, 'rb') as f:
+            self.put_stream(storage_key, f)
+        os.remove(source_path)
+    
+    def put_stream(self, storage_key: str, stream: BinaryIO):
+        fd, temp_path = tempfile.mkstemp(prefix='.put-', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # 原始大小在写完后回填到文件头
+                f.write(_COMPRESSED_HEADER.pack(_COMPRESSED_MAGIC, 0))
+                compressor = zlib.compressobj(self.compression_level)
+                size = 0
+                for block in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+                    size += len(block)
+                    f.write(compressor.compress(block))
+                f.write(compressor.flush())
+                f.seek(0)
+                f.write(_COMPRESSED_HEADER.pack(_COMPRESSED_MAGIC, size))
+            LocalStorageBackend.put_file(self, temp_path, storage_key)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def iter_range(self, storage_key: str, start: int = 0, end: Optional[int] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.path_for(storage_key), 'rb') as f:
+            self._read_header(f)
+            decompressor = zlib.decompressobj()
+            position = 0
+            buffer = bytearray()
+            while True:
+                compressed = f.read(STREAM_CHUNK_SIZE)
+                data = decompressor.decompress(compressed) if compressed else decompressor.flush()
+                # 丢弃起始偏移量之前的数据，截断结束偏移量之后的数据
+                if position + len(data) > start:
+                    begin = max(0, start - position)
+                    stop = len(data) if end is None else min(len(data), end + 1 - position)
+                    buffer += data[begin:stop]
+                position += len(data)
+                while len(buffer) >= chunk_size:
+                    yield bytes(buffer[:chunk_size])
+                    del buffer[:chunk_size]
+                if not compressed or (end is not None and position > end):
+                    break
+            if buffer:
+                yield bytes(buffer)
+    
+    def size(self, storage_key: str) -> int:
+        with open(self.path_for(storage_key), 'rb') as f:
+            return self._read_header(f)
+    
+    @staticmethod
+    def _read_header(f: BinaryIO) -> int:
+        """读取文件头，返回原始大小"""
+        magic, size = _COMPRESSED_HEADER.unpack(f.read(_COMPRESSED_HEADER.size))
+        if magic != _COMPRESSED_MAGIC:
+            raise ValueError("无效的压缩数据块")
+        return size
+
+
+class S3StorageBackend(StorageBackend):
+    """兼容S3的对象存储后端（AWS S3、MinIO 等）
+    
+    对象键为 前缀 + ab/cd/<key>。分片上传的每个分片直接对应一个 S3 multipart 分片，
+    服务器不需要在本地暂存整个文件。可以传入现成的 client（如 moto 或指向本地 MinIO 的客户端）。
+    """
+    
+    name = "s3"
+    supports_multipart = True
+    min_part_size = S3_MULTIPART_MIN_PART_SIZE
+    
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, client=None,
+                 endpoint_url: Optional[str] = S3_ENDPOINT_URL, region: Optional[str] = S3_REGION,
+                 access_key_id: Optional[str] = S3_ACCESS_KEY_ID,
+                 secret_access_key: Optional[str] = S3_SECRET_ACCESS_KEY):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("使用 S3 存储后端需要安装 boto3")
+            client = boto3.client(
+                's3',
+                endpoint_url=endpoint_url,
+                region_name=region,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+    
+    def object_key(self, storage_key: str) -> str:
+        """根据存储标识计算对象键"""
+        return self.prefix + '/'.join(shard_path(storage_key))
+    
+    @staticmethod
+    def _is_not_found(error) -> bool:
+        code = error.response.get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+    
+    def put_file(self, source_path: str, storage_key: str):
+        # upload_file 会对大文件自动使用并发分片上传
+        self.client.upload_file(source_path, self.bucket, self.object_key(storage_key))
+        os.remove(source_path)
+    
+    def put_stream(self, storage_key: str, stream: BinaryIO):
+        self.client.upload_fileobj(stream, self.bucket, self.object_key(storage_key))
+    
+    def iter_range(self, storage_key: str, start: int = 0, end: Optional[int] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        params = {'Bucket': self.bucket, 'Key': self.object_key(storage_key)}
+        if start or end is not None:
+            params['Range'] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**params)['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+    
+    def size(self, storage_key: str) -> int:
+        response = self.client.head_object(Bucket=self.bucket, Key=self.object_key(storage_key))
+        return response['ContentLength']
+    
+    def exists(self, storage_key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(storage_key))
+            return True
+        except ClientError as e:
+            if self._is_not_found(e):
+                return False
+            raise
+    
+    def delete(self, storage_key: str):
+        # S3 删除不存在的对象不会报错
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(storage_key))
+    
+    def rename(self, storage_key: str, new_storage_key: str):
+        # 对象存储没有重命名，复制后删除；copy 会对大对象自动使用分片复制
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': self.object_key(storage_key)},
+            self.bucket, self.object_key(new_storage_key)
+        )
+        self.delete(storage_key)
+    
+    def create_multipart(self, storage_key: str) -> str:
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.object_key(storage_key))
+        return response['UploadId']
+    
+    def upload_part(self, storage_key: str, upload_token: str, part_number: int, data: bytes):
+        self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.object_key(storage_key),
+            UploadId=upload_token,
+            PartNumber=part_number,
+            Body=data
+        )
+    
+    def complete_multipart(self, storage_key: str, upload_token: str, part_count: int):
+        # 分片的 ETag 由服务端记录，完成时再列出，不需要在数据库中保存
+        parts = {}
+        paginator = self.client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket, Key=self.object_key(storage_key), UploadId=upload_token):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = part['ETag']
+        
+        missing = [number for number in range(1, part_count + 1) if number not in parts]
+        if missing:
+            raise ValueError(f"对象存储中缺少分片: {[number - 1 for number in missing]}")
+        
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.object_key(storage_key),
+            UploadId=upload_token,
+            MultipartUpload={'Parts': [
+                {'PartNumber': number, 'ETag': parts[number]} for number in range(1, part_count + 1)
+            ]}
+        )
+    
+    def abort_multipart(self, storage_key: str, upload_token: str):
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.object_key(storage_key), UploadId=upload_token
+            )
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code != 'NoSuchUpload':
+                raise
+
+
+class CompressedBlobView(StorageBackend):
+    """压缩存放的数据块的只读视图
+    
+    读取时先取出 gzip 数据之后的帧索引，再只解压覆盖所需范围的帧。
+    """
+    
+    def __init__(self, storage: StorageBackend, gzip_size: int):
+        self.storage = storage
+        self.gzip_size = gzip_size
+        self.name = storage.name
+    
+    def iter_range(self, storage_key: str, start: int = 0, end: Optional[int] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        index = parse_frame_index(self.storage.read_range(storage_key, self.gzip_size), self.gzip_size)
+        yield from iter_decompressed_range(
+            lambda compressed_start, compressed_end: self.storage.iter_range(
+                storage_key, compressed_start, compressed_end, chunk_size
+            ),
+            index, start, end, chunk_size
+        )
+    
+    def iter_encoded(self, storage_key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """按块读取 gzip 数据，可以原样作为 Content-Encoding: gzip 的响应体"""
+        return self.storage.iter_range(storage_key, 0, self.gzip_size - 1, chunk_size)
+    
+    def size(self, storage_key: str) -> int:
+        return parse_frame_index(self.storage.read_range(storage_key, self.gzip_size), self.gzip_size).raw_size
+    
+    def exists(self, storage_key: str) -> bool:
+        return self.storage.exists(storage_key)
+    
+    def delete(self, storage_key: str):
+        self.storage.delete(storage_key)
+
+
+# 可用的存储后端，按名称创建
+_BACKEND_FACTORIES = {
+    LocalStorageBackend.name: LocalStorageBackend,
+    CompressedLocalStorageBackend.name: CompressedLocalStorageBackend,
+    S3StorageBackend.name: S3StorageBackend,
+}
+
+_backends: Dict[str, StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage_backend(name: Optional[str] = None) -> StorageBackend:
+    """获取指定名称的存储后端实例，未指定时返回写入新数据块的默认后端"""
+    name = name or STORAGE_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            factory = _BACKEND_FACTORIES.get(name)
+            if factory is None:
+                raise ValueError(f"未知的存储后端: {name}")
+            backend = factory()
+            _backends[name] = backend
+        return backend
+
+
+def get_blob_storage(backend: str, encoding: Optional[str] = None,
+                     encoded_size: Optional[int] = None) -> StorageBackend:
+    """获取读取数据块内容的存储后端，压缩存放的数据块返回解压视图"""
+    storage = get_storage_backend(backend)
+    if encoding == ENCODING_GZIP_FRAMES:
+        return CompressedBlobView(storage, encoded_size)
+    return storage
+
+
+def register_storage_backend(backend: StorageBackend):
+    """注册已创建的存储后端实例，例如测试时使用 moto 客户端的 S3 后端"""
+    with _backends_lock:
+        _backends[backend.name] = backend
+
+
+class _ChunkReader(io.RawIOBase):
+    """把按块产出数据的迭代器包装为只读文件对象"""
+    
+    def __init__(self, chunks: Iterator[bytes]):
+        super().__init__()
+        self._chunks = chunks
+        self._pending = b''
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def copy_between_backends(source: StorageBackend, target: StorageBackend, storage_key: str):
+    """把数据块从一个存储后端复制到另一个后端，存储标识不变，源数据保留"""
+    local_path = source.local_path(storage_key)
+    if local_path is not None:
+        with open(local_path, 'rb') as f:
+            target.put_stream(storage_key, f)
+        return
+    
+    reader = io.BufferedReader(_ChunkReader(source.iter_range(storage_key)), STREAM_CHUNK_SIZE)
+    with reader:
+        target.put_stream(storage_key, reader)
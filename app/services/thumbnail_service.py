@@ -0,0 +1,227 @@
+"""
+缩略图服务
+
+图片文件的缩略图在缩略图线程池中生成一次，以 WebP 格式缓存在 THUMBNAIL_DIR 中。
+缓存文件名包含节点ID、内容版本和尺寸，文件内容变化后版本随之变化，不会读到旧的缩略图；
+重命名和永久删除时主动删除该节点的全部缩略图。
+
+缓存文件的修改时间即最后使用时间，命中时更新；缓存总大小超过 THUMBNAIL_CACHE_MAX_BYTES 时
+删除最久未使用的缩略图。Pillow 未安装时缩略图功能不可用，其他功能不受影响。
+"""
+
+import io
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, Optional, Union
+from app.models.file import FileNode
+from app.utils.file_utils import get_file_content, is_image
+from app.config import (
+    THUMBNAIL_DIR, THUMBNAIL_SIZES, THUMBNAIL_QUALITY, THUMBNAIL_MAX_SOURCE_PIXELS,
+    THUMBNAIL_CACHE_MAX_BYTES
+)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+# 清理缓存时删除到容量的这一比例，避免每生成一张缩略图就清理一次
+_EVICT_TARGET_RATIO = 0.9
+
+# 正在生成的缩略图，同一缩略图的并发请求等待第一个请求生成完成
+_render_locks: Dict[str, threading.Lock] = {}
+_render_locks_lock = threading.Lock()
+
+# 缓存总大小，首次使用时扫描缓存目录得到
+_cache_bytes: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def thumbnails_available() -> bool:
+    """是否可以生成缩略图"""
+    return Image is not None
+
+
+def has_thumbnail(node: FileNode) -> bool:
+    """文件是否可以生成缩略图"""
+    return thumbnails_available() and is_image(node)
+
+
+def thumbnail_size(requested: int) -> int:
+    """把请求的尺寸向上取到最接近的一档，超过最大一档时使用最大一档"""
+    for size in THUMBNAIL_SIZES:
+        if requested <= size:
+            return size
+    return THUMBNAIL_SIZES[-1]
+
+
+def open_node_source(node: FileNode) -> Union[str, BinaryIO]:
+    """返回供 Pillow 读取的文件内容：本地文件返回路径，其他存储后端读入内存"""
+    file_path = node.physical_path
+    if file_path is not None:
+        return file_path
+    return io.BytesIO(get_file_content(node))
+
+
+def _shard_dir(node_id: int) -> str:
+    """节点的缩略图所在的子目录，按节点ID分散到256个目录"""
+    return os.path.join(str(THUMBNAIL_DIR), f"{node_id % 256:02x}")
+
+
+def cache_path(node_id: int, version: str, size: int) -> str:
+    """缩略图的缓存路径"""
+    return os.path.join(_shard_dir(node_id), f"{node_id}-{version}-{size}.webp")
+
+
+def get_thumbnail(node_id: int, version: str, size: int,
+                  open_source: Callable[[], Union[str, BinaryIO]]) -> bytes:
+    """返回缩略图的内容，缓存中没有时读取原图生成，在缩略图线程池中调用
+    
+    缩略图很小，直接返回内容而不是缓存路径，发送期间缓存被清理也不影响响应。
+    """
+    path = cache_path(node_id, version, size)
+    data = _read_cached(path)
+    if data is not None:
+        return data
+    
+    with _render_locks_lock:
+        lock = _render_locks.setdefault(path, threading.Lock())
+    try:
+        with lock:
+            # 等待期间其他请求可能已经生成
+            data = _read_cached(path)
+            if data is not None:
+                return data
+            data = _render(open_source(), size)
+            _write_cache(path, data)
+    finally:
+        with _render_locks_lock:
+            _render_locks.pop(path, None)
+    
+    _add_cache_bytes(len(data))
+    return data
+
+
+def _read_cached(path: str) -> Optional[bytes]:
+    """读取缓存的缩略图并更新其最后使用时间，不存在时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return data
+
+
+def _render(source: Union[str, BinaryIO], size: int) -> bytes:
+    """生成缩略图，返回 WebP 编码的内容"""
+    if Image is None:
+        raise RuntimeError("未安装 Pillow，无法生成缩略图")
+    
+    with Image.open(source) as image:
+        if image.width * image.height > THUMBNAIL_MAX_SOURCE_PIXELS:
+            raise ValueError("图片尺寸过大")
+        # JPEG 解码时直接按 1/2、1/4、1/8 缩小，不需要解码完整的大图
+        image.draft('RGB', (size, size))
+        thumbnail = ImageOps.exif_transpose(image)
+        if thumbnail.mode not in ('RGB', 'RGBA'):
+            has_alpha = thumbnail.mode in ('LA', 'PA') or 'transparency' in thumbnail.info
+            thumbnail = thumbnail.convert('RGBA' if has_alpha else 'RGB')
+        thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        
+        output = io.BytesIO()
+        thumbnail.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    return output.getvalue()
+
+
+def _write_cache(path: str, data: bytes):
+    """写入临时文件后重命名，并发读取时不会读到不完整的缩略图"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.thumbnail-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _scan_cache():
+    """缓存中所有缩略图的（路径，大小，最后使用时间）"""
+    root = str(THUMBNAIL_DIR)
+    if not os.path.isdir(root):
+        return
+    for shard in os.scandir(root):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith('.webp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.path, stat.st_size, stat.st_mtime
+
+
+def _add_cache_bytes(delta: int):
+    """累计缓存大小，超过容量时删除最久未使用的缩略图"""
+    global _cache_bytes
+    
+    with _cache_lock:
+        if _cache_bytes is None:
+            # 首次扫描的结果已包含刚写入的缩略图
+            _cache_bytes = sum(size for _, size, _ in _scan_cache())
+        else:
+            _cache_bytes = max(0, _cache_bytes + delta)
+        if _cache_bytes > THUMBNAIL_CACHE_MAX_BYTES:
+            _cache_bytes = _evict(int(THUMBNAIL_CACHE_MAX_BYTES * _EVICT_TARGET_RATIO))
+
+
+def _evict(target_bytes: int) -> int:
+    """按最后使用时间从旧到新删除缩略图，直到总大小不超过 target_bytes，返回剩余的总大小"""
+    entries = sorted(_scan_cache(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+def remove_thumbnails(node_ids: Iterable[int]):
+    """删除节点的全部缩略图"""
+    global _cache_bytes
+    
+    # 按子目录分组，每个子目录只列出一次
+    shards: Dict[str, set] = {}
+    for node_id in node_ids:
+        shards.setdefault(_shard_dir(node_id), set()).add(str(node_id))
+    
+    removed = 0
+    for directory, ids in shards.items():
+        try:
+            entries = [entry for entry in os.scandir(directory) if entry.name.split('-', 1)[0] in ids]
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                removed += size
+            except FileNotFoundError:
+                pass
+    
+    if removed:
+        with _cache_lock:
+            if _cache_bytes is not None:
+                _cache_bytes = max(0, _cache_bytes - removed)
@@ -0,0 +1,235 @@
+"""
+冷热分层存储服务
+
+数据块默认位于热数据层（STORAGE_BACKEND）。后台线程定期把长期未读取的数据块
+复制到冷数据层（如本地压缩目录或对象存储），再把数据块记录切换到冷数据层并删除热数据层的副本；
+冷数据层中的数据块被读取时，先直接从冷数据层返回内容，同时在后台提升回热数据层。
+数据块在两层之间移动时存储标识不变，只修改记录中的 backend；
+源数据的副本记录在 pending_blob_deletions 中，保留期结束后才删除。
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Set
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.database import get_db_context
+from app.models.blob import Blob, PendingBlobDeletion
+from app.models.file import FileNode
+from app.services.storage_backend import StorageBackend, get_storage_backend, copy_between_backends
+from app.utils.executors import submit_to_disk_pool
+from app.utils.path_remover import schedule_call, schedule_call_later
+from app.config import (
+    TIERING_ENABLED, TIER_COLD_BACKEND, TIER_COLD_AFTER_DAYS, TIER_CHECK_INTERVAL_HOURS,
+    TIER_BATCH_SIZE, TIER_ACCESS_UPDATE_INTERVAL_SECONDS, TIER_DELETE_GRACE_SECONDS
+)
+
+# 正在移动或正在删除副本的数据块，同一数据块同时只有一个这样的操作
+_moving_blobs: Set[int] = set()
+_moving_lock = threading.Lock()
+
+_tiering_thread: Optional[threading.Thread] = None
+_stop_tiering = threading.Event()
+
+
+class TieringService:
+    """冷热分层存储服务类"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.hot = get_storage_backend()
+        self.cold = get_storage_backend(TIER_COLD_BACKEND)
+    
+    def demote_cold_blobs(self, limit: int = TIER_BATCH_SIZE,
+                          cold_after: timedelta = timedelta(days=TIER_COLD_AFTER_DAYS)) -> int:
+        """把热数据层中长期未读取的数据块移入冷数据层，返回移动的数量"""
+        cutoff = datetime.utcnow() - cold_after
+        blob_ids = [row[0] for row in self.db.query(Blob.id).filter(
+            Blob.backend == self.hot.name,
+            Blob.last_accessed_at < cutoff,
+            Blob.ref_count > 0
+        ).order_by(Blob.last_accessed_at).limit(limit).all()]
+        
+        moved = 0
+        for blob_id in blob_ids:
+            try:
+                if self.move_blob(blob_id, self.hot, self.cold):
+                    moved += 1
+            except Exception as e:
+                self.db.rollback()
+                print(f"Warning: Failed to move blob {blob_id} to cold tier: {e}")
+        return moved
+    
+    def promote_blob(self, blob_id: int) -> bool:
+        """把冷数据层中的数据块移回热数据层"""
+        return self.move_blob(blob_id, self.cold, self.hot)
+    
+    def move_blob(self, blob_id: int, source: StorageBackend, target: StorageBackend) -> bool:
+        """把数据块从 source 移动到 target，返回是否移动
+        
+        先复制内容，再用带条件的 UPDATE 切换记录中的后端，同一事务中登记源数据的删除；
+        复制期间数据块被删除或已被移走时丢弃复制出的副本。
+        切换前已经按旧后端构造好的响应可能还没有打开数据（如触发提升的那次下载本身），
+        源数据在 TIER_DELETE_GRACE_SECONDS 之后才由 delete_moved_copies 删除。
+        """
+        if not _claim_blob(blob_id):
+            return False
+        
+        try:
+            blob = self.db.get(Blob, blob_id)
+            if blob is None or blob.backend != source.name:
+                return False
+            storage_key = blob.storage_key
+            
+            copy_between_backends(source, target, storage_key)
+            switched = self.db.execute(
+                update(Blob)
+                .where(Blob.id == blob_id, Blob.backend == source.name)
+                .values(backend=target.name)
+            )
+            if switched.rowcount:
+                self.db.add(PendingBlobDeletion(
+                    blob_id=blob_id,
+                    backend=source.name,
+                    storage_key=storage_key,
+                    delete_after=datetime.utcnow() + timedelta(seconds=TIER_DELETE_GRACE_SECONDS)
+                ))
+            self.db.commit()
+            
+            if switched.rowcount:
+                schedule_call_later(TIER_DELETE_GRACE_SECONDS, delete_moved_copies)
+                return True
+            
+            # 复制期间数据块的状态发生了变化，只有记录不指向目标后端时才能删除副本
+            current = self.db.query(Blob.backend).filter(Blob.id == blob_id).scalar()
+            if current != target.name:
+                target.delete(storage_key)
+            return False
+        finally:
+            _release_blob(blob_id)
+
+
+def _claim_blob(blob_id: int) -> bool:
+    """开始移动数据块或删除其副本，已有其他操作在进行时返回 False"""
+    with _moving_lock:
+        if blob_id in _moving_blobs:
+            return False
+        _moving_blobs.add(blob_id)
+        return True
+
+
+def _release_blob(blob_id: int):
+    """结束 _claim_blob 开始的操作"""
+    with _moving_lock:
+        _moving_blobs.discard(blob_id)
+
+
+def delete_moved_copies() -> int:
+    """删除保留期已结束的源数据副本，返回删除的数量
+    
+    两层中的副本使用相同的存储标识，保留期内数据块可能又被移回了原来的后端，
+    此时该位置的副本正在使用，只删除等待记录；正在移动的数据块留到下一次再处理。
+    """
+    deleted = 0
+    with get_db_context() as db:
+        pending = db.query(PendingBlobDeletion).filter(
+            PendingBlobDeletion.delete_after <= datetime.utcnow()
+        ).order_by(PendingBlobDeletion.id).all()
+        
+        for item in pending:
+            if not _claim_blob(item.blob_id):
+                continue
+            try:
+                current = db.query(Blob.backend).filter(Blob.id == item.blob_id).scalar()
+                if current != item.backend:
+                    try:
+                        get_storage_backend(item.backend).delete(item.storage_key)
+                    except Exception as e:
+                        print(f"Warning: Failed to remove moved blob {item.backend}:{item.storage_key}: {e}")
+                        continue
+                    deleted += 1
+                db.delete(item)
+                db.commit()
+            finally:
+                _release_blob(item.blob_id)
+    return deleted
+
+
+def record_access(node: FileNode):
+    """记录文件内容被读取，在数据库线程池中调用
+    
+    最后访问时间按 TIER_ACCESS_UPDATE_INTERVAL_SECONDS 的粒度更新，使用独立的会话提交，
+    不会让调用方会话中的对象过期。位于冷数据层的数据块会安排在后台提升回热数据层。
+    """
+    if node.blob_id is None:
+        return
+    blob = node.blob
+    
+    now = datetime.utcnow()
+    update_before = now - timedelta(seconds=TIER_ACCESS_UPDATE_INTERVAL_SECONDS)
+    if blob.last_accessed_at is None or blob.last_accessed_at < update_before:
+        with get_db_context() as db:
+            db.execute(update(Blob).where(Blob.id == blob.id).values(last_accessed_at=now))
+            db.commit()
+    
+    if TIERING_ENABLED and blob.backend == TIER_COLD_BACKEND:
+        submit_to_disk_pool(_promote_blob, blob.id)
+
+
+def _promote_blob(blob_id: int):
+    """在后台把数据块提升回热数据层"""
+    try:
+        with get_db_context() as db:
+            TieringService(db).promote_blob(blob_id)
+    except Exception as e:
+        print(f"Warning: Failed to promote blob {blob_id}: {e}")
+
+
+def run_tiering_pass() -> int:
+    """执行一轮冷数据检查"""
+    try:
+        delete_moved_copies()
+        with get_db_context() as db:
+            moved = TieringService(db).demote_cold_blobs()
+            if moved:
+                print(f"✅ 已将 {moved} 个长期未访问的数据块移入冷数据层")
+            return moved
+    except Exception as e:
+        print(f"❌ 冷热分层任务失败: {e}")
+        return 0
+
+
+def tiering_worker():
+    """冷热分层线程工作函数，每轮移动一批数据块，还有剩余时立即继续"""
+    while not _stop_tiering.is_set():
+        moved = run_tiering_pass()
+        if moved < TIER_BATCH_SIZE:
+            _stop_tiering.wait(TIER_CHECK_INTERVAL_HOURS * 3600)
+
+
+def start_tiering_worker():
+    """启动冷热分层线程"""
+    global _tiering_thread
+    
+    # 上次运行时登记的源数据副本：已到期的立即删除，其余的在保留期之后删除
+    schedule_call(delete_moved_copies)
+    schedule_call_later(TIER_DELETE_GRACE_SECONDS, delete_moved_copies)
+    
+    if not TIERING_ENABLED:
+        return
+    if _tiering_thread is not None and _tiering_thread.is_alive():
+        return
+    
+    _stop_tiering.clear()
+    _tiering_thread = threading.Thread(target=tiering_worker, name="tiering", daemon=True)
+    _tiering_thread.start()
+
+
+def stop_tiering_worker():
+    """停止冷热分层线程"""
+    global _tiering_thread
+    
+    _stop_tiering.set()
+    if _tiering_thread and _tiering_thread.is_alive():
+        _tiering_thread.join(timeout=5)
+    _tiering_thread = None
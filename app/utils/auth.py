@@ -5,16 +5,22 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends, Request
+from fastapi import HTTPException, status, Depends, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from app.config import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config import (
+    SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES, MEDIA_TOKEN_EXPIRE_MINUTES, INSTANT_UPLOAD_TOKEN_EXPIRE_MINUTES
+)
 from app.database import get_db
 from app.models.user import User
 
 security = HTTPBearer()
 
 ALGORITHM = "HS256"
+# 音视频预览令牌的用途标记，带用途标记的令牌不能作为登录凭据使用
+MEDIA_TOKEN_SCOPE = "media"
+# 秒传校验令牌的用途标记
+INSTANT_UPLOAD_TOKEN_SCOPE = "instant-upload"
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -35,13 +41,54 @@ def verify_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") is not None:
             return None
         return {"username": username}
     except JWTError:
         return None
 
 
+def create_media_token(username: str, node_id: int) -> str:
+    """创建只能用于预览指定文件的短期令牌
+    
+    <video>、<audio> 元素请求媒体时不能携带 Authorization 头，令牌放在预览地址的查询参数中。
+    """
+    return create_access_token(
+        {"sub": username, "scope": MEDIA_TOKEN_SCOPE, "node": node_id},
+        expires_delta=timedelta(minutes=MEDIA_TOKEN_EXPIRE_MINUTES)
+    )
+
+
+def verify_media_token(token: str, node_id: int) -> Optional[str]:
+    """验证预览令牌，返回用户名；令牌无效或不属于该文件时返回 None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != MEDIA_TOKEN_SCOPE or payload.get("node") != node_id:
+        return None
+    return payload.get("sub")
+
+
+def create_instant_upload_token(username: str, challenge: dict) -> str:
+    """创建秒传校验令牌，记录服务器选择的校验范围，客户端提交证明时原样带回"""
+    return create_access_token(
+        {**challenge, "sub": username, "scope": INSTANT_UPLOAD_TOKEN_SCOPE},
+        expires_delta=timedelta(minutes=INSTANT_UPLOAD_TOKEN_EXPIRE_MINUTES)
+    )
+
+
+def verify_instant_upload_token(token: str, username: str) -> Optional[dict]:
+    """验证秒传校验令牌，返回校验范围；令牌无效或不属于该用户时返回 None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != INSTANT_UPLOAD_TOKEN_SCOPE or payload.get("sub") != username:
+        return None
+    return payload
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
@@ -92,4 +139,28 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
         return None
     if not user.verify_password(password):
         return None
-    return user
\ No newline at end of file
+    return user
+
+
+def get_preview_user(
+    node_id: int,
+    request: Request,
+    token: Optional[str] = Query(None, description="音视频预览令牌"),
+    db: Session = Depends(get_db)
+) -> User:
+    """获取预览文件的用户，支持 Authorization 头或限定到该文件的预览令牌"""
+    user = get_current_user_optional(request, db)
+    if user is not None:
+        return user
+    
+    username = verify_media_token(token, node_id) if token else None
+    if username is not None:
+        user = db.query(User).filter(User.username == username).first()
+        if user is not None:
+            return user
+    
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="无效的认证凭据",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
@@ -0,0 +1,213 @@
+"""
+可按范围读取的压缩格式
+
+整个压缩数据是一个标准的 gzip 成员，每压缩一帧（COMPRESSION_FRAME_SIZE 字节原始数据）
+执行一次完全刷新（Z_FULL_FLUSH）。压缩流在这些位置按字节对齐且不依赖之前的数据，
+可以从任意一帧开始用原始 deflate 解压，读取某个范围只需解压覆盖该范围的几帧。
+
+gzip 成员之后是帧索引，数据块记录中保存 gzip 成员的大小，读取索引时从该位置读到末尾：
+
+    [gzip 成员][索引头：魔数, 帧大小, 帧数, 原始大小][每帧的压缩偏移]
+
+gzip 成员本身可以原样作为 Content-Encoding: gzip 的响应体发送。
+"""
+
+import os
+import struct
+import tempfile
+import zlib
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Tuple
+from app.config import (
+    COMPRESSION_ENABLED, COMPRESSION_LEVEL, COMPRESSION_FRAME_SIZE, COMPRESSION_MIN_SIZE,
+    COMPRESSION_MAX_RATIO, COMPRESSION_SAMPLE_SIZE, COMPRESSIBLE_EXTENSIONS, COMPRESSIBLE_MIME_TYPES
+)
+
+# 数据块记录中的编码名称
+ENCODING_GZIP_FRAMES = "gzip-frames"
+
+# 固定的 gzip 头：无文件名、修改时间为0、操作系统未知
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+_GZIP_TRAILER = struct.Struct('<II')  # CRC32、原始大小（模 2^32）
+_INDEX_HEADER = struct.Struct('>4sIIQ')  # 魔数、帧大小、帧数、原始大小
+_INDEX_ENTRY = struct.Struct('>Q')  # 帧在压缩数据中的偏移
+_INDEX_MAGIC = b'NDGF'
+
+
+class FrameIndex(NamedTuple):
+    """压缩数据的帧索引，第 i 帧对应原始数据从 i * frame_size 开始的部分"""
+    gzip_size: int
+    raw_size: int
+    frame_size: int
+    compressed_offsets: List[int]
+
+
+def is_compressible(file_name: str, mime_type: Optional[str], size: int) -> bool:
+    """根据扩展名、MIME类型和大小判断是否值得尝试压缩"""
+    if not COMPRESSION_ENABLED or size < COMPRESSION_MIN_SIZE:
+        return False
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in COMPRESSIBLE_EXTENSIONS:
+        return True
+    if mime_type:
+        mime_type = mime_type.split(';')[0].strip().lower()
+        return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_MIME_TYPES
+    return False
+
+
+def sample_ratio(source_path: str, level: int = COMPRESSION_LEVEL) -> float:
+    """压缩文件开头的样本，返回压缩后与压缩前的大小之比"""
+    with open(source_path, 'rb') as f:
+        sample = f.read(COMPRESSION_SAMPLE_SIZE)
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, level)) / len(sample)
+
+
+def try_compress_file(source_path: str, file_name: str, mime_type: Optional[str],
+                      size: int) -> Optional[Tuple[str, int]]:
+    """为适合压缩的文件在同一目录下生成压缩后的临时文件
+    
+    返回（临时文件路径，gzip 成员大小）；类型不适合、样本压缩率不足
+    或整体压缩效果不明显时返回 None，源文件保持不变。
+    """
+    if not is_compressible(file_name, mime_type, size):
+        return None
+    if sample_ratio(source_path) > COMPRESSION_MAX_RATIO:
+        return None
+    
+    fd, temp_path = tempfile.mkstemp(prefix='.compress-', dir=os.path.dirname(source_path))
+    try:
+        with open(source_path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            gzip_size, stored_size = compress_file(source, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    
+    if stored_size > size * COMPRESSION_MAX_RATIO:
+        os.remove(temp_path)
+        return None
+    return temp_path, gzip_size
+
+
+def compress_file(source: BinaryIO, target: BinaryIO, frame_size: int = COMPRESSION_FRAME_SIZE,
+                  level: int = COMPRESSION_LEVEL) -> Tuple[int, int]:
+    """把 source 压缩写入 target，返回（gzip 成员大小，写入的总字节数）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    raw_size = 0
+    compressed_offset = len(_GZIP_HEADER)
+    offsets = []
+    target.write(_GZIP_HEADER)
+    
+    while True:
+        block = source.read(frame_size)
+        if not block:
+            break
+        offsets.append(compressed_offset)
+        data = compressor.compress(block) + compressor.flush(zlib.Z_FULL_FLUSH)
+        target.write(data)
+        compressed_offset += len(data)
+        raw_size += len(block)
+        crc = zlib.crc32(block, crc)
+    
+    data = compressor.flush()
+    target.write(data)
+    target.write(_GZIP_TRAILER.pack(crc, raw_size & 0xFFFFFFFF))
+    gzip_size = compressed_offset + len(data) + _GZIP_TRAILER.size
+    
+    target.write(_INDEX_HEADER.pack(_INDEX_MAGIC, frame_size, len(offsets), raw_size))
+    target.write(b''.join(_INDEX_ENTRY.pack(offset) for offset in offsets))
+    return gzip_size, gzip_size + _INDEX_HEADER.size + len(offsets) * _INDEX_ENTRY.size
+
+
+def parse_frame_index(data: bytes, gzip_size: int) -> FrameIndex:
+    """解析 gzip 成员之后的帧索引数据"""
+    magic, frame_size, count, raw_size = _INDEX_HEADER.unpack_from(data)
+    if magic != _INDEX_MAGIC or len(data) < _INDEX_HEADER.size + count * _INDEX_ENTRY.size:
+        raise ValueError("无效的压缩数据块")
+    offsets = [
+        _INDEX_ENTRY.unpack_from(data, _INDEX_HEADER.size + i * _INDEX_ENTRY.size)[0]
+        for i in range(count)
+    ]
+    return FrameIndex(gzip_size, raw_size, frame_size, offsets)
+
+
+def iter_decompressed_range(read_iter: Callable[[int, int], Iterator[bytes]], index: FrameIndex,
+                            start: int = 0, end: Optional[int] = None,
+                            chunk_size: int = COMPRESSION_FRAME_SIZE) -> Iterator[bytes]:
+    """解压原始数据中 [start, end] 的字节，只读取和解压覆盖该范围的帧
+    
+    read_iter(start, end) 按块读取压缩数据中 [start, end] 的字节。
+    """
+    if end is None or end >= index.raw_size:
+        end = index.raw_size - 1
+    if start > end:
+        return
+    
+    first = start // index.frame_size
+    last = end // index.frame_size
+    compressed_start = index.compressed_offsets[first]
+    if last + 1 < len(index.compressed_offsets):
+        compressed_end = index.compressed_offsets[last + 1] - 1
+    else:
+        compressed_end = index.gzip_size - _GZIP_TRAILER.size - 1
+    
+    # 完全刷新后的位置不依赖之前的数据，直接用原始 deflate 解压
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    position = first * index.frame_size
+    buffer = bytearray()
+    for compressed in read_iter(compressed_start, compressed_end):
+        data = decompressor.decompress(compressed)
+        if position + len(data) > start:
+            buffer += data[max(0, start - position):end + 1 - position]
+        position += len(data)
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+        if position > end:
+            break
+    if buffer:
+        yield bytes(buffer)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """请求的 Accept-Encoding 是否接受 gzip
+    
+    明确列出的 gzip（或等价的 x-gzip）优先于 *，如 "gzip;q=0, *" 表示不接受 gzip。
+    """
+    if not accept_encoding:
+        return False
+    qualities = {}
+    for item in accept_encoding.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        coding = parts[0].lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        if coding not in ('gzip', '*'):
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        # 同一编码出现多次时取最高的权重
+        qualities[coding] = max(quality, qualities.get(coding, 0.0))
+    quality = qualities.get('gzip', qualities.get('*', 0.0))
+    return quality > 0
+    for item in accept_encoding.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if parts[0].lower() not in ('gzip', '*'):
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return True
+    return False
@@ -0,0 +1,74 @@
+"""
+阻塞操作的线程池
+
+路由都是 async def，同步的 SQLAlchemy 会话和文件操作不能直接在事件循环中执行，
+否则一次慢磁盘操作就会阻塞同一进程中的所有请求。
+磁盘和数据库操作使用各自有界的线程池，大文件写入不会占满数据库查询的线程。
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+from app.config import DISK_IO_WORKERS, DB_WORKERS, THUMBNAIL_WORKERS
+
+T = TypeVar('T')
+
+# 线程池配置：disk 用于文件读写、移动、哈希等以磁盘为主的操作；
+# db 用于以数据库查询和提交为主的操作，SQLite 同时只有一个写入者，线程数不宜过多；
+# thumbnail 用于解码图片和生成缩略图，以CPU为主，单独限制避免占满磁盘线程
+_POOL_SIZES = {
+    'disk': (DISK_IO_WORKERS, "disk-io"),
+    'db': (DB_WORKERS, "db"),
+    'thumbnail': (THUMBNAIL_WORKERS, "thumbnail"),
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(name: str) -> ThreadPoolExecutor:
+    """按需创建指定的线程池"""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            max_workers, prefix = _POOL_SIZES[name]
+            executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=prefix)
+            _executors[name] = executor
+        return executor
+
+
+async def _run_in_pool(name: str, func: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(name), functools.partial(func, *args, **kwargs))
+
+
+async def run_in_disk_pool(func: Callable[..., T], *args, **kwargs) -> T:
+    """在磁盘线程池中执行阻塞操作"""
+    return await _run_in_pool('disk', func, *args, **kwargs)
+
+
+async def run_in_db_pool(func: Callable[..., T], *args, **kwargs) -> T:
+    """在数据库线程池中执行阻塞操作"""
+    return await _run_in_pool('db', func, *args, **kwargs)
+
+
+async def run_in_thumbnail_pool(func: Callable[..., T], *args, **kwargs) -> T:
+    """在缩略图线程池中执行图片解码和缩放"""
+    return await _run_in_pool('thumbnail', func, *args, **kwargs)
+
+
+def submit_to_disk_pool(func: Callable[..., T], *args, **kwargs) -> Future:
+    """把不需要等待结果的阻塞操作提交到磁盘线程池"""
+    return _get_executor('disk').submit(func, *args, **kwargs)
+
+
+def shutdown_executors():
+    """关闭线程池，等待已提交的操作完成"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    
+    for executor in executors:
+        executor.shutdown(wait=True)
@@ -6,8 +6,9 @@ import threading
 import time
 from datetime import datetime, timedelta
 from app.database import get_db_context
-from app.models.file import FileNode
 from app.services.file_service import FileService
+from app.services.job_service import JobService
+from app.services.chunk_upload_service import ChunkUploadService
 from app.config import TRASH_RETENTION_DAYS
 
 # 全局变量控制清理线程
@@ -22,35 +23,47 @@ def cleanup_expired_files():
             # 计算过期时间
             expire_date = datetime.utcnow() - timedelta(days=TRASH_RETENTION_DAYS)
             
-            # 查询过期的已删除文件
-            expired_files = db.query(FileNode).filter(
-                FileNode.is_deleted == True,
-                FileNode.deleted_at <= expire_date
-            ).all()
+            # 批量删除过期的已删除文件
+            success_count = FileService(db).purge_trash(deleted_before=expire_date)
             
-            if not expired_files:
+            if not success_count:
                 print("🗑️ 没有过期文件需要清理")
                 return 0
             
-            file_service = FileService(db)
-            success_count = 0
-            
-            for node in expired_files:
-                try:
-                    if file_service.permanent_delete(node):
-                        success_count += 1
-                        print(f"🗑️ 已清理过期文件: {node.full_path}")
-                except Exception as e:
-                    print(f"⚠️ 清理文件失败 {node.full_path}: {e}")
-            
             print(f"✅ 自动清理完成，共清理 {success_count} 个过期文件")
             return success_count
-            
+    
     except Exception as e:
         print(f"❌ 清理任务失败: {e}")
         return 0
 
 
+def cleanup_expired_jobs():
+    """清理过期的后台任务及其结果文件"""
+    try:
+        with get_db_context() as db:
+            count = JobService(db).cleanup_expired_jobs()
+            if count:
+                print(f"✅ 已清理 {count} 个过期的后台任务")
+            return count
+    except Exception as e:
+        print(f"❌ 清理后台任务失败: {e}")
+        return 0
+
+
+def cleanup_expired_uploads():
+    """清理过期的分片上传会话及其暂存文件"""
+    try:
+        with get_db_context() as db:
+            count = ChunkUploadService(db).cleanup_expired_uploads()
+            if count:
+                print(f"✅ 已清理 {count} 个过期的上传会话")
+            return count
+    except Exception as e:
+        print(f"❌ 清理上传会话失败: {e}")
+        return 0
+
+
 def file_cleaner_worker():
     """文件清理线程工作函数"""
     print("🗑️ 文件清理线程已启动")
@@ -59,13 +72,15 @@ def file_cleaner_worker():
         try:
             # 每24小时执行一次清理
             cleanup_expired_files()
+            cleanup_expired_jobs()
+            cleanup_expired_uploads()
             
             # 等待 24 小时，每分钟检查一次停止信号
             for _ in range(24 * 60):  # 24小时 * 60分钟
                 if _stop_cleaner:
                     break
                 time.sleep(60)  # 等待 1 分钟
-                
+        
         except Exception as e:
             print(f"❌ 清理线程异常: {e}")
             # 异常后等待 1 小时再试
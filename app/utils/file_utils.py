@@ -2,13 +2,43 @@
 文件处理工具函数
 """
 
+import io
 import os
 import zipfile
-import tempfile
-from typing import List, BinaryIO
-from pathlib import Path
+import time
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+from sqlalchemy.orm import object_session
 from app.models.file import FileNode
-from app.config import STORAGE_DIR, PREVIEW_EXTENSIONS
+from app.services.storage_backend import StorageBackend, get_blob_storage, iter_file_range
+from app.config import PREVIEW_EXTENSIONS, STORAGE_DIR
+
+# 流式打包时每次读取的文件块大小
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024
+# 读取文件内容时每次读取的大小
+CONTENT_CHUNK_SIZE = 1024 * 1024
+
+# 音视频预览时按扩展名返回的MIME类型，浏览器据此选择解码器
+AUDIO_MIME_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.aac': 'audio/aac',
+    '.ogg': 'audio/ogg',
+    '.m4a': 'audio/mp4'
+}
+VIDEO_MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.mov': 'video/quicktime',
+    '.wmv': 'video/x-ms-wmv',
+    '.webm': 'video/webm',
+    '.m4v': 'video/mp4'
+}
+
+# ZIP条目的内容来源：None 表示目录，字符串为本地文件路径，
+# 元组为不能直接读取本地文件的数据块（读取用的存储后端，存储标识，文件大小）
+ZipSource = Union[None, str, Tuple[StorageBackend, str, int]]
 
 
 def is_image(node: FileNode) -> bool:
@@ -46,67 +76,152 @@ def is_video(node: FileNode) -> bool:
     return node.file_extension in PREVIEW_EXTENSIONS.get('video', set())
 
 
+def media_type_for(node: FileNode) -> str:
+    """音视频文件预览时使用的MIME类型"""
+    if is_audio(node):
+        return AUDIO_MIME_TYPES.get(node.file_extension, 'audio/mpeg')
+    return VIDEO_MIME_TYPES.get(node.file_extension, 'video/mp4')
+
+
 def can_preview(node: FileNode) -> bool:
     """判断文件是否可以预览"""
     return is_image(node) or is_text(node) or is_pdf(node) or is_audio(node) or is_video(node)
 
 
+def iter_node_content(node: FileNode, start: int = 0, end: Optional[int] = None,
+                      chunk_size: int = CONTENT_CHUNK_SIZE) -> Iterator[bytes]:
+    """按块读取文件内容中 [start, end] 的字节（end 包含在内，为空时读到末尾）
+    
+    在调用时就确定内容的位置，返回的迭代器不再访问数据库会话，可以交给其他线程消费。
+    """
+    if node.blob_id is not None:
+        blob = node.blob
+        return blob.storage.iter_range(blob.storage_key, start, end, chunk_size)
+    return iter_file_range(node.legacy_path, start, end, chunk_size)
+
+
+def content_version(node: FileNode) -> str:
+    """文件内容的版本，内容变化时随之变化，用于缓存由内容派生的数据"""
+    if node.blob_id is not None:
+        return node.blob.content_hash[:16]
+    # 旧版按路径存储的文件没有内容哈希，使用修改时间和大小
+    updated_at = int(node.updated_at.timestamp()) if node.updated_at else 0
+    return f"{updated_at:x}{node.file_size or 0:x}"
+
+
 def get_file_content(node: FileNode) -> bytes:
     """读取文件内容"""
     if not node.is_file or node.is_deleted:
         raise ValueError("无效的文件节点")
     
     file_path = node.physical_path
-    if not os.path.exists(file_path):
+    if file_path is not None and not os.path.exists(file_path):
         raise FileNotFoundError(f"文件不存在: {file_path}")
     
-    with open(file_path, 'rb') as f:
-        return f.read()
+    return b''.join(iter_node_content(node))
 
 
-def get_text_content(node: FileNode, encoding: str = 'utf-8') -> str:
-    """读取文本文件内容"""
-    if not is_text(node):
-        raise ValueError("不是文本文件")
+def iter_zip_from_nodes(nodes: List[FileNode], base_path: str = "",
+                        progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """从文件节点列表流式生成ZIP文件
     
-    content = get_file_content(node)
+    先收集要打包的条目，再返回一个逐块产出ZIP数据的生成器，
+    本地文件头、文件数据和中央目录在生成过程中依次输出，
+    内存占用与目录大小无关。progress 会以已读取的源文件字节数调用。
+    """
+    if not nodes:
+        raise ValueError("没有要打包的文件")
     
-    # 尝试不同的编码
-    encodings = [encoding, 'utf-8', 'gbk', 'gb2312', 'latin-1']
+    # 确定根节点：如果是单个目录，则使用该目录作为根节点
+    root_node = None
+    if len(nodes) == 1 and nodes[0].is_directory:
+        root_node = nodes[0]
     
-    for enc in encodings:
-        try:
-            return content.decode(enc)
-        except UnicodeDecodeError:
-            continue
+    entries = []
+    for node in nodes:
+        _collect_zip_entries(entries, node, base_path, root_node)
     
-    # 如果所有编码都失败，使用错误处理
-    return content.decode('utf-8', errors='replace')
+    return _iter_zip_entries(entries, progress)
 
 
-def create_zip_from_nodes(nodes: List[FileNode], base_path: str = "") -> bytes:
-    """从文件节点列表创建ZIP文件"""
-    if not nodes:
-        raise ValueError("没有要打包的文件")
+class _ZipOutputBuffer(io.RawIOBase):
+    """只写、不可seek的ZIP输出缓冲区
+    
+    zipfile 检测到输出流不可seek时会使用数据描述符写入，
+    因此可以边写边取走已生成的数据。
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
     
-    # 创建临时文件
-    with tempfile.NamedTemporaryFile() as temp_file:
-        with zipfile.ZipFile(temp_file.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # 确定根节点：如果是单个目录，则使用该目录作为根节点
-            root_node = None
-            if len(nodes) == 1 and nodes[0].is_directory:
-                root_node = nodes[0]
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def drain(self) -> bytes:
+        """取出缓冲区中已生成的数据"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _iter_zip_entries(entries: List[Tuple[str, ZipSource]],
+                      progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """按条目顺序生成ZIP数据块"""
+    output = _ZipOutputBuffer()
+    bytes_read = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for zip_path, source in entries:
+            if source is None:
+                # 目录项，以/结尾
+                zipf.writestr(zip_path + '/', '')
+            else:
+                if isinstance(source, str):
+                    try:
+                        zinfo = zipfile.ZipInfo.from_file(source, zip_path, strict_timestamps=False)
+                    except OSError:
+                        # 文件在打包过程中消失，跳过
+                        continue
+                    chunks = iter_file_range(source, 0, None, ZIP_STREAM_CHUNK_SIZE)
+                else:
+                    # 其他存储后端中的数据块没有本地文件属性，使用打包时的时间；
+                    # zipfile 按预先给出的大小决定是否写入 ZIP64 扩展，超过 4GB 的文件需要
+                    storage, storage_key, size = source
+                    zinfo = zipfile.ZipInfo(zip_path, time.localtime()[:6])
+                    zinfo.file_size = size
+                    chunks = storage.iter_range(storage_key, chunk_size=ZIP_STREAM_CHUNK_SIZE)
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with zipf.open(zinfo, 'w') as dest:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        bytes_read += len(chunk)
+                        if progress:
+                            progress(bytes_read)
+                        data = output.drain()
+                        if data:
+                            yield data
             
-            for node in nodes:
-                _add_node_to_zip(zipf, node, base_path, root_node)
-        
-        # 读取ZIP文件内容
-        temp_file.seek(0)
-        return temp_file.read()
+            data = output.drain()
+            if data:
+                yield data
+    
+    # 中央目录在关闭时写入
+    data = output.drain()
+    if data:
+        yield data
 
 
-def _add_node_to_zip(zipf: zipfile.ZipFile, node: FileNode, base_path: str = "", root_node: FileNode = None):
-    """递归添加节点到ZIP文件"""
+def _collect_zip_entries(entries: list, node: FileNode, base_path: str = "", root_node: FileNode = None):
+    """递归收集节点在ZIP中的路径和对应的物理文件"""
     if node.is_deleted:
         return
     
@@ -136,22 +251,48 @@ def _add_node_to_zip(zipf: zipfile.ZipFile, node: FileNode, base_path: str = "",
     
     if node.is_file:
         # 添加文件
-        file_path = node.physical_path
-        if os.path.exists(file_path):
-            zipf.write(file_path, zip_path)
+        source = _node_zip_source(node)
+        if not isinstance(source, str) or os.path.exists(source):
+            entries.append((zip_path, source))
     
     elif node.is_directory:
-        # 添加目录（如果为空目录，创建一个空目录项）
-        children = node.get_children()
-        if not children:
-            # 空目录，添加一个以/结尾的路径
-            zipf.writestr(zip_path + '/', '')
-        else:
-            # 创建目录项（即使非空目录也要创建目录项以保持结构）
-            zipf.writestr(zip_path + '/', '')
-            # 递归添加子节点
-            for child in children:
-                _add_node_to_zip(zipf, child, zip_path, root_node)
+        # 创建目录项（即使非空目录也要创建目录项以保持结构）
+        entries.append((zip_path, None))
+        # 一次查询取出整棵子树，按相对路径添加
+        for row in _get_subtree(node):
+            child_zip_path = zip_path + row.full_path[len(node.full_path):]
+            if row.node_type == 'directory':
+                entries.append((child_zip_path, None))
+            else:
+                # 物理文件缺失时在打包阶段跳过，这里不逐个检查
+                entries.append((child_zip_path, _subtree_row_zip_source(row)))
+
+
+def _get_subtree(node: FileNode) -> list:
+    """获取节点的所有未删除后代"""
+    from app.services.file_service import FileService
+    return FileService(object_session(node)).get_subtree(node)
+
+
+def _node_zip_source(node: FileNode) -> ZipSource:
+    """获取文件节点在ZIP中的内容来源"""
+    if node.blob_id is not None:
+        return _blob_zip_source(node.blob.storage, node.blob.storage_key, node.blob.size)
+    return node.legacy_path
+
+
+def _subtree_row_zip_source(row) -> ZipSource:
+    """获取子树查询结果中文件的内容来源"""
+    if row.storage_key:
+        storage = get_blob_storage(row.backend, row.encoding, row.encoded_size)
+        return _blob_zip_source(storage, row.storage_key, row.file_size)
+    return os.path.join(str(STORAGE_DIR), row.full_path.lstrip('/'))
+
+
+def _blob_zip_source(storage: StorageBackend, storage_key: str, size: int) -> ZipSource:
+    """数据块可以直接读取本地文件时返回路径，否则返回（存储后端，存储标识，文件大小）"""
+    local_path = storage.local_path(storage_key)
+    return local_path if local_path is not None else (storage, storage_key, size)
 
 
 def format_file_size(size_bytes: int) -> str:
@@ -256,8 +397,8 @@ def calculate_directory_size(node: FileNode) -> int:
         return node.file_size or 0
     
     total_size = 0
-    for child in node.get_all_descendants():
-        if child.is_file and not child.is_deleted:
-            total_size += child.file_size or 0
+    for row in _get_subtree(node):
+        if row.node_type == 'file':
+            total_size += row.file_size or 0
     
     return total_size
\ No newline at end of file
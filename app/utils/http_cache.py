@@ -0,0 +1,114 @@
+"""
+HTTP 缓存
+
+文件内容、文本预览、缩略图、静态资源和模板页面的响应都带有强 ETag 和 Cache-Control。
+文件的 ETag 由内容版本（内容哈希，旧版文件为修改时间和大小）生成，页面的 ETag 由渲染结果生成。
+客户端用 If-None-Match / If-Modified-Since 重新验证且内容未变化时返回 304，不读取文件内容。
+各类路由的 Cache-Control 在 config 中分别配置。
+"""
+
+import calendar
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Sequence
+from urllib.parse import parse_qs
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
+from app.models.file import FileNode
+from app.utils.file_utils import content_version
+from app.config import CACHE_CONTROL_PAGES, CACHE_CONTROL_STATIC, CACHE_CONTROL_STATIC_VERSIONED
+
+
+def node_validators(node: FileNode, cache_control: str, variant: Optional[str] = None) -> dict:
+    """由文件内容派生的响应的缓存头
+    
+    同一文件的不同表示（如缩略图的不同尺寸、文本预览的不同窗口）用 variant 区分 ETag。
+    """
+    version = content_version(node)
+    headers = {
+        'ETag': f'"{version}-{variant}"' if variant else f'"{version}"',
+        'Cache-Control': cache_control,
+    }
+    if node.updated_at:
+        headers['Last-Modified'] = formatdate(calendar.timegm(node.updated_at.utctimetuple()), usegmt=True)
+    return headers
+
+
+def _etag_in(header: str, etags: Sequence[str]) -> bool:
+    """按弱比较判断 If-None-Match 中是否包含给定的 ETag"""
+    if header.strip() == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+def _parse_http_date(value: str):
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[str],
+                    other_etags: Sequence[str] = ()) -> bool:
+    """客户端缓存的内容是否仍然有效，有 If-None-Match 时忽略 If-Modified-Since
+    
+    other_etags 为同一内容的其他表示的 ETag（如 gzip 编码发送时），也视为匹配。
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_in(if_none_match, [etag, *other_etags])
+    
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified:
+        since = _parse_http_date(if_modified_since)
+        modified = _parse_http_date(last_modified)
+        return since is not None and modified is not None and modified <= since
+    return False
+
+
+def not_modified_response(request: Request, headers: dict) -> Optional[Response]:
+    """缓存仍然有效时返回 304 响应，否则返回 None"""
+    if is_not_modified(request, headers['ETag'], headers.get('Last-Modified')):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def page_response(request: Request, response: Response) -> Response:
+    """为模板渲染的页面加上由页面内容生成的 ETag，内容未变化时返回 304"""
+    headers = {
+        'ETag': f'"{hashlib.sha256(response.body).hexdigest()[:16]}"',
+        'Cache-Control': CACHE_CONTROL_PAGES,
+    }
+    if is_not_modified(request, headers['ETag'], None):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+
+class CachedStaticFiles(StaticFiles):
+    """静态文件服务，按地址中是否带有版本号（?v=）设置 Cache-Control
+    
+    ETag 由文件的修改时间和大小生成。Starlette 生成的 ETag 没有引号，这里加上引号作为强 ETag，
+    并按与文件内容相同的规则处理 If-None-Match / If-Modified-Since。
+    """
+    
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, method=scope['method'])
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        headers = {
+            'ETag': f'"{response.headers["etag"].strip(chr(34))}"',
+            'Last-Modified': response.headers['last-modified'],
+            'Cache-Control': CACHE_CONTROL_STATIC_VERSIONED if query.get('v') else CACHE_CONTROL_STATIC,
+        }
+        if is_not_modified(Request(scope), headers['ETag'], headers['Last-Modified']):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return response
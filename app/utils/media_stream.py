@@ -0,0 +1,287 @@
+"""
+文件内容的HTTP响应
+
+预览和下载共用同一套响应逻辑：
+- 响应带有 ETag、Last-Modified 和 Cache-Control，If-None-Match / If-Modified-Since 命中时
+  返回 304，不读取文件内容，也不记录访问；
+- 支持单个范围、多个范围（multipart/byteranges）和后缀范围（bytes=-N）的 Range 请求，
+  If-Range 与当前内容不一致时返回完整内容；
+- 完整内容在客户端接受 gzip 时原样发送压缩存放的数据；
+- 本地文件的完整内容和单个范围由 FileRangeResponse 按 DOWNLOAD_READ_SIZE 对齐的大块读取发送。
+"""
+
+import os
+import uuid
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.config import DOWNLOAD_READ_SIZE, CACHE_CONTROL_FILES
+from app.models.file import FileNode
+from app.services.tiering_service import record_access
+from app.utils.compression import accepts_gzip
+from app.utils.executors import run_in_disk_pool, run_in_db_pool
+from app.utils.file_utils import iter_node_content
+from app.utils.http_cache import node_validators, is_not_modified, not_modified_response
+from app.utils.text_preview import read_text_preview
+
+# 合并重叠的范围后最多处理的范围数，更多的范围按完整内容响应
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求中没有可以满足的范围"""
+
+
+def content_disposition(filename: str, disposition_type: str = 'attachment') -> str:
+    """生成 Content-Disposition 头，非 ASCII 文件名使用 RFC 5987 编码"""
+    try:
+        filename.encode('ascii')
+        return f'{disposition_type}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition_type}; filename*=UTF-8''{quote(filename.encode('utf-8'))}"
+
+
+def parse_range_header(range_header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """解析 Range 请求头，返回按起始位置排序、合并了重叠部分的 [start, end] 范围列表
+    
+    无法识别的写法、范围过多或内容为空时返回 None，按完整内容响应；
+    所有范围都超出内容大小时抛出 RangeNotSatisfiable。
+    """
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip() or size == 0:
+        return None
+    
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, separator, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not separator:
+            return None
+        if not first:
+            # 后缀范围：最后 N 个字节
+            if not last.isdigit():
+                return None
+            length = int(last)
+            if length > 0:
+                ranges.append((max(0, size - length), size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    
+    if not ranges:
+        raise RangeNotSatisfiable()
+    
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class FileRangeResponse(StreamingResponse):
+    """发送本地文件中 [start, end] 的字节
+    
+    在磁盘线程池中按 DOWNLOAD_READ_SIZE 对齐读取后发送，并提示内核按顺序预读，每 GB 只需几百次读取。
+    uvicorn 不向应用提供套接字，也不支持 zerocopysend / pathsend 扩展，因此不使用 sendfile。
+    """
+    
+    def __init__(self, path: str, start: int, end: int, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: Optional[str] = None):
+        self.path = path
+        self.start = start
+        self.end = end
+        headers = {**(headers or {}), 'Content-Length': str(max(0, end - start + 1))}
+        super().__init__(self._iter_chunks(), status_code=status_code, headers=headers, media_type=media_type)
+    
+    async def _iter_chunks(self):
+        """按块读取文件，第一次读取到 DOWNLOAD_READ_SIZE 的整数倍为止，之后每次都从对齐的位置读取"""
+        fd = await run_in_disk_pool(os.open, self.path, os.O_RDONLY)
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, self.start, max(0, self.end - self.start + 1), os.POSIX_FADV_SEQUENTIAL)
+            position = self.start
+            while position <= self.end:
+                size = min(DOWNLOAD_READ_SIZE - position % DOWNLOAD_READ_SIZE, self.end + 1 - position)
+                chunk = await run_in_disk_pool(os.pread, fd, size, position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+
+def encoded_etag(etag: str) -> str:
+    """gzip 编码发送的内容是另一种表示，使用不同的 ETag"""
+    return f'{etag[:-1]}-gzip"'
+
+
+def content_not_modified(request: Request, headers: dict) -> bool:
+    """客户端缓存的文件内容是否仍然有效，按 gzip 编码发送的表示也视为匹配"""
+    etag = headers['ETag']
+    return is_not_modified(request, etag, headers.get('Last-Modified'), (encoded_etag(etag),))
+
+
+def if_range_matches(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    """If-Range 与当前内容一致时才按 Range 响应，ETag 使用强比较"""
+    if_range = request.headers.get('if-range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+def serves_content(request: Request, size: int, etag: str, last_modified: Optional[str]) -> bool:
+    """响应是否发送内容，只有无法满足的范围（返回 416）不发送"""
+    range_header = request.headers.get('range')
+    if not range_header or not if_range_matches(request, etag, last_modified):
+        return True
+    try:
+        parse_range_header(range_header, size)
+    except RangeNotSatisfiable:
+        return False
+    return True
+
+
+def node_content_response(node: FileNode, media_type: str, size: int, filename: Optional[str] = None,
+                          headers: Optional[dict] = None, accept_encoding: Optional[str] = None):
+    """返回文件的完整内容
+    
+    内容在本地磁盘时使用 FileRangeResponse，在其他存储后端时从后端流式读取。
+    压缩存放的内容在客户端接受 gzip 时原样发送，不需要解压。
+    """
+    headers = dict(headers or {})
+    if filename:
+        headers['Content-Disposition'] = content_disposition(filename)
+    
+    file_path = node.physical_path
+    if file_path is not None:
+        return FileRangeResponse(file_path, 0, size - 1, media_type=media_type, headers=headers)
+    
+    blob = node.blob if node.blob_id is not None else None
+    if blob is not None and blob.encoding:
+        headers['Vary'] = 'Accept-Encoding'
+        if accepts_gzip(accept_encoding):
+            # 范围请求针对的是解压后的内容，压缩后的响应不支持范围请求
+            headers.pop('Accept-Ranges', None)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Content-Length'] = str(blob.encoded_size)
+            if 'ETag' in headers:
+                headers['ETag'] = encoded_etag(headers['ETag'])
+            return StreamingResponse(blob.storage.iter_encoded(blob.storage_key),
+                                     media_type=media_type, headers=headers)
+    
+    headers['Content-Length'] = str(size)
+    return StreamingResponse(iter_node_content(node), media_type=media_type, headers=headers)
+
+
+def _resolve_content(node: FileNode, cache_control: str) -> Tuple[dict, Optional[str]]:
+    """生成缓存头并确定内容在本地磁盘上的路径
+    
+    两者都可能加载文件节点关联的数据块记录，在数据库线程池中调用，
+    之后在事件循环中使用节点时不会再触发数据库查询。
+    """
+    return node_validators(node, cache_control), node.physical_path
+
+
+async def content_response(request: Request, node: FileNode, media_type: str,
+                           filename: Optional[str] = None, inline: bool = False,
+                           headers: Optional[dict] = None, cache_control: str = CACHE_CONTROL_FILES) -> Response:
+    """按请求头返回文件内容的完整响应、范围响应或 304"""
+    validators, file_path = await run_in_db_pool(_resolve_content, node, cache_control)
+    if content_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
+    
+    if file_path is not None:
+        try:
+            size = await run_in_disk_pool(os.path.getsize, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="文件不存在")
+    else:
+        size = node.file_size or 0
+    await run_in_db_pool(record_access, node)
+    
+    etag, last_modified = validators['ETag'], validators.get('Last-Modified')
+    headers = {**(headers or {}), **validators, 'Accept-Ranges': 'bytes'}
+    if filename:
+        headers['Content-Disposition'] = content_disposition(filename, 'inline' if inline else 'attachment')
+    
+    range_header = request.headers.get('range')
+    if range_header and if_range_matches(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**validators, 'Content-Range': f'bytes */{size}'})
+        if ranges:
+            return _range_response(node, file_path, ranges, size, media_type, headers)
+    
+    return node_content_response(node, media_type, size, headers=headers,
+                                 accept_encoding=request.headers.get('accept-encoding'))
+
+
+async def text_preview_response(request: Request, node: FileNode, offset: Optional[int], limit: int,
+                                start_line: Optional[int], line_count: int,
+                                cache_control: str = CACHE_CONTROL_FILES) -> Response:
+    """文本预览的JSON响应，ETag 由内容版本和窗口参数生成"""
+    window = f'l{start_line}-{line_count}' if start_line is not None else f'b{offset or 0}-{limit}'
+    validators = await run_in_db_pool(node_validators, node, cache_control, window)
+    not_modified = not_modified_response(request, validators)
+    if not_modified is not None:
+        return not_modified
+    
+    await run_in_db_pool(record_access, node)
+    preview = await run_in_disk_pool(read_text_preview, node, offset, limit, start_line, line_count)
+    return JSONResponse(preview, headers=validators)
+
+
+def _range_response(node: FileNode, file_path: Optional[str], ranges: List[Tuple[int, int]], size: int,
+                    media_type: str, headers: dict) -> StreamingResponse:
+    """返回 206 响应，多个范围时使用 multipart/byteranges"""
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        if file_path is not None:
+            return FileRangeResponse(file_path, start, end, status_code=206,
+                                     media_type=media_type, headers=headers)
+        headers['Content-Length'] = str(end - start + 1)
+        return StreamingResponse(iter_node_content(node, start, end), status_code=206,
+                                 media_type=media_type, headers=headers)
+    
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        f'\r\n--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode()
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    # 在返回前确定每个范围的读取位置，生成响应体时不再访问数据库会话
+    parts = [iter_node_content(node, start, end) for start, end in ranges]
+    
+    def iter_parts():
+        for part_header, part in zip(part_headers, parts):
+            yield part_header
+            yield from part
+        yield closing
+    
+    headers['Content-Length'] = str(
+        sum(len(part_header) for part_header in part_headers)
+        + sum(end - start + 1 for start, end in ranges) + len(closing)
+    )
+    return StreamingResponse(iter_parts(), status_code=206,
+                             media_type=f'multipart/byteranges; boundary={boundary}', headers=headers)
@@ -0,0 +1,89 @@
+"""
+后台删除物理文件
+"""
+
+import os
+import queue
+import shutil
+import functools
+import threading
+from typing import Callable, Iterable
+
+# 等待删除的文件或目录路径，以及其他清理操作
+_remove_queue = queue.Queue()
+_remover_thread = None
+_remover_lock = threading.Lock()
+
+
+def schedule_removal(paths: Iterable[str]):
+    """把要删除的文件或目录交给后台线程，调用方不等待磁盘操作完成"""
+    paths = [path for path in paths if path]
+    if not paths:
+        return
+    
+    _ensure_remover()
+    for path in paths:
+        _remove_queue.put(path)
+
+
+def schedule_call(func: Callable, *args):
+    """把其他清理操作（如删除对象存储中的数据块）交给同一个后台线程"""
+    _ensure_remover()
+    _remove_queue.put(functools.partial(func, *args))
+
+
+def schedule_call_later(delay: float, func: Callable, *args):
+    """延迟 delay 秒后再把清理操作交给后台线程，用于可能仍有读取方在使用的数据
+    
+    定时器不会保留到服务重启之后，必须执行的清理需要另外记录下来。
+    """
+    if delay <= 0:
+        schedule_call(func, *args)
+        return
+    timer = threading.Timer(delay, schedule_call, (func, *args))
+    timer.daemon = True
+    timer.start()
+
+
+def wait_for_removals():
+    """等待已提交的删除全部完成"""
+    _remove_queue.join()
+
+
+def remove_path(path: str):
+    """删除文件或整个目录，路径不存在时忽略"""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: Failed to remove {path}: {e}")
+
+
+def _ensure_remover():
+    """按需启动后台删除线程"""
+    global _remover_thread
+    
+    with _remover_lock:
+        if _remover_thread is not None and _remover_thread.is_alive():
+            return
+        _remover_thread = threading.Thread(target=_remover_worker, name="path-remover", daemon=True)
+        _remover_thread.start()
+
+
+def _remover_worker():
+    """后台删除线程工作函数"""
+    while True:
+        item = _remove_queue.get()
+        try:
+            if callable(item):
+                item()
+            else:
+                remove_path(item)
+        except Exception as e:
+            print(f"Warning: Background removal failed: {e}")
+        finally:
+            _remove_queue.task_done()
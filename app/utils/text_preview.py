@@ -0,0 +1,258 @@
+"""
+按窗口读取的文本预览
+
+文本预览每次只读取和解码文件的一个窗口，窗口按字节偏移或按行号指定，
+大小不超过 PREVIEW_TEXT_MAX_SIZE。编码只根据文件开头的一小段样本检测。
+
+按行预览使用稀疏的行索引：每隔 PREVIEW_LINE_INDEX_STRIDE 行记录一次该行的字节偏移，
+第一次按行预览时扫描一遍文件生成，之后读取任意行只需从最近的索引点向后读取。
+编码和行索引按文件内容版本缓存在内存中，内容变化后自动失效。
+"""
+
+import codecs
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Optional, Tuple
+from app.models.file import FileNode
+from app.utils.file_utils import content_version, iter_node_content, is_text
+from app.config import (
+    PREVIEW_TEXT_MAX_SIZE, PREVIEW_TEXT_DEFAULT_SIZE, PREVIEW_TEXT_DEFAULT_LINES,
+    PREVIEW_ENCODING_SAMPLE_SIZE, PREVIEW_LINE_INDEX_STRIDE, PREVIEW_TEXT_CACHE_ENTRIES
+)
+
+# 字节顺序标记及对应的编码，按长度从长到短检查
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# 没有字节顺序标记时依次尝试的编码，latin-1 可以解码任意字节，作为最后的选择
+_CANDIDATE_ENCODINGS = ('utf-8', 'gbk')
+_FALLBACK_ENCODING = 'latin-1'
+
+
+class TextInfo:
+    """文本文件的编码和行索引"""
+    
+    def __init__(self, size: int, encoding: str, bom_length: int):
+        self.size = size
+        self.encoding = encoding
+        self.bom_length = bom_length
+        self.line_offsets: Optional[array] = None  # 第 i 项为第 i * PREVIEW_LINE_INDEX_STRIDE 行的字节偏移
+        self.total_lines: Optional[int] = None
+
+
+_text_infos: "OrderedDict[Tuple[int, str], TextInfo]" = OrderedDict()
+_text_infos_lock = threading.Lock()
+
+
+def detect_encoding(sample: bytes) -> Tuple[str, int]:
+    """根据文件开头的样本检测编码，返回（编码，字节顺序标记的长度）"""
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding, len(bom)
+    
+    for encoding in _CANDIDATE_ENCODINGS:
+        try:
+            # 样本末尾可能截断在多字节字符中间，不作为最终输入解码
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding, 0
+        except UnicodeDecodeError:
+            continue
+    return _FALLBACK_ENCODING, 0
+
+
+def get_text_info(node: FileNode) -> TextInfo:
+    """获取文件的编码信息，首次读取时检测并缓存"""
+    if not is_text(node):
+        raise ValueError("不是文本文件")
+    
+    key = (node.id, content_version(node))
+    with _text_infos_lock:
+        info = _text_infos.get(key)
+        if info is not None:
+            _text_infos.move_to_end(key)
+            return info
+    
+    size = node.file_size or 0
+    sample = _read_range(node, 0, min(size, PREVIEW_ENCODING_SAMPLE_SIZE) - 1) if size else b''
+    encoding, bom_length = detect_encoding(sample)
+    info = TextInfo(size, encoding, bom_length)
+    
+    with _text_infos_lock:
+        info = _text_infos.setdefault(key, info)
+        _text_infos.move_to_end(key)
+        while len(_text_infos) > PREVIEW_TEXT_CACHE_ENTRIES:
+            _text_infos.popitem(last=False)
+    return info
+
+
+def read_text_preview(node: FileNode, offset: Optional[int] = None, limit: int = PREVIEW_TEXT_DEFAULT_SIZE,
+                      start_line: Optional[int] = None,
+                      line_count: int = PREVIEW_TEXT_DEFAULT_LINES) -> dict:
+    """文本预览接口的返回内容，指定 start_line 时按行读取，否则按字节读取"""
+    if start_line is not None:
+        window = read_text_lines(node, start_line, line_count)
+    else:
+        window = read_text_window(node, offset or 0, limit)
+    return {
+        "type": "text",
+        "filename": node.name,
+        "size": node.file_size,
+        **window
+    }
+
+
+def read_text_window(node: FileNode, offset: int = 0, limit: int = PREVIEW_TEXT_DEFAULT_SIZE) -> dict:
+    """读取从字节偏移 offset 开始、最多 limit 字节的文本
+    
+    窗口两端落在多字节字符中间时，开头跳过不完整的字符，末尾不完整的字符留给下一个窗口，
+    返回的 next_offset 是下一个窗口的起始偏移。
+    """
+    info = get_text_info(node)
+    limit = max(1, min(limit, PREVIEW_TEXT_MAX_SIZE))
+    start = max(offset, info.bom_length)
+    end = min(start + limit, info.size) - 1
+    data = _read_range(node, start, end) if start <= end else b''
+    
+    # 跳过开头不完整的字符：UTF-8 的后续字节以二进制 10 开头，UTF-16 按两字节对齐
+    skip = 0
+    if info.encoding == 'utf-8':
+        while skip < min(3, len(data)) and data[skip] & 0xC0 == 0x80:
+            skip += 1
+    elif info.encoding.startswith('utf-16') and (start - info.bom_length) % 2:
+        skip = 1
+    
+    at_end = end + 1 >= info.size
+    decoder = codecs.getincrementaldecoder(info.encoding)(errors='replace')
+    content = decoder.decode(data[skip:], final=at_end)
+    next_offset = start + len(data) - len(decoder.getstate()[0])
+    
+    return {
+        "content": content,
+        "encoding": info.encoding,
+        "offset": start,
+        "next_offset": next_offset if next_offset < info.size else None,
+        "has_more": next_offset < info.size,
+    }
+
+
+def read_text_lines(node: FileNode, start_line: int = 0, line_count: int = PREVIEW_TEXT_DEFAULT_LINES) -> dict:
+    """读取从第 start_line 行（从0开始）开始的 line_count 行文本
+    
+    返回的内容不超过 PREVIEW_TEXT_MAX_SIZE 字节，超出时在最后一个完整的行处截断；
+    单独一行就超过该大小时只返回该行的开头部分。
+    """
+    info = get_text_info(node)
+    if info.encoding.startswith('utf-16'):
+        raise ValueError("UTF-16 编码的文件不支持按行预览")
+    _ensure_line_index(node, info)
+    
+    total_lines = info.total_lines
+    if start_line >= total_lines:
+        return _lines_result("", info, total_lines, total_lines, False)
+    
+    block = start_line // PREVIEW_LINE_INDEX_STRIDE
+    position = info.line_offsets[block]
+    skip_lines = start_line - block * PREVIEW_LINE_INDEX_STRIDE
+    
+    buffer = bytearray()
+    lines_read = 0
+    truncated = False
+    for chunk in iter_node_content(node, position):
+        # 跳过索引点到起始行之间的行
+        while skip_lines and chunk:
+            newline = chunk.find(b'\n')
+            if newline < 0:
+                chunk = b''
+                break
+            chunk = chunk[newline + 1:]
+            skip_lines -= 1
+        if skip_lines:
+            continue
+        
+        buffer += chunk
+        lines_read, cut = _find_line_end(buffer, line_count)
+        if cut is not None:
+            del buffer[cut:]
+            break
+        if len(buffer) > PREVIEW_TEXT_MAX_SIZE:
+            break
+    else:
+        # 读到文件末尾，最后一行可能没有换行符
+        lines_read = min(line_count, buffer.count(b'\n') + (1 if buffer and not buffer.endswith(b'\n') else 0))
+    
+    if len(buffer) > PREVIEW_TEXT_MAX_SIZE:
+        # 在预算内最后一个完整的行处截断，第一行就超出预算时截断该行
+        last_newline = buffer.rfind(b'\n', 0, PREVIEW_TEXT_MAX_SIZE)
+        if last_newline >= 0:
+            del buffer[last_newline + 1:]
+            lines_read = buffer.count(b'\n')
+        else:
+            del buffer[PREVIEW_TEXT_MAX_SIZE:]
+            lines_read = 1
+            truncated = True
+    
+    content = bytes(buffer).decode(info.encoding, errors='replace')
+    return _lines_result(content, info, start_line, start_line + lines_read, truncated)
+
+
+def _lines_result(content: str, info: TextInfo, start_line: int, next_line: int, truncated: bool) -> dict:
+    """按行预览的返回结果"""
+    return {
+        "content": content,
+        "encoding": info.encoding,
+        "start_line": start_line,
+        "next_line": next_line if next_line < info.total_lines else None,
+        "total_lines": info.total_lines,
+        "has_more": next_line < info.total_lines,
+        "truncated": truncated,
+    }
+
+
+def _find_line_end(buffer: bytearray, line_count: int) -> Tuple[int, Optional[int]]:
+    """返回（缓冲区中完整的行数，第 line_count 行末尾的位置），行数不足时位置为 None"""
+    position = -1
+    for lines in range(line_count):
+        position = buffer.find(b'\n', position + 1)
+        if position < 0:
+            return lines, None
+    return line_count, position + 1
+
+
+def _ensure_line_index(node: FileNode, info: TextInfo):
+    """扫描文件生成稀疏行索引"""
+    if info.line_offsets is not None:
+        return
+    
+    offsets = array('Q', [info.bom_length])
+    newlines = 0
+    position = info.bom_length
+    last_byte = b''
+    for chunk in iter_node_content(node, info.bom_length):
+        count = chunk.count(b'\n')
+        next_indexed = len(offsets) * PREVIEW_LINE_INDEX_STRIDE
+        if newlines + count >= next_indexed:
+            # 本块中第 j 个换行符之后的行从前 j 段的长度之和加 j 处开始，长度的累加在C中完成
+            ends = list(accumulate(map(len, chunk.split(b'\n'))))
+            for line in range(next_indexed, newlines + count + 1, PREVIEW_LINE_INDEX_STRIDE):
+                j = line - newlines
+                offsets.append(position + ends[j - 1] + j)
+        newlines += count
+        position += len(chunk)
+        last_byte = chunk[-1:] or last_byte
+    
+    # 文件末尾没有换行符时最后一行也算一行
+    total_lines = newlines + (1 if position > info.bom_length and last_byte != b'\n' else 0)
+    # 恰好以换行符结尾时最后一个索引点指向文件末尾，不对应任何行
+    while len(offsets) > 1 and (len(offsets) - 1) * PREVIEW_LINE_INDEX_STRIDE >= total_lines:
+        offsets.pop()
+    info.line_offsets = offsets
+    info.total_lines = total_lines
+
+
+def _read_range(node: FileNode, start: int, end: int) -> bytes:
+    """读取文件内容中 [start, end] 的字节"""
+    return b''.join(iter_node_content(node, start, end))
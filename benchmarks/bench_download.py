@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+下载性能测试脚本
+在进程内直接调用下载响应的 ASGI 接口，把响应体写入本地套接字并在另一线程中读出，
+测量单个下载流的吞吐量（GB/s），对比以下几种发送方式：
+
+- legacy-range: 原来的范围下载，Python 生成器每次读取 8192 字节
+- legacy-full:  原来的完整下载，Starlette FileResponse 每次读取 64KB
+- buffered:     FileRangeResponse，在磁盘线程池中按 DOWNLOAD_READ_SIZE 对齐读取
+
+用法（在项目根目录下执行）:
+    python benchmarks/bench_download.py                  # 使用 1GB 的临时文件
+    python benchmarks/bench_download.py --size-mb 256 --rounds 5
+    python benchmarks/bench_download.py --file /path/to/file
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import asyncio
+import tempfile
+import threading
+
+# 直接运行脚本时 sys.path 中只有 benchmarks 目录，加入项目根目录以导入 app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import FileResponse, StreamingResponse
+from app.utils.media_stream import FileRangeResponse
+
+# 生成测试文件时每次写入的大小
+WRITE_BLOCK_SIZE = 4 * 1024 * 1024
+# 读取端每次接收的大小
+RECV_BUFFER_SIZE = 1024 * 1024
+# 原来的范围下载每次读取的大小
+LEGACY_CHUNK_SIZE = 8192
+
+
+def legacy_iterfile(path: str, start: int, end: int):
+    """原来的范围下载生成器"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining:
+            chunk_size = min(LEGACY_CHUNK_SIZE, remaining)
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def make_response(variant: str, path: str, size: int):
+    """按发送方式构造完整文件的响应"""
+    if variant == 'legacy-range':
+        return StreamingResponse(legacy_iterfile(path, 0, size - 1), status_code=206,
+                                 media_type='application/octet-stream')
+    if variant == 'legacy-full':
+        return FileResponse(path, media_type='application/octet-stream')
+    return FileRangeResponse(path, 0, size - 1, media_type='application/octet-stream')
+
+
+class SocketSink:
+    """把 ASGI 消息写入本地套接字，另一线程读出并计数，模拟服务器发送到网络"""
+    
+    def __init__(self):
+        self.writer, self.reader = socket.socketpair()
+        self.received = 0
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+    
+    def _drain(self):
+        buffer = bytearray(RECV_BUFFER_SIZE)
+        while True:
+            count = self.reader.recv_into(buffer)
+            if not count:
+                break
+            self.received += count
+    
+    async def send(self, message: dict):
+        # 读取端在另一线程中，直接在事件循环中阻塞写入，和服务器写入传输层一样不切换线程
+        if message['type'] == 'http.response.body' and message.get('body'):
+            self.writer.sendall(message['body'])
+    
+    def close(self) -> int:
+        self.writer.shutdown(socket.SHUT_WR)
+        self._thread.join()
+        self.writer.close()
+        self.reader.close()
+        return self.received
+
+
+async def run_once(variant: str, path: str, size: int) -> float:
+    """下载一次完整文件，返回耗时（秒）"""
+    disconnected = asyncio.Event()
+    
+    async def receive():
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+    
+    scope = {'type': 'http', 'method': 'GET', 'headers': []}
+    sink = SocketSink()
+    started = time.perf_counter()
+    await make_response(variant, path, size)(scope, receive, sink.send)
+    received = sink.close()
+    elapsed = time.perf_counter() - started
+    disconnected.set()
+    if received != size:
+        raise RuntimeError(f"{variant} 只发送了 {received} / {size} 字节")
+    return elapsed
+
+
+def create_test_file(size: int) -> str:
+    """生成指定大小的随机内容临时文件"""
+    fd, path = tempfile.mkstemp(prefix='bench-download-')
+    block = os.urandom(WRITE_BLOCK_SIZE)
+    with os.fdopen(fd, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    return path
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="测量单个下载流的吞吐量")
+    parser.add_argument('--file', help="使用已有文件，不指定时生成临时文件")
+    parser.add_argument('--size-mb', type=int, default=1024, help="生成的临时文件大小（MB）")
+    parser.add_argument('--rounds', type=int, default=3, help="每种方式下载的次数，取最快的一次")
+    parser.add_argument('--variants', default='legacy-range,legacy-full,buffered',
+                        help="要测试的发送方式，用逗号分隔")
+    args = parser.parse_args()
+    
+    path = args.file or create_test_file(args.size_mb * 1024 * 1024)
+    try:
+        size = os.path.getsize(path)
+        print(f"测试文件: {path} ({size / 1024 ** 3:.2f} GB)")
+        # 先完整读一遍，让各种方式都从页缓存读取
+        with open(path, 'rb') as f:
+            while f.read(WRITE_BLOCK_SIZE):
+                pass
+        
+        for variant in args.variants.split(','):
+            variant = variant.strip()
+            elapsed = min(asyncio.run(run_once(variant, path, size)) for _ in range(args.rounds))
+            print(f"{variant:<14} {size / elapsed / 1024 ** 3:6.2f} GB/s  ({elapsed:.3f}s)")
+    
+    except KeyboardInterrupt:
+        print("\n\n测试已取消")
+        sys.exit(1)
+    finally:
+        if not args.file:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
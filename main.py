@@ -4,7 +4,6 @@
 """
 
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -12,11 +11,16 @@ from contextlib import asynccontextmanager
 import os
 
 # 导入路由模块
-from app.routers import auth, files, share, trash
+from app.routers import auth, files, share, trash, jobs
 from app.database import init_db
 from app.utils.file_cleaner import start_file_cleaner
+from app.services.job_service import JobService, shutdown_job_workers
+from app.utils.executors import shutdown_executors
+from app.services.storage_backend import get_storage_backend
+from app.services.tiering_service import start_tiering_worker, stop_tiering_worker
 from app.middleware.security import SecurityHeadersMiddleware
 from app.middleware.rate_limit import RateLimitMiddleware
+from app.utils.http_cache import CachedStaticFiles, page_response
 from app.config import STORAGE_DIR, TRASH_DIR
 
 # 创建必要的目录
@@ -31,12 +35,18 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时执行
     await init_db()
+    get_storage_backend('local').migrate_flat_layout()  # 旧版平铺的数据块移入分层目录
+    JobService.recover_interrupted_jobs()  # 上次未完成的后台任务标记为中断
     start_file_cleaner()  # 启动文件清理任务
+    start_tiering_worker()  # 启动冷热分层任务
     print("🚀 个人网盘系统启动成功")
     
     yield
     
     # 关闭时执行
+    stop_tiering_worker()
+    shutdown_job_workers()
+    shutdown_executors()
     print("📁 个人网盘系统已关闭")
 
 
@@ -67,8 +77,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 静态文件服务
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# 静态文件服务（带版本号的地址长期缓存，其余每次重新验证）
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # 模板引擎
 templates = Jinja2Templates(directory="templates")
@@ -78,33 +88,34 @@ app.include_router(auth.router, prefix="/auth", tags=["认证"])
 app.include_router(files.router, prefix="/files", tags=["文件管理"])
 app.include_router(trash.router, prefix="/trash", tags=["回收站"])
 app.include_router(share.router, prefix="/share", tags=["分享系统"])
+app.include_router(jobs.router, prefix="/jobs", tags=["后台任务"])
 
 
 @app.get("/")
 async def index(request: Request):
     """首页/根目录"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_response(request, templates.TemplateResponse("index.html", {"request": request}))
 
 
 @app.get("/trash")
 async def trash_page(request: Request):
     """回收站页面"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_response(request, templates.TemplateResponse("index.html", {"request": request}))
 
 
 @app.get("/shares")
 async def shares_page(request: Request):
     """分享管理页面"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_response(request, templates.TemplateResponse("index.html", {"request": request}))
 
 
 @app.get("/{path:path}")
 async def folder_path(request: Request, path: str):
     """文件夹路径页面"""
     # 避免与 API 路径冲突
-    if path.startswith(("auth/", "files/", "trash/", "share/", "health", "static/")):
+    if path.startswith(("auth/", "files/", "trash/", "share/", "jobs/", "health", "static/")):
         raise HTTPException(status_code=404, detail="Not found")
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_response(request, templates.TemplateResponse("index.html", {"request": request}))
 
 
 @app.get("/health")
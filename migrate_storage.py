@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+存储迁移脚本
+将旧版按逻辑目录结构存放在 files/ 和 trash/ 下的文件转换为内容寻址的数据块，
+并把平铺在数据块目录根下的数据块移入分层目录。
+
+用法:
+    python migrate_storage.py            # 执行迁移
+    python migrate_storage.py --dry-run  # 只统计，不修改任何文件
+"""
+
+import os
+import sys
+import argparse
+import asyncio
+from app.database import get_db_context, init_db
+from app.models.file import FileNode
+from app.services.blob_service import BlobService, new_content_hasher
+from app.services.storage_backend import get_storage_backend
+from app.config import STORAGE_DIR, TRASH_DIR
+
+# 每次查询的文件数
+MIGRATE_BATCH_SIZE = 200
+# 计算哈希时每次读取的大小
+READ_CHUNK_SIZE = 1024 * 1024
+# 检测MIME类型读取的开头字节数
+MIME_SNIFF_SIZE = 2048
+
+
+def find_legacy_file(full_path: str) -> str:
+    """查找旧版文件的物理位置
+    
+    被删除目录中的文件随目录一起在 trash 下，节点本身不一定标记为删除，
+    所以两个位置都要检查。找不到时返回空字符串。
+    """
+    relative_path = full_path.lstrip('/')
+    for root in (STORAGE_DIR, TRASH_DIR):
+        path = os.path.join(str(root), relative_path)
+        if os.path.isfile(path):
+            return path
+    return ""
+
+
+def hash_file(path: str):
+    """计算文件的内容哈希，返回（哈希，大小，开头数据）"""
+    hasher = new_content_hasher()
+    size = 0
+    with open(path, 'rb') as f:
+        head = f.read(MIME_SNIFF_SIZE)
+        hasher.update(head)
+        size += len(head)
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size, head
+
+
+def remove_empty_dirs(root: str) -> int:
+    """自底向上删除空目录（保留根目录），返回删除的数量"""
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for dir_path, _, _ in os.walk(root, topdown=False):
+        if dir_path == root:
+            continue
+        try:
+            os.rmdir(dir_path)
+            removed += 1
+        except OSError:
+            pass  # 目录非空
+    return removed
+
+
+def migrate_legacy_files(dry_run: bool) -> dict:
+    """将 blob_id 为空的文件节点转换为数据块"""
+    stats = {'converted': 0, 'deduplicated': 0, 'missing': 0}
+    last_id = 0
+    
+    with get_db_context() as db:
+        blob_service = BlobService(db)
+        while True:
+            nodes = db.query(FileNode).filter(
+                FileNode.node_type == 'file',
+                FileNode.blob_id.is_(None),
+                FileNode.id > last_id
+            ).order_by(FileNode.id).limit(MIGRATE_BATCH_SIZE).all()
+            if not nodes:
+                break
+            last_id = nodes[-1].id
+            
+            for node in nodes:
+                source_path = find_legacy_file(node.full_path)
+                if not source_path:
+                    stats['missing'] += 1
+                    print(f"⚠️ 找不到物理文件: {node.full_path} (id={node.id})")
+                    continue
+                if dry_run:
+                    stats['converted'] += 1
+                    continue
+                
+                content_hash, size, head = hash_file(source_path)
+                blob, created = blob_service.store_file(source_path, content_hash, size, head, node.name)
+                node.blob_id = blob.id
+                node.file_size = size
+                # 源文件已经移入数据块存储，立即提交对应的记录
+                db.commit()
+                stats['converted'] += 1
+                if not created:
+                    stats['deduplicated'] += 1
+            
+            print(f"已处理 {stats['converted'] + stats['missing']} 个文件")
+    
+    return stats
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="将旧版存储转换为分层的数据块存储")
+    parser.add_argument('--dry-run', action='store_true', help="只统计需要迁移的文件，不做修改")
+    args = parser.parse_args()
+    
+    try:
+        print("正在初始化数据库...")
+        asyncio.run(init_db())
+        
+        storage = get_storage_backend('local')
+        if args.dry_run:
+            print(f"平铺存放的数据块: {sum(1 for _ in storage.iter_flat_keys())} 个")
+        else:
+            print(f"✅ 已将 {storage.migrate_flat_layout()} 个数据块移入分层目录")
+        
+        stats = migrate_legacy_files(args.dry_run)
+        print(f"旧版文件: 转换 {stats['converted']} 个，"
+              f"其中内容重复 {stats['deduplicated']} 个，缺失 {stats['missing']} 个")
+        
+        if not args.dry_run:
+            removed = remove_empty_dirs(str(STORAGE_DIR)) + remove_empty_dirs(str(TRASH_DIR))
+            print(f"✅ 已清理 {removed} 个空目录")
+    
+    except KeyboardInterrupt:
+        print("\n\n操作已取消")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ 错误: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ class NetdiskApp {
         this.userInfo = null;
         this.sortOrder = 'name-asc'; // 默认按名称升序排列
         this.isSearchResults = false; // 标记当前是否显示搜索结果
+        this.thumbnailUrls = []; // 当前列表中缩略图的对象URL，重新渲染时释放
+        this.thumbnailObserver = null;
         
         this.init();
     }
@@ -366,6 +368,53 @@ class NetdiskApp {
         
         // 绑定文件项事件
         this.bindFileItemEvents();
+        
+        // 图片文件加载缩略图
+        this.loadThumbnails();
+    }
+    
+    loadThumbnails() {
+        // 释放上一次渲染的缩略图
+        this.thumbnailUrls.forEach(url => URL.revokeObjectURL(url));
+        this.thumbnailUrls = [];
+        if (this.thumbnailObserver) {
+            this.thumbnailObserver.disconnect();
+        }
+        
+        const icons = document.querySelectorAll('.file-icon[data-thumbnail-id]');
+        if (!('IntersectionObserver' in window)) {
+            icons.forEach(icon => this.loadThumbnail(icon));
+            return;
+        }
+        
+        // 只加载滚动到可见区域的缩略图
+        this.thumbnailObserver = new IntersectionObserver((entries, observer) => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    this.loadThumbnail(entry.target);
+                }
+            });
+        }, { rootMargin: '200px' });
+        icons.forEach(icon => this.thumbnailObserver.observe(icon));
+    }
+    
+    async loadThumbnail(icon) {
+        try {
+            const response = await fetch(`/files/thumbnail/${icon.dataset.thumbnailId}?size=64`, {
+                headers: {
+                    'Authorization': `Bearer ${this.accessToken}`,
+                },
+                credentials: 'same-origin'
+            });
+            if (!response.ok) return;
+            
+            const url = URL.createObjectURL(await response.blob());
+            this.thumbnailUrls.push(url);
+            icon.innerHTML = `<img src="${url}" class="file-thumbnail" alt="">`;
+        } catch (error) {
+            // 缩略图加载失败时保留文件图标
+        }
     }
     
     sortItems(items) {
@@ -460,7 +509,7 @@ class NetdiskApp {
         
         return `
             <div class="file-item" data-id="${item.id}" data-name="${item.name}" data-type="${item.type}">
-                <div class="file-icon">${item.icon}</div>
+                <div class="file-icon"${item.has_thumbnail ? ` data-thumbnail-id="${item.id}"` : ''}>${item.icon}</div>
                 <div class="file-info">
                     <div class="file-details">
                         <h4>${this.escapeHtml(displayName)}</h4>
@@ -826,13 +875,13 @@ class NetdiskApp {
                     this.showModal('图片预览', `<img src="${imageUrl}" class="preview-image" alt="预览图片">`);
                 } else if (contentType && contentType.startsWith('audio/')) {
                     // 音频预览
-                    const blob = await response.blob();
-                    const audioUrl = URL.createObjectURL(blob);
+                    // 音频元素直接从服务器按范围读取，拖动进度时不需要下载整个文件
+                    const audioUrl = await this.getMediaUrl(fileId, response);
+                    const mediaSize = Number(response.headers.get('content-length')) || 0;
                     
                     console.log('Audio preview debug:', {
                         contentType,
-                        blobSize: blob.size,
-                        blobType: blob.type,
+                        mediaSize,
                         audioUrl,
                         responseHeaders: Object.fromEntries([...response.headers])
                     });
@@ -850,7 +899,7 @@ class NetdiskApp {
                                 </audio>
                             </div>
                             <div id="audio-info">
-                                <p><small>MIME 类型: ${contentType} | 文件大小: ${this.formatBytes(blob.size)}</small></p>
+                                <p><small>MIME 类型: ${contentType} | 文件大小: ${this.formatBytes(mediaSize)}</small></p>
                                 <div id="audio-status" class="mt-2">
                                     <small class="text-info">🔄 初始化中...</small>
                                 </div>
@@ -859,7 +908,7 @@ class NetdiskApp {
                         </div>
                     `, `
                         <button type="button" class="btn btn-secondary" onclick="window.open('${audioUrl}', '_blank')">在新窗口播放</button>
-                        <button type="button" class="btn btn-primary" onclick="app.closeModal(); URL.revokeObjectURL('${audioUrl}')">关闭</button>
+                        <button type="button" class="btn btn-primary" onclick="app.closeModal()">关闭</button>
                     `);
                     
                     // 添加音频加载和错误事件监听器
@@ -871,9 +920,8 @@ class NetdiskApp {
                         if (audioElement && statusDiv && debugDiv) {
                             // 显示调试信息
                             debugDiv.innerHTML = `
-                                Blob URL: ${audioUrl}<br>
-                                Blob Size: ${blob.size} bytes<br>
-                                Blob Type: ${blob.type || '未知'}<br>
+                                Media URL: ${audioUrl.split('?')[0]}<br>
+                                Media Size: ${mediaSize} bytes<br>
                                 Response Type: ${contentType}
                             `;
                             
@@ -939,11 +987,11 @@ class NetdiskApp {
                         }
                     }, 100);
                 } else if (contentType && contentType.startsWith('video/')) {
-                    // 视频预览
-                    const blob = await response.blob();
-                    const videoUrl = URL.createObjectURL(blob);
+                    // 视频预览：视频元素直接从服务器按范围读取，拖动进度时只请求需要的部分
+                    const videoUrl = await this.getMediaUrl(fileId, response);
+                    const mediaSize = Number(response.headers.get('content-length')) || 0;
                     
-                    console.log('Video preview:', { contentType, blobSize: blob.size, videoUrl });
+                    console.log('Video preview:', { contentType, mediaSize });
                     
                     this.showModal('视频预览', `
                         <div class="media-preview">
@@ -951,11 +999,11 @@ class NetdiskApp {
                                 <source src="${videoUrl}" type="${contentType}">
                                 您的浏览器不支持视频播放。
                             </video>
-                            <p><small>MIME 类型: ${contentType} | 文件大小: ${this.formatBytes(blob.size)}</small></p>
+                            <p><small>MIME 类型: ${contentType} | 文件大小: ${this.formatBytes(mediaSize)}</small></p>
                         </div>
                     `, `
                         <button type="button" class="btn btn-secondary" onclick="window.open('${videoUrl}', '_blank')">在新窗口播放</button>
-                        <button type="button" class="btn btn-primary" onclick="app.closeModal(); URL.revokeObjectURL('${videoUrl}')">关闭</button>
+                        <button type="button" class="btn btn-primary" onclick="app.closeModal()">关闭</button>
                     `);
                 } else if (contentType && contentType === 'application/pdf') {
                     // PDF预览
@@ -970,9 +1018,10 @@ class NetdiskApp {
                         <button type="button" class="btn btn-primary" onclick="app.closeModal()">关闭</button>
                     `);
                 } else {
-                    // 文本预览
+                    // 文本预览：大文件只返回开头的一部分，可以继续加载
                     const data = await response.json();
-                    this.showModal('文本预览', `<div class="preview-container"><pre class="preview-text">${this.escapeHtml(data.content)}</pre></div>`);
+                    this.showModal('文本预览', `<div class="preview-container"><pre class="preview-text" id="previewText">${this.escapeHtml(data.content)}</pre></div>`,
+                        this.renderTextPreviewFooter(fileId, data));
                 }
             } else {
                 this.showAlert('error', '预览失败');
@@ -983,6 +1032,43 @@ class NetdiskApp {
         }
     }
     
+    async getMediaUrl(fileId, response) {
+        // 音视频元素不能携带 Authorization 头，使用带短期令牌的预览地址，已开始的响应不再读取
+        if (response.body) {
+            response.body.cancel();
+        }
+        const data = await this.api(`/files/media-url/${fileId}`);
+        if (!data.success) {
+            throw new Error(data.message || '获取播放地址失败');
+        }
+        return data.url;
+    }
+    
+    renderTextPreviewFooter(fileId, data) {
+        const loadMore = data.has_more ?
+            `<button type="button" class="btn btn-secondary" id="loadMoreText" onclick="app.loadMoreText(${fileId}, ${data.next_offset})">加载更多</button>` : '';
+        return `${loadMore}<button type="button" class="btn btn-primary" onclick="app.closeModal()">关闭</button>`;
+    }
+    
+    async loadMoreText(fileId, offset) {
+        const button = document.getElementById('loadMoreText');
+        if (button) button.disabled = true;
+        
+        try {
+            const data = await this.api(`/files/preview/${fileId}?offset=${offset}`);
+            if (data.content === undefined) throw new Error(data.detail || '加载失败');
+            const previewText = document.getElementById('previewText');
+            if (previewText) {
+                previewText.textContent += data.content;
+            }
+            document.getElementById('modalFooter').innerHTML = this.renderTextPreviewFooter(fileId, data);
+        } catch (error) {
+            console.error('Load text error:', error);
+            this.showAlert('error', '加载失败');
+            if (button) button.disabled = false;
+        }
+    }
+    
     async shareFile(fileId) {
         // 显示分享设置模态框
         const modalBody = `
@@ -1268,7 +1354,14 @@ class NetdiskApp {
             const data = await response.json();
             
             if (data.success) {
-                this.showAlert('success', data.message);
+                // 删除在后台任务中进行，等待完成后再刷新
+                this.showAlert('info', data.message);
+                const job = await this.waitForJob(data.job_id);
+                if (job.status === 'succeeded') {
+                    this.showAlert('success', `清理完成，删除了 ${job.result.deleted_count} 个项目`);
+                } else {
+                    this.showAlert('error', job.error || '清理失败');
+                }
                 this.showTrash(); // 刷新回收站列表
             } else {
                 this.showAlert('error', data.message);
@@ -1292,7 +1385,14 @@ class NetdiskApp {
             const data = await response.json();
             
             if (data.success) {
-                this.showAlert('success', data.message);
+                // 删除在后台任务中进行，等待完成后再刷新
+                this.showAlert('info', data.message);
+                const job = await this.waitForJob(data.job_id);
+                if (job.status === 'succeeded') {
+                    this.showAlert('success', `清理完成，删除了 ${job.result.deleted_count} 个项目`);
+                } else {
+                    this.showAlert('error', job.error || '清理失败');
+                }
                 this.showTrash(); // 刷新回收站列表
             } else {
                 this.showAlert('error', data.message);
@@ -1303,6 +1403,23 @@ class NetdiskApp {
         }
     }
     
+    async waitForJob(jobId, interval = 1000) {
+        // 轮询后台任务直到结束
+        while (true) {
+            const data = await this.api(`/jobs/${jobId}`);
+            if (!data.success) {
+                throw new Error(data.message || '任务不存在');
+            }
+            
+            const job = data.job;
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+            
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+    
     async showShares(updateUrl = true) {
         try {
             this.showLoading(true);
@@ -1824,6 +1941,33 @@ class NetdiskApp {
         });
     }
     
+    // 在后台线程中计算 BLAKE2b 哈希，prefix 为先计入哈希的十六进制数据
+    hashInWorker(blob, prefix = '') {
+        return new Promise((resolve, reject) => {
+            if (!window.Worker) {
+                reject(new Error('浏览器不支持 Web Worker'));
+                return;
+            }
+            const worker = new Worker('/static/js/hash-worker.js');
+            worker.onmessage = (e) => {
+                if (e.data.progress !== undefined) {
+                    return;
+                }
+                worker.terminate();
+                if (e.data.error) {
+                    reject(new Error(e.data.error));
+                } else {
+                    resolve(e.data.hash);
+                }
+            };
+            worker.onerror = (e) => {
+                worker.terminate();
+                reject(new Error(e.message || '计算哈希失败'));
+            };
+            worker.postMessage({ blob, prefix });
+        });
+    }
+    
     async uploadSmallFile(file) {
         const formData = new FormData();
         formData.append('files', file);
@@ -1919,9 +2063,6 @@ class NetdiskApp {
     }
     
     async uploadLargeFile(file, relativePath = null) {
-        const CHUNK_SIZE = 5 * 1024 * 1024; // 5MB per chunk
-        const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
-        
         // 计算文件路径
         let filePath = this.currentPath;
         let fileName = file.name;
@@ -1943,53 +2084,114 @@ class NetdiskApp {
         }
         
         try {
+            // 计算内容哈希，服务器已有相同内容时可以秒传；失败时按普通上传处理
+            let fileHash = null;
+            try {
+                fileHash = await this.hashInWorker(file);
+            } catch (error) {
+                console.warn('计算文件哈希失败，跳过秒传:', error);
+            }
+            
+            const initRequest = {
+                filename: fileName,
+                file_size: file.size,
+                // 不指定分片大小，由服务器根据文件大小推荐
+                path: filePath,
+                file_metadata: file.lastModified ? {
+                    lastModified: file.lastModified,
+                    originalName: file.name,
+                    size: file.size
+                } : null
+            };
+            if (fileHash) {
+                initRequest.file_hash = fileHash;
+                initRequest.hash_algorithm = 'blake2b';
+            }
+            
             // 初始化分片上传
-            const initData = await this.api('/files/chunk/init', {
+            let initData = await this.api('/files/chunk/init', {
                 method: 'POST',
-                body: JSON.stringify({
-                    filename: fileName,
-                    file_size: file.size,
-                    chunk_size: CHUNK_SIZE,
-                    path: filePath,
-                    file_metadata: file.lastModified ? {
-                        lastModified: file.lastModified,
-                        originalName: file.name,
-                        size: file.size
-                    } : null
-                })
+                body: JSON.stringify(initRequest)
             });
             
+            // 服务器已有相同内容，对服务器指定的范围计算持有证明后再次初始化
+            if (initData.success && initData.instant_challenge) {
+                const challenge = initData.instant_challenge;
+                let proof = null;
+                try {
+                    proof = await this.hashInWorker(
+                        file.slice(challenge.offset, challenge.offset + challenge.length), challenge.nonce
+                    );
+                } catch (error) {
+                    console.warn('计算持有证明失败，按普通上传处理:', error);
+                }
+                initData = await this.api('/files/chunk/init', {
+                    method: 'POST',
+                    body: JSON.stringify({
+                        ...initRequest,
+                        instant_token: challenge.token,
+                        instant_proof: proof
+                    })
+                });
+            }
+            
             if (!initData.success) {
                 throw new Error(initData.message);
             }
             
+            // 服务器已有相同内容，文件已直接创建（秒传）
+            if (initData.instant) {
+                return initData;
+            }
+            
             const uploadId = initData.upload_id;
+            const chunkSize = initData.chunk_size;
+            const totalChunks = initData.total_chunks;
             const uploadedChunks = new Set(initData.uploaded_chunks || []);
+            // 服务器根据负载给出的并发分片数
+            const concurrency = Math.max(1, initData.max_concurrency || 1);
             
-            // 上传各个分片
+            // 待上传的分片队列
+            const queue = [];
             for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
-                if (uploadedChunks.has(chunkIndex)) {
-                    continue; // 跳过已上传的分片
-                }
-                
-                const start = chunkIndex * CHUNK_SIZE;
-                const end = Math.min(start + CHUNK_SIZE, file.size);
-                const chunk = file.slice(start, end);
-                
-                // 带重试机制的分片上传
-                const success = await this.uploadChunkWithRetry(uploadId, chunkIndex, chunk, 3);
-                if (!success) {
-                    throw new Error(`分片 ${chunkIndex} 上传失败（已重试多次）`);
+                if (!uploadedChunks.has(chunkIndex)) {
+                    queue.push(chunkIndex); // 跳过已上传的分片
                 }
-                
-                // 更新单个文件的进度（这里简化处理）
-                const progress = ((chunkIndex + 1) / totalChunks) * 100;
-                console.log(`文件 ${file.name} 上传进度: ${progress.toFixed(1)}%`);
-                
-                // 添加小延迟防止请求过于频繁
-                if (chunkIndex < totalChunks - 1) {
-                    await this.delay(100); // 100ms延迟
+            }
+            
+            let completedChunks = uploadedChunks.size;
+            let uploadError = null;
+            
+            // 多个分片并行上传，每个工作者依次从队列中取分片
+            const worker = async () => {
+                while (queue.length > 0 && !uploadError) {
+                    const chunkIndex = queue.shift();
+                    const start = chunkIndex * chunkSize;
+                    const end = Math.min(start + chunkSize, file.size);
+                    const chunk = file.slice(start, end);
+                    
+                    // 带重试机制的分片上传
+                    const success = await this.uploadChunkWithRetry(uploadId, chunkIndex, chunk, 3);
+                    if (!success) {
+                        uploadError = new Error(`分片 ${chunkIndex} 上传失败（已重试多次）`);
+                        return;
+                    }
+                    
+                    // 更新单个文件的进度（这里简化处理）
+                    completedChunks++;
+                    const progress = (completedChunks / totalChunks) * 100;
+                    console.log(`文件 ${file.name} 上传进度: ${progress.toFixed(1)}%`);
                 }
+            };
+            
+            const workers = [];
+            for (let i = 0; i < Math.min(concurrency, queue.length); i++) {
+                workers.push(worker());
+            }
+            await Promise.all(workers);
+            
+            if (uploadError) {
+                throw uploadError;
             }
             
             // 完成上传
@@ -0,0 +1,169 @@
+// 在后台线程中计算文件的 BLAKE2b-512 哈希，结果与服务器 hashlib.blake2b 一致
+//
+// 消息格式: { blob, prefix }，prefix 为先计入哈希的十六进制数据（可省略）
+// 返回: { progress: 已读取字节数 } 若干次，最后 { hash } 或 { error }
+
+// 每次读取的大小
+const HASH_READ_SIZE = 4 * 1024 * 1024;
+
+// 初始向量，每个 64 位字拆为（低 32 位, 高 32 位）；
+// 全部使用 Int32Array 和 32 位整数运算，避免 V8 把超过 2^31 的值当作浮点数处理
+const BLAKE2B_IV32 = new Int32Array([
+    0xF3BCC908, 0x6A09E667, 0x84CAA73B, 0xBB67AE85,
+    0xFE94F82B, 0x3C6EF372, 0x5F1D36F1, 0xA54FF53A,
+    0xADE682D1, 0x510E527F, 0x2B3E6C1F, 0x9B05688C,
+    0xFB41BD6B, 0x1F83D9AB, 0x137E2179, 0x5BE0CD19
+]);
+
+// 每轮的消息字排列，下标已乘 2 对应拆分后的数组
+const BLAKE2B_SIGMA = [
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    14, 10, 4, 8, 9, 15, 13, 6, 1, 12, 0, 2, 11, 7, 5, 3,
+    11, 8, 12, 0, 5, 2, 15, 13, 10, 14, 3, 6, 7, 1, 9, 4,
+    7, 9, 3, 1, 13, 12, 11, 14, 2, 6, 5, 10, 4, 0, 15, 8,
+    9, 0, 5, 7, 2, 4, 10, 15, 14, 1, 11, 12, 6, 8, 3, 13,
+    2, 12, 6, 10, 0, 11, 8, 3, 4, 13, 7, 5, 15, 14, 1, 9,
+    12, 5, 1, 15, 14, 13, 4, 10, 0, 7, 6, 3, 9, 2, 8, 11,
+    13, 11, 7, 14, 12, 1, 3, 9, 5, 0, 15, 4, 8, 6, 2, 10,
+    6, 15, 14, 9, 11, 3, 0, 8, 12, 2, 13, 7, 1, 4, 10, 5,
+    10, 2, 8, 4, 7, 6, 1, 5, 15, 11, 9, 14, 3, 12, 13, 0,
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    14, 10, 4, 8, 9, 15, 13, 6, 1, 12, 0, 2, 11, 7, 5, 3
+].map(x => x * 2);
+
+// 混合函数 G，旋转位数依次为 32、24、16、63
+// 8 个 64 位字先读入局部变量；64 位加法的进位由低 32 位的最高位推出，只用 32 位整数运算
+function mix(v, m, a, b, c, d, x, y) {
+    let al = v[a], ah = v[a + 1], bl = v[b], bh = v[b + 1];
+    let cl = v[c], ch = v[c + 1], dl = v[d], dh = v[d + 1];
+    let lo, t;
+    
+    lo = (al + bl) | 0;
+    ah = (ah + bh + (((al & bl) | ((al | bl) & ~lo)) >>> 31)) | 0;
+    t = m[x];
+    al = (lo + t) | 0;
+    ah = (ah + m[x + 1] + (((lo & t) | ((lo | t) & ~al)) >>> 31)) | 0;
+    t = dl ^ al; dl = dh ^ ah; dh = t;
+    lo = (cl + dl) | 0;
+    ch = (ch + dh + (((cl & dl) | ((cl | dl) & ~lo)) >>> 31)) | 0;
+    cl = lo;
+    bl ^= cl; bh ^= ch;
+    t = (bl >>> 24) | (bh << 8); bh = (bh >>> 24) | (bl << 8); bl = t;
+    
+    lo = (al + bl) | 0;
+    ah = (ah + bh + (((al & bl) | ((al | bl) & ~lo)) >>> 31)) | 0;
+    t = m[y];
+    al = (lo + t) | 0;
+    ah = (ah + m[y + 1] + (((lo & t) | ((lo | t) & ~al)) >>> 31)) | 0;
+    dl ^= al; dh ^= ah;
+    t = (dl >>> 16) | (dh << 16); dh = (dh >>> 16) | (dl << 16); dl = t;
+    lo = (cl + dl) | 0;
+    ch = (ch + dh + (((cl & dl) | ((cl | dl) & ~lo)) >>> 31)) | 0;
+    cl = lo;
+    bl ^= cl; bh ^= ch;
+    t = (bh >>> 31) | (bl << 1); bh = (bl >>> 31) | (bh << 1); bl = t;
+    
+    v[a] = al; v[a + 1] = ah; v[b] = bl; v[b + 1] = bh;
+    v[c] = cl; v[c + 1] = ch; v[d] = dl; v[d + 1] = dh;
+}
+
+// 创建 BLAKE2b-512 哈希对象（无密钥）
+function createBlake2b() {
+    const h = new Int32Array(BLAKE2B_IV32);
+    // 参数块：摘要长度 64 字节，扇出和深度为 1
+    h[0] ^= 0x01010000 ^ 64;
+    const block = new Uint8Array(128);
+    const words = new Int32Array(32);
+    const v = new Int32Array(32);
+    let filled = 0;
+    // 已处理的字节数
+    let total = 0;
+
+    function compress(last) {
+        for (let i = 0; i < 16; i++) {
+            v[i] = h[i];
+            v[i + 16] = BLAKE2B_IV32[i];
+        }
+        v[24] ^= total % 0x100000000;
+        v[25] ^= Math.floor(total / 0x100000000);
+        if (last) {
+            v[28] = ~v[28];
+            v[29] = ~v[29];
+        }
+        for (let i = 0; i < 32; i++) {
+            const j = i * 4;
+            words[i] = block[j] | (block[j + 1] << 8) | (block[j + 2] << 16) | (block[j + 3] << 24);
+        }
+        for (let round = 0; round < 12; round++) {
+            const s = round * 16;
+            mix(v, words, 0, 8, 16, 24, BLAKE2B_SIGMA[s], BLAKE2B_SIGMA[s + 1]);
+            mix(v, words, 2, 10, 18, 26, BLAKE2B_SIGMA[s + 2], BLAKE2B_SIGMA[s + 3]);
+            mix(v, words, 4, 12, 20, 28, BLAKE2B_SIGMA[s + 4], BLAKE2B_SIGMA[s + 5]);
+            mix(v, words, 6, 14, 22, 30, BLAKE2B_SIGMA[s + 6], BLAKE2B_SIGMA[s + 7]);
+            mix(v, words, 0, 10, 20, 30, BLAKE2B_SIGMA[s + 8], BLAKE2B_SIGMA[s + 9]);
+            mix(v, words, 2, 12, 22, 24, BLAKE2B_SIGMA[s + 10], BLAKE2B_SIGMA[s + 11]);
+            mix(v, words, 4, 14, 16, 26, BLAKE2B_SIGMA[s + 12], BLAKE2B_SIGMA[s + 13]);
+            mix(v, words, 6, 8, 18, 28, BLAKE2B_SIGMA[s + 14], BLAKE2B_SIGMA[s + 15]);
+        }
+        for (let i = 0; i < 16; i++) {
+            h[i] ^= v[i] ^ v[i + 16];
+        }
+    }
+
+    return {
+        update(data) {
+            let offset = 0;
+            while (offset < data.length) {
+                // 缓冲区满且后面还有数据时才压缩，最后一块留给 hexdigest
+                if (filled === 128) {
+                    total += 128;
+                    compress(false);
+                    filled = 0;
+                }
+                const count = Math.min(128 - filled, data.length - offset);
+                block.set(data.subarray(offset, offset + count), filled);
+                filled += count;
+                offset += count;
+            }
+        },
+        hexdigest() {
+            total += filled;
+            block.fill(0, filled);
+            compress(true);
+            let hex = '';
+            for (let i = 0; i < 16; i++) {
+                for (let shift = 0; shift < 32; shift += 8) {
+                    hex += ((h[i] >>> shift) & 0xff).toString(16).padStart(2, '0');
+                }
+            }
+            return hex;
+        }
+    };
+}
+
+function hexToBytes(hex) {
+    const bytes = new Uint8Array(hex.length / 2);
+    for (let i = 0; i < bytes.length; i++) {
+        bytes[i] = parseInt(hex.substr(i * 2, 2), 16);
+    }
+    return bytes;
+}
+
+self.onmessage = (event) => {
+    const { blob, prefix } = event.data;
+    try {
+        const hasher = createBlake2b();
+        if (prefix) {
+            hasher.update(hexToBytes(prefix));
+        }
+        const reader = new FileReaderSync();
+        for (let offset = 0; offset < blob.size; offset += HASH_READ_SIZE) {
+            const slice = blob.slice(offset, offset + HASH_READ_SIZE);
+            hasher.update(new Uint8Array(reader.readAsArrayBuffer(slice)));
+            self.postMessage({ progress: Math.min(offset + HASH_READ_SIZE, blob.size) });
+        }
+        self.postMessage({ hash: hasher.hexdigest() });
+    } catch (error) {
+        self.postMessage({ error: error.message || String(error) });
+    }
+};
@@ -0,0 +1,131 @@
+"""
+测试公共配置
+
+数据库和所有数据目录在导入应用模块之前改为指向临时目录，测试不会读写仓库中的数据。
+每个测试使用独立创建的用户，用户之间的路径命名空间互不影响。
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="netdisk-test-"))
+os.environ["COLD_STORAGE_PATH"] = str(DATA_DIR / "blobs_cold")
+os.environ["THUMBNAIL_PATH"] = str(DATA_DIR / "thumbnails")
+
+import app.config as config
+
+config.STORAGE_DIR = DATA_DIR / "files"
+config.TRASH_DIR = DATA_DIR / "trash"
+config.BLOB_DIR = DATA_DIR / "blobs"
+config.COLD_BLOB_DIR = DATA_DIR / "blobs_cold"
+config.UPLOAD_TMP_DIR = DATA_DIR / "uploads"
+config.JOB_DIR = DATA_DIR / "jobs"
+config.THUMBNAIL_DIR = DATA_DIR / "thumbnails"
+config.DATABASE_URL = f"sqlite:///{DATA_DIR}/netdisk.db"
+
+from fastapi.testclient import TestClient
+from app.database import get_db_context
+from app.middleware.rate_limit import RateLimitMiddleware
+from app.models.user import User
+from app.utils.auth import create_access_token
+import main
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """启动应用（执行 lifespan 中的初始化），整个测试会话共用"""
+    with get_db_context() as db:
+        User.metadata.create_all(bind=db.get_bind())
+        # 默认管理员已存在时 init_db 不再创建
+        if not db.query(User).filter(User.username == config.DEFAULT_ADMIN_USERNAME).first():
+            db.add(User(username=config.DEFAULT_ADMIN_USERNAME, hashed_password="-", is_active=True))
+            db.commit()
+    with TestClient(main.app) as client:
+        yield client
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    """测试中连续发出大量请求，关闭速率限制"""
+    monkeypatch.setattr(RateLimitMiddleware, "is_rate_limited", lambda self, client_id: False)
+
+
+def create_user(username: str = None) -> User:
+    """创建一个新用户"""
+    with get_db_context() as db:
+        user = User(username=username or f"u{uuid.uuid4().hex[:12]}", hashed_password="-", is_active=True)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        return user
+
+
+def login(app_client, user: User) -> TestClient:
+    """返回以该用户身份发送请求的客户端"""
+    client = TestClient(main.app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': user.username})}"
+    return client
+
+
+@pytest.fixture
+def user(app_client) -> User:
+    return create_user()
+
+
+@pytest.fixture
+def db(app_client):
+    """数据库会话"""
+    with get_db_context() as session:
+        yield session
+
+
+@pytest.fixture
+def client(app_client, user) -> TestClient:
+    """已登录的新用户的客户端"""
+    return login(app_client, user)
+
+
+def upload(client: TestClient, path: str, files: dict) -> dict:
+    """上传 {文件名: 内容} 到目录 path，返回上传结果"""
+    response = client.post(
+        "/files/upload",
+        data={"path": path},
+        files=[("files", (name, content)) for name, content in files.items()]
+    )
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result["success"], result
+    return result
+
+
+def mkdir(client: TestClient, path: str) -> dict:
+    """创建目录 path"""
+    response = client.post("/files/mkdir", json={"path": path})
+    assert response.status_code == 200, response.text
+    assert response.json()["success"], response.json()
+    return response.json()
+
+
+def browse(client: TestClient, path: str = "/") -> dict:
+    """列出目录，返回 {名称: 条目}"""
+    response = client.get("/files/browse", params={"path": path})
+    assert response.status_code == 200, response.text
+    return {item["name"]: item for item in response.json()["items"]}
+
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    """等待后台线程完成的操作，超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
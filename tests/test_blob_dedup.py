@@ -0,0 +1,161 @@
+"""
+内容寻址的数据块去重和秒传
+"""
+
+import hashlib
+import os
+import threading
+
+from app.models.blob import Blob
+from app.services.blob_service import BlobService
+from app.services.chunk_upload_service import ChunkUploadService
+from app.services.file_service import FileService
+from app.utils.auth import verify_instant_upload_token
+from app.database import get_db_context
+from tests.conftest import browse, create_user, upload, wait_until
+
+
+def _blob_of(db, node) -> Blob:
+    db.expire_all()
+    return db.get(Blob, node.blob_id)
+
+
+def _proof(content: bytes, challenge: dict) -> str:
+    start = challenge["offset"]
+    data = content[start:start + challenge["length"]]
+    return hashlib.blake2b(bytes.fromhex(challenge["nonce"]) + data).hexdigest()
+
+
+def test_identical_content_shares_one_blob(db, user):
+    service = FileService(db)
+    content = os.urandom(10000)
+    first = service.save_uploaded_file("/a.bin", content, user)
+    second = service.save_uploaded_file("/b.bin", content, create_user())
+    
+    assert first.blob_id == second.blob_id
+    blob = _blob_of(db, first)
+    assert blob.ref_count == 2
+    assert blob.content_hash == hashlib.blake2b(content).hexdigest()
+    assert service.save_uploaded_file("/c.bin", b"other", user).blob_id != first.blob_id
+
+
+def test_concurrent_uploads_of_same_content_share_one_blob(app_client, monkeypatch):
+    # 两个上传都在对方插入数据块之前完成查找
+    barrier = threading.Barrier(2, timeout=5)
+    waited = set()
+    find_blob = BlobService.find_blob
+    
+    def racing_find_blob(self, content_hash, size):
+        name = threading.current_thread().name
+        if name.startswith("upload-") and name not in waited:
+            waited.add(name)
+            barrier.wait()
+        return find_blob(self, content_hash, size)
+    
+    monkeypatch.setattr(BlobService, "find_blob", racing_find_blob)
+    storage_keys = []
+    add_blob = BlobService._add_blob
+    
+    def recording_add_blob(self, blob):
+        storage_keys.append(blob.storage_key)
+        return add_blob(self, blob)
+    
+    monkeypatch.setattr(BlobService, "_add_blob", recording_add_blob)
+    content = os.urandom(10000)
+    users = [create_user(), create_user()]
+    blob_ids, errors = [], []
+    
+    def save(user):
+        try:
+            with get_db_context() as session:
+                blob_ids.append(FileService(session).save_uploaded_file("/same.bin", content, user).blob_id)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=save, args=(user,), name=f"upload-{i}") for i, user in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert errors == []
+    assert len(set(blob_ids)) == 1
+    with get_db_context() as session:
+        blobs = session.query(Blob).filter(Blob.content_hash == hashlib.blake2b(content).hexdigest()).all()
+        assert len(blobs) == 1 and blobs[0].ref_count == 2
+        # 落选的一方写入的内容已删除
+        storage = blobs[0].storage
+        assert [storage.exists(key) for key in storage_keys].count(True) == 1
+        assert storage.exists(blobs[0].storage_key)
+
+
+def test_blob_is_removed_with_last_reference(db, user):
+    service = FileService(db)
+    content = os.urandom(10000)
+    first = service.save_uploaded_file("/a.bin", content, user)
+    second = service.save_uploaded_file("/b.bin", content, user)
+    blob_id = first.blob_id
+    path = _blob_of(db, first).physical_path
+    
+    service.move_to_trash(first)
+    service.permanent_delete(first)
+    assert _blob_of(db, second).ref_count == 1
+    assert os.path.exists(path)
+    
+    service.move_to_trash(second)
+    service.permanent_delete(second)
+    db.expire_all()
+    assert db.get(Blob, blob_id) is None
+    assert wait_until(lambda: not os.path.exists(path))
+
+
+def _init(client, content: bytes, name: str, **extra) -> dict:
+    response = client.post("/files/chunk/init", json={
+        "filename": name, "file_size": len(content), "chunk_size": 4096,
+        "file_hash": hashlib.blake2b(content).hexdigest(), "hash_algorithm": "blake2b", **extra
+    })
+    assert response.json()["success"], response.json()
+    return response.json()
+
+
+def test_instant_upload_requires_proof_of_possession(client):
+    content = os.urandom(3 * 1024 * 1024 + 3)
+    upload(client, "/", {"original.bin": content})
+    
+    init = _init(client, content, "copy.bin")
+    challenge = init["instant_challenge"]
+    assert not init["instant"] and init["upload_id"] is None
+    assert 0 <= challenge["offset"] <= len(content) - challenge["length"]
+    assert "copy.bin" not in browse(client)
+    
+    # 只知道哈希，无法给出正确的证明时按普通上传处理
+    wrong = _init(client, content, "copy.bin", instant_token=challenge["token"], instant_proof="00" * 64)
+    assert not wrong["instant"] and wrong["upload_id"]
+    
+    done = _init(client, content, "copy.bin", instant_token=challenge["token"],
+                 instant_proof=_proof(content, challenge))
+    assert done["instant"]
+    item = browse(client)["copy.bin"]
+    assert client.get(f"/files/download/{item['id']}").content == content
+
+
+def test_instant_upload_token_belongs_to_its_user(app_client, client, user):
+    content = os.urandom(5000)
+    upload(client, "/", {"original.bin": content})
+    challenge = _init(client, content, "copy.bin")["instant_challenge"]
+    
+    assert verify_instant_upload_token(challenge["token"], user.username)["hash"] == \
+        hashlib.blake2b(content).hexdigest()
+    assert verify_instant_upload_token(challenge["token"], create_user().username) is None
+
+
+def test_unknown_content_starts_a_normal_upload(client):
+    init = _init(client, os.urandom(5000), "new.bin")
+    assert init["upload_id"] and init["instant_challenge"] is None
+
+
+def test_md5_hash_never_offers_instant_upload(db, user):
+    content = os.urandom(5000)
+    FileService(db).save_uploaded_file("/a.bin", content, user)
+    service = ChunkUploadService(db)
+    assert service.instant_upload_challenge(len(content), user, hashlib.md5(content).hexdigest(), 'md5') is None
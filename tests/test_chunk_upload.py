@@ -0,0 +1,246 @@
+"""
+分片上传
+"""
+
+import hashlib
+import os
+
+import pytest
+
+from app.config import CHUNK_MAX_CONCURRENCY, CHUNK_SIZE_MAX, CHUNK_SIZE_MIN, CHUNK_TARGET_COUNT, UPLOAD_TMP_DIR
+from app.models.upload import UploadSession
+from app.services import chunk_upload_service
+from app.services.chunk_upload_service import DATA_FILE_NAME, ChunkUploadService
+from app.utils import file_cleaner
+from tests.conftest import browse, create_user
+
+CHUNK_SIZE = 4096
+
+
+def _chunks(content: bytes, chunk_size: int = CHUNK_SIZE):
+    return [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+
+
+def _data_file(upload_id: str) -> str:
+    return os.path.join(UPLOAD_TMP_DIR, upload_id, DATA_FILE_NAME)
+
+
+def _read_file(node) -> bytes:
+    with open(node.physical_path, 'rb') as f:
+        return f.read()
+
+
+def test_chunks_are_written_in_place(db, user):
+    content = os.urandom(CHUNK_SIZE * 3 + 17)
+    service = ChunkUploadService(db)
+    upload_id, total_chunks, _ = service.init_chunk_upload("a.bin", len(content), CHUNK_SIZE, "/", user)
+    
+    # 目标文件预先分配为完整大小
+    assert total_chunks == 4
+    assert os.path.getsize(_data_file(upload_id)) == len(content)
+    
+    chunks = _chunks(content)
+    for index in (2, 0, 3, 1):
+        service.upload_chunk(upload_id, index, chunks[index], user)
+    with open(_data_file(upload_id), 'rb') as f:
+        assert f.read() == content
+    
+    info = service.complete_chunk_upload(upload_id, user, hashlib.md5(content).hexdigest())
+    assert info["size"] == len(content)
+    assert _read_file(service.file_service.get_node_by_path("/a.bin", user)) == content
+    assert not os.path.exists(os.path.join(UPLOAD_TMP_DIR, upload_id))
+
+
+def test_complete_reports_missing_chunks(db, user):
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("b.bin", CHUNK_SIZE * 3, CHUNK_SIZE, "/", user)
+    service.upload_chunk(upload_id, 1, b"x" * CHUNK_SIZE, user)
+    
+    with pytest.raises(ValueError, match=r"缺少分片: \[0, 2\]"):
+        service.complete_chunk_upload(upload_id, user)
+
+
+def test_chunk_with_wrong_size_is_rejected(db, user):
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("c.bin", CHUNK_SIZE + 10, CHUNK_SIZE, "/", user)
+    
+    with pytest.raises(ValueError, match="分片大小不正确"):
+        service.upload_chunk(upload_id, 0, b"x" * (CHUNK_SIZE - 1), user)
+    with pytest.raises(ValueError, match="分片大小不正确"):
+        service.upload_chunk(upload_id, 1, b"x" * CHUNK_SIZE, user)
+
+
+def test_chunk_upload_over_http(client):
+    content = os.urandom(CHUNK_SIZE * 2 + 1)
+    init = client.post("/files/chunk/init", json={
+        "filename": "http.bin", "file_size": len(content), "chunk_size": CHUNK_SIZE, "path": "/"
+    }).json()
+    assert init["success"], init
+    
+    for index, chunk in enumerate(_chunks(content)):
+        result = client.post("/files/chunk/upload",
+                             data={"upload_id": init["upload_id"], "chunk_index": str(index)},
+                             files={"chunk_file": ("chunk", chunk)}).json()
+        assert result["received"], result
+    
+    result = client.post("/files/chunk/complete", json={"upload_id": init["upload_id"]}).json()
+    assert result["success"], result
+    item = browse(client)["http.bin"]
+    assert client.get(f"/files/download/{item['id']}").content == content
+
+
+def test_out_of_order_chunks_are_hashed_incrementally(db, user):
+    content = os.urandom(CHUNK_SIZE * 3)
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("d.bin", len(content), CHUNK_SIZE, "/", user,
+                                                hash_algorithm='blake2b')
+    chunks = _chunks(content)
+    for index in (2, 1, 0):
+        service.upload_chunk(upload_id, index, chunks[index], user)
+    
+    state = chunk_upload_service._hash_states[upload_id]
+    assert state.next_index == 3 and not state.stale and not state.pending
+    service.complete_chunk_upload(upload_id, user, hashlib.blake2b(content).hexdigest())
+
+
+def test_pending_chunks_respect_global_budget(db, user, monkeypatch):
+    # 其他测试中未完成的会话也占用预算
+    before = chunk_upload_service._pending_bytes_total
+    monkeypatch.setattr(chunk_upload_service, "HASH_PENDING_TOTAL_LIMIT", before + CHUNK_SIZE)
+    content = os.urandom(CHUNK_SIZE * 4)
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("e.bin", len(content), CHUNK_SIZE, "/", user)
+    chunks = _chunks(content)
+    
+    service.upload_chunk(upload_id, 2, chunks[2], user)
+    service.upload_chunk(upload_id, 3, chunks[3], user)
+    state = chunk_upload_service._hash_states[upload_id]
+    # 预算只够缓存一个分片，另一个只记录索引，推进时从目标文件回读
+    assert state.pending[2] == chunks[2] and state.pending[3] is None
+    assert chunk_upload_service._pending_bytes_total == before + CHUNK_SIZE
+    
+    service.upload_chunk(upload_id, 1, chunks[1], user)
+    service.upload_chunk(upload_id, 0, chunks[0], user)
+    assert chunk_upload_service._pending_bytes_total == before
+    service.complete_chunk_upload(upload_id, user, hashlib.md5(content).hexdigest())
+
+
+def test_dropped_session_releases_budget(db, user):
+    before = chunk_upload_service._pending_bytes_total
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("f.bin", CHUNK_SIZE * 2, CHUNK_SIZE, "/", user)
+    service.upload_chunk(upload_id, 1, b"x" * CHUNK_SIZE, user)
+    assert chunk_upload_service._pending_bytes_total == before + CHUNK_SIZE
+    
+    service.cancel_upload(upload_id, user)
+    assert upload_id not in chunk_upload_service._hash_states
+    assert chunk_upload_service._pending_bytes_total == before
+
+
+def test_cleanup_expired_uploads(db, user):
+    service = ChunkUploadService(db)
+    finished_id, _, _ = service.init_chunk_upload("g.bin", 10, CHUNK_SIZE, "/", user)
+    service.upload_chunk(finished_id, 0, b"0123456789", user)
+    service.complete_chunk_upload(finished_id, user)
+    active_id, _, _ = service.init_chunk_upload("h.bin", 10, CHUNK_SIZE, "/", user)
+    
+    old_orphan = os.path.join(UPLOAD_TMP_DIR, "orphan-old")
+    new_orphan = os.path.join(UPLOAD_TMP_DIR, "orphan-new")
+    os.makedirs(old_orphan)
+    os.makedirs(new_orphan)
+    os.utime(old_orphan, (0, 0))
+    
+    assert file_cleaner.cleanup_expired_uploads() >= 1
+    db.expire_all()
+    assert db.get(UploadSession, finished_id) is None
+    assert db.get(UploadSession, active_id) is not None
+    assert os.path.exists(_data_file(active_id))
+    assert not os.path.exists(old_orphan)
+    assert os.path.exists(new_orphan)
+    os.rmdir(new_orphan)
+
+
+def test_session_progress_is_stored_in_database(db, user):
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("i.bin", CHUNK_SIZE * 3, CHUNK_SIZE, "/", user,
+                                                file_metadata={"mtime": 123})
+    service.upload_chunk(upload_id, 2, b"c" * CHUNK_SIZE, user)
+    service.upload_chunk(upload_id, 0, b"a" * CHUNK_SIZE, user)
+    # 重传的分片不重复计数
+    service.upload_chunk(upload_id, 0, b"a" * CHUNK_SIZE, user)
+    
+    db.expire_all()
+    upload = db.get(UploadSession, upload_id)
+    assert upload.uploaded_count == 2
+    assert upload.file_metadata == {"mtime": 123}
+    status = service.get_upload_status(upload_id, user)
+    assert status["uploaded_chunks"] == [0, 2]
+    assert status["status"] == "uploading"
+
+
+def test_session_belongs_to_its_owner(db, user):
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("j.bin", 10, CHUNK_SIZE, "/", user)
+    other = create_user()
+    
+    with pytest.raises(ValueError, match="无权限"):
+        service.upload_chunk(upload_id, 0, b"0123456789", other)
+    with pytest.raises(ValueError, match="无权限"):
+        service.get_upload_status(upload_id, other)
+
+
+def test_upload_resumes_after_restart(db, user):
+    content = os.urandom(CHUNK_SIZE * 3)
+    chunks = _chunks(content)
+    upload_id, _, _ = ChunkUploadService(db).init_chunk_upload("k.bin", len(content), CHUNK_SIZE, "/", user)
+    ChunkUploadService(db).upload_chunk(upload_id, 0, chunks[0], user)
+    ChunkUploadService(db).upload_chunk(upload_id, 2, chunks[2], user)
+    
+    # 进程重启后内存中的增量哈希状态丢失，会话和已写入的分片仍然有效
+    ChunkUploadService._drop_hash_state(upload_id)
+    db.expire_all()
+    service = ChunkUploadService(db)
+    assert service.get_upload_status(upload_id, user)["uploaded_chunks"] == [0, 2]
+    service.upload_chunk(upload_id, 1, chunks[1], user)
+    
+    service.complete_chunk_upload(upload_id, user, hashlib.md5(content).hexdigest())
+    assert _read_file(service.file_service.get_node_by_path("/k.bin", user)) == content
+
+
+def test_completed_session_cannot_be_reused(db, user):
+    service = ChunkUploadService(db)
+    upload_id, _, _ = service.init_chunk_upload("l.bin", 10, CHUNK_SIZE, "/", user)
+    service.upload_chunk(upload_id, 0, b"0123456789", user)
+    service.complete_chunk_upload(upload_id, user)
+    
+    with pytest.raises(ValueError, match="上传会话已结束"):
+        service.upload_chunk(upload_id, 0, b"0123456789", user)
+    with pytest.raises(ValueError, match="上传会话已结束"):
+        service.complete_chunk_upload(upload_id, user)
+
+
+def test_recommended_chunk_size(db):
+    service = ChunkUploadService(db)
+    mib = 1024 * 1024
+    assert service.recommend_chunk_size(10) == CHUNK_SIZE_MIN
+    assert service.recommend_chunk_size(CHUNK_TARGET_COUNT * 6 * mib - 1) == 6 * mib
+    assert service.recommend_chunk_size(100 * 1024 * mib) == CHUNK_SIZE_MAX
+
+
+def test_recommended_concurrency(db, monkeypatch):
+    service = ChunkUploadService(db)
+    monkeypatch.setattr(chunk_upload_service, "CHUNK_SERVER_CONCURRENCY", 10 ** 6)
+    assert service.recommend_concurrency(1) == 1
+    assert service.recommend_concurrency(1000) == CHUNK_MAX_CONCURRENCY
+    
+    # 并发预算被活跃上传分完时至少保留一个
+    monkeypatch.setattr(chunk_upload_service, "CHUNK_SERVER_CONCURRENCY", 0)
+    assert service.recommend_concurrency(1000) == 1
+
+
+def test_init_advertises_chunk_size_and_concurrency(client):
+    init = client.post("/files/chunk/init", json={"filename": "m.bin", "file_size": 10 * 1024 * 1024}).json()
+    assert init["success"], init
+    assert init["chunk_size"] == CHUNK_SIZE_MIN
+    assert init["total_chunks"] == 3
+    assert 1 <= init["max_concurrency"] <= min(CHUNK_MAX_CONCURRENCY, 3)
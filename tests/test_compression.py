@@ -0,0 +1,130 @@
+"""
+可按范围读取的压缩格式
+"""
+
+import gzip
+import io
+import os
+
+import pytest
+
+from app.config import COMPRESSION_FRAME_SIZE
+from app.models.file import FileNode
+from app.utils.compression import (
+    ENCODING_GZIP_FRAMES, accepts_gzip, compress_file, iter_decompressed_range, parse_frame_index,
+    try_compress_file
+)
+from tests.conftest import browse, upload
+
+FRAME_SIZE = 1000
+
+
+def _text(size: int) -> bytes:
+    lines = b"".join(b"line %d: the quick brown fox jumps over the lazy dog\n" % i for i in range(size // 40 + 1))
+    return lines[:size]
+
+
+def _compress(raw: bytes, frame_size: int = FRAME_SIZE):
+    target = io.BytesIO()
+    gzip_size, stored_size = compress_file(io.BytesIO(raw), target, frame_size)
+    data = target.getvalue()
+    assert len(data) == stored_size
+    return data, parse_frame_index(data[gzip_size:], gzip_size)
+
+
+def test_gzip_member_is_standard_gzip():
+    raw = _text(10_500)
+    data, index = _compress(raw)
+    assert gzip.decompress(data[:index.gzip_size]) == raw
+    assert index.raw_size == len(raw) and index.frame_size == FRAME_SIZE
+    assert len(index.compressed_offsets) == 11
+
+
+@pytest.mark.parametrize("start,end", [
+    (0, None), (0, 0), (999, 1000), (2500, 7321), (10_000, 10_499), (10_499, 20_000), (3000, 2999),
+])
+def test_ranges_decompress_only_covering_frames(start, end):
+    raw = _text(10_500)
+    data, index = _compress(raw)
+    reads = []
+    
+    def read_iter(compressed_start, compressed_end):
+        reads.append((compressed_start, compressed_end))
+        chunk = data[compressed_start:compressed_end + 1]
+        # 按小块产出，模拟流式读取
+        return (chunk[i:i + 100] for i in range(0, len(chunk), 100))
+    
+    result = b"".join(iter_decompressed_range(read_iter, index, start, end, chunk_size=300))
+    assert result == raw[start:None if end is None else end + 1]
+    
+    last_byte = len(raw) - 1 if end is None else min(end, len(raw) - 1)
+    if start > last_byte:
+        assert reads == []
+        return
+    offsets = index.compressed_offsets
+    last = last_byte // FRAME_SIZE
+    # 最后一帧读到 gzip 尾部（CRC32 和原始大小，8 字节）之前
+    compressed_end = offsets[last + 1] - 1 if last + 1 < len(offsets) else index.gzip_size - 8 - 1
+    assert reads == [(offsets[start // FRAME_SIZE], compressed_end)]
+
+
+def test_empty_input():
+    data, index = _compress(b"")
+    assert gzip.decompress(data[:index.gzip_size]) == b""
+    assert index.raw_size == 0 and index.compressed_offsets == []
+    assert list(iter_decompressed_range(lambda s, e: iter([]), index)) == []
+
+
+def test_only_compressible_files_are_compressed(tmp_path):
+    text_path = tmp_path / "log.txt"
+    text_path.write_bytes(_text(64 * 1024))
+    compressed = try_compress_file(str(text_path), "log.txt", "text/plain", 64 * 1024)
+    assert compressed is not None
+    with open(compressed[0], "rb") as f:
+        assert gzip.decompress(f.read()[:compressed[1]]) == text_path.read_bytes()
+    
+    random_path = tmp_path / "random.txt"
+    random_path.write_bytes(os.urandom(64 * 1024))
+    assert try_compress_file(str(random_path), "random.txt", "text/plain", 64 * 1024) is None
+    assert try_compress_file(str(text_path), "photo.jpg", "image/jpeg", 64 * 1024) is None
+    assert try_compress_file(str(text_path), "tiny.txt", "text/plain", 100) is None
+
+
+def test_accepts_gzip():
+    assert accepts_gzip("gzip, deflate, br")
+    assert accepts_gzip("br;q=1.0, *;q=0.5")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("identity")
+    # 明确列出的 gzip 优先于 *
+    assert not accepts_gzip("gzip;q=0, *")
+    assert not accepts_gzip("*, gzip; Q=0")
+    assert accepts_gzip("gzip;q=0.5, *;q=0")
+    assert accepts_gzip("x-gzip")
+    assert not accepts_gzip(None)
+
+
+def test_text_upload_is_stored_compressed_and_served_decoded(client, db):
+    content = _text(COMPRESSION_FRAME_SIZE * 2 + 12345)
+    upload(client, "/", {"big.log": content})
+    node_id = browse(client)["big.log"]["id"]
+    blob = db.get(FileNode, node_id).blob
+    assert blob.encoding == ENCODING_GZIP_FRAMES and blob.encoded_size < len(content)
+    
+    # 接受 gzip 的客户端直接收到压缩数据（httpx 自动解码）
+    response = client.get(f"/files/download/{node_id}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert response.content == content
+    
+    for accept_encoding in ("identity", "gzip;q=0, *"):
+        response = client.get(f"/files/download/{node_id}", headers={"Accept-Encoding": accept_encoding})
+        assert "content-encoding" not in response.headers
+        assert response.content == content
+    
+    # 范围请求返回解压后的字节，跨越帧边界
+    start, end = COMPRESSION_FRAME_SIZE - 10, COMPRESSION_FRAME_SIZE * 2 + 10
+    response = client.get(f"/files/download/{node_id}",
+                          headers={"Range": f"bytes={start}-{end}", "Accept-Encoding": "gzip"})
+    assert response.status_code == 206
+    assert "content-encoding" not in response.headers
+    assert response.content == content[start:end + 1]
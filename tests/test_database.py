@@ -0,0 +1,34 @@
+"""
+SQLite 连接配置
+"""
+
+from sqlalchemy import text
+
+from app.config import (
+    DB_POOL_SIZE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_JOURNAL_MODE, SQLITE_MMAP_SIZE
+)
+from app.database import engine
+
+
+def _pragma(conn, name: str):
+    return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_connections_use_configured_pragmas(app_client):
+    with engine.connect() as conn:
+        assert _pragma(conn, "journal_mode").upper() == SQLITE_JOURNAL_MODE.upper()
+        assert _pragma(conn, "synchronous") == 1  # NORMAL
+        assert _pragma(conn, "busy_timeout") == SQLITE_BUSY_TIMEOUT_MS
+        assert _pragma(conn, "cache_size") == -SQLITE_CACHE_SIZE_KB
+        assert _pragma(conn, "mmap_size") == SQLITE_MMAP_SIZE
+        assert _pragma(conn, "temp_store") == 2  # MEMORY
+    assert engine.pool.size() == DB_POOL_SIZE
+
+
+def test_reads_are_not_blocked_by_open_write(app_client):
+    with engine.connect() as writer, engine.connect() as reader:
+        writer.exec_driver_sql("BEGIN IMMEDIATE")
+        writer.execute(text("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = -1"))
+        # WAL 模式下写事务未提交时仍然可以读取
+        assert reader.execute(text("SELECT COUNT(*) FROM users")).scalar() >= 1
+        writer.exec_driver_sql("ROLLBACK")
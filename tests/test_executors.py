@@ -0,0 +1,44 @@
+"""
+阻塞的数据库操作不在事件循环中执行
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from app.database import engine
+from tests.conftest import browse, upload
+
+
+@pytest.fixture
+def loop_queries():
+    """记录在事件循环线程中执行的 SQL"""
+    statements = []
+    
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        statements.append(statement)
+    
+    event.listen(engine, "before_cursor_execute", before_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_execute)
+
+
+def test_download_does_not_query_on_event_loop(client, loop_queries):
+    upload(client, "/", {"a.bin": b"0123456789" * 100})
+    file_id = browse(client)["a.bin"]["id"]
+    loop_queries.clear()
+    
+    assert client.get(f"/files/download/{file_id}").status_code == 200
+    assert client.get(f"/files/download/{file_id}", headers={"Range": "bytes=10-19"}).content == b"0123456789"
+    assert loop_queries == []
+
+
+def test_chunk_init_does_not_query_on_event_loop(client, loop_queries):
+    init = client.post("/files/chunk/init", json={"filename": "a.bin", "file_size": 10}).json()
+    assert init["success"] and init["max_concurrency"] >= 1
+    assert loop_queries == []
@@ -0,0 +1,193 @@
+"""
+重命名、移动、子树查询和永久删除
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.blob import Blob
+from app.models.file import FileNode
+from app.models.share import ShareLink
+from app.services.file_service import FileService
+from tests.conftest import create_user, wait_until
+
+
+def _build(service: FileService, user, paths):
+    """按路径创建文件（以 / 结尾的为目录）"""
+    for path in paths:
+        if path.endswith('/'):
+            service.ensure_directory_exists(path.rstrip('/'), user)
+        else:
+            service.save_uploaded_file(path, path.encode(), user)
+
+
+def _paths(db, user) -> dict:
+    """用户的所有节点：{full_path: (path, 父目录路径)}"""
+    db.expire_all()
+    nodes = db.query(FileNode).filter(FileNode.owner_id == user.id).all()
+    by_id = {node.id: node for node in nodes}
+    return {
+        node.full_path: (node.path, by_id[node.parent_id].full_path if node.parent_id else None)
+        for node in nodes
+    }
+
+
+def test_rename_directory_rewrites_subtree(db, user):
+    service = FileService(db)
+    _build(service, user, ["/docs/a.txt", "/docs/sub/b.txt", "/docs2/c.txt", "/docs.txt"])
+    
+    service.rename_node(service.get_node_by_path("/docs", user), "papers")
+    
+    paths = _paths(db, user)
+    assert set(paths) == {
+        "/papers", "/papers/a.txt", "/papers/sub", "/papers/sub/b.txt",
+        "/docs2", "/docs2/c.txt", "/docs.txt",
+    }
+    assert paths["/papers/sub/b.txt"] == ("/papers/sub/b.txt", "/papers/sub")
+    assert service.get_node_by_path("/papers/sub/b.txt", user).file_size == len(b"/docs/sub/b.txt")
+
+
+def test_rename_to_existing_name_fails(db, user):
+    service = FileService(db)
+    _build(service, user, ["/a/x.txt", "/b/"])
+    
+    with pytest.raises(ValueError, match="已存在"):
+        service.rename_node(service.get_node_by_path("/a", user), "b")
+    assert "/a/x.txt" in _paths(db, user)
+
+
+def test_rename_file_updates_extension(db, user):
+    service = FileService(db)
+    _build(service, user, ["/note.txt"])
+    
+    service.rename_node(service.get_node_by_path("/note.txt", user), "note.MD")
+    assert service.get_node_by_path("/note.MD", user).file_extension == ".md"
+
+
+def test_move_files_and_directories(client, db, user):
+    service = FileService(db)
+    _build(service, user, ["/src/a.txt", "/src/dir/b.txt", "/src/dir/deep/c.txt", "/dst/"])
+    ids = [service.get_node_by_path(path, user).id for path in ("/src/a.txt", "/src/dir", "/src/dir/b.txt")]
+    
+    # 已选目录下的项目随目录一起移动，不单独计数
+    result = client.post("/files/move", json={"node_ids": ids, "target_path": "/dst"}).json()
+    assert result["success"], result
+    assert result["moved_count"] == 2
+    
+    paths = _paths(db, user)
+    assert set(paths) == {
+        "/src", "/dst", "/dst/a.txt", "/dst/dir", "/dst/dir/b.txt", "/dst/dir/deep", "/dst/dir/deep/c.txt",
+    }
+    assert paths["/dst/a.txt"] == ("/dst/a.txt", "/dst")
+    assert paths["/dst/dir"][1] == "/dst"
+    assert paths["/dst/dir/deep/c.txt"][1] == "/dst/dir/deep"
+
+
+def test_move_into_own_subdirectory_fails(db, user):
+    service = FileService(db)
+    _build(service, user, ["/a/b/"])
+    
+    with pytest.raises(ValueError, match="自身或其子目录"):
+        service.move_nodes([service.get_node_by_path("/a", user).id], "/a/b", user)
+
+
+def test_move_conflict_changes_nothing(db, user):
+    service = FileService(db)
+    _build(service, user, ["/x.txt", "/y.txt", "/dst/y.txt"])
+    before = _paths(db, user)
+    ids = [service.get_node_by_path(path, user).id for path in ("/x.txt", "/y.txt")]
+    
+    with pytest.raises(ValueError, match="已存在"):
+        service.move_nodes(ids, "/dst", user)
+    assert _paths(db, user) == before
+
+
+def test_move_rejects_other_users_nodes(db, user):
+    service = FileService(db)
+    other = create_user()
+    _build(service, other, ["/theirs.txt"])
+    
+    with pytest.raises(ValueError, match="不存在"):
+        service.move_nodes([service.get_node_by_path("/theirs.txt", other).id], "/", user)
+
+
+def test_subtree_is_one_recursive_query(db, user):
+    service = FileService(db)
+    _build(service, user, ["/root/a.txt", "/root/sub/b.txt", "/root/sub/deep/c.txt", "/root/gone/d.txt", "/other.txt"])
+    service.move_to_trash(service.get_node_by_path("/root/gone", user))
+    root = service.get_node_by_path("/root", user)
+    
+    rows = service.get_subtree(root)
+    # 父目录在前，已删除目录及其内容被排除
+    assert [row.full_path for row in rows] == [
+        "/root/a.txt", "/root/sub", "/root/sub/b.txt", "/root/sub/deep", "/root/sub/deep/c.txt",
+    ]
+    file_row = rows[0]
+    assert file_row.node_type == "file" and file_row.file_size == len(b"/root/a.txt")
+    assert file_row.storage_key and file_row.backend
+    assert rows[1].storage_key is None
+    
+    with_deleted = {row.full_path for row in service.get_subtree(root, include_deleted=True)}
+    assert {"/root/gone", "/root/gone/d.txt"} <= with_deleted
+
+
+def test_subtree_of_empty_directory(db, user):
+    service = FileService(db)
+    _build(service, user, ["/empty/"])
+    assert service.get_subtree(service.get_node_by_path("/empty", user)) == []
+
+
+def test_purge_trash_removes_subtrees_and_shares(db, user):
+    service = FileService(db)
+    content = b"purge me"
+    _build(service, user, ["/trash-dir/sub/a.txt", "/trash-dir/b.txt", "/keep.txt"])
+    service.save_uploaded_file("/unique.bin", content, user)
+    nested = service.get_node_by_path("/trash-dir/b.txt", user)
+    unique = service.get_node_by_path("/unique.bin", user)
+    blob_path = db.get(Blob, unique.blob_id).physical_path
+    db.add(ShareLink(share_id="purge-test", file_node_id=nested.id, creator_id=user.id))
+    db.commit()
+    
+    # 已删除目录中再被单独删除的项目只处理一次
+    service.move_to_trash(nested)
+    service.move_to_trash(service.get_node_by_path("/trash-dir", user))
+    service.move_to_trash(unique)
+    progress = []
+    
+    assert service.purge_trash(user=user, progress=lambda done, total: progress.append((done, total))) == 3
+    assert set(_paths(db, user)) == {"/keep.txt"}
+    assert progress[-1] == (5, 5)
+    assert db.query(ShareLink).filter(ShareLink.share_id == "purge-test").first() is None
+    assert wait_until(lambda: not os.path.exists(blob_path))
+
+
+def test_purge_trash_respects_cutoff_and_owner(db, user):
+    service = FileService(db)
+    other = create_user()
+    _build(service, user, ["/old.txt", "/new.txt"])
+    _build(service, other, ["/theirs.txt"])
+    for owner, path in ((user, "/old.txt"), (user, "/new.txt"), (other, "/theirs.txt")):
+        service.move_to_trash(service.get_node_by_path(path, owner))
+    old = service.get_node_by_path("/old.txt", user, include_deleted=True)
+    old.deleted_at = datetime.utcnow() - timedelta(days=60)
+    db.commit()
+    
+    assert service.purge_trash(user=user, deleted_before=datetime.utcnow() - timedelta(days=30)) == 1
+    assert set(_paths(db, user)) == {"/new.txt"}
+    assert set(_paths(db, other)) == {"/theirs.txt"}
+
+
+def test_users_have_separate_path_namespaces(db, user):
+    service = FileService(db)
+    other = create_user()
+    _build(service, user, ["/shared/a.txt"])
+    _build(service, other, ["/shared/a.txt"])
+    
+    with pytest.raises(ValueError, match="已存在"):
+        service.save_uploaded_file("/shared/a.txt", b"again", user)
+    
+    service.rename_node(service.get_node_by_path("/shared", user), "mine")
+    assert set(_paths(db, user)) == {"/mine", "/mine/a.txt"}
+    assert set(_paths(db, other)) == {"/shared", "/shared/a.txt"}
@@ -0,0 +1,42 @@
+"""
+浏览器端 BLAKE2b 实现（static/js/hash-worker.js）与服务器 hashlib 的结果一致
+"""
+
+import hashlib
+import json
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+WORKER = Path(__file__).parent.parent / "static" / "js" / "hash-worker.js"
+
+NODE_SCRIPT = """
+const fs = require('fs'), vm = require('vm');
+const context = { self: {} };
+vm.runInNewContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+const cases = JSON.parse(fs.readFileSync(0, 'utf8'));
+console.log(JSON.stringify(cases.map(([prefix, hex, split]) => {
+    const data = Buffer.from(hex, 'hex');
+    const hasher = context.createBlake2b();
+    if (prefix) hasher.update(context.hexToBytes(prefix));
+    hasher.update(data.subarray(0, split));
+    hasher.update(data.subarray(split));
+    return hasher.hexdigest();
+})));
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="需要 node")
+def test_worker_blake2b_matches_hashlib():
+    cases = []
+    for size in (0, 1, 127, 128, 129, 256, 1000, 70000):
+        data = bytes((i * 31 + 7) & 0xff for i in range(size))
+        cases.append(("", data.hex(), size // 3))
+    cases.append(("00ff" * 8, b"proof".hex(), 2))
+    
+    result = subprocess.run(["node", "-e", NODE_SCRIPT, str(WORKER)], input=json.dumps(cases),
+                            capture_output=True, text=True, check=True, timeout=60)
+    expected = [hashlib.blake2b(bytes.fromhex(prefix + hex_data)).hexdigest() for prefix, hex_data, _ in cases]
+    assert json.loads(result.stdout) == expected
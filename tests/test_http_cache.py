@@ -0,0 +1,131 @@
+"""
+ETag、条件请求和 Cache-Control
+"""
+
+import os
+
+from fastapi.testclient import TestClient
+
+import main
+from app.config import (
+    CACHE_CONTROL_FILES, CACHE_CONTROL_PAGES, CACHE_CONTROL_SHARES, CACHE_CONTROL_STATIC,
+    CACHE_CONTROL_STATIC_VERSIONED
+)
+from app.utils import media_stream
+from app.utils.media_stream import encoded_etag
+from tests.conftest import browse, upload
+
+CONTENT = os.urandom(1000)
+
+
+def _upload(client, name: str = "a.bin", content: bytes = CONTENT) -> int:
+    upload(client, "/", {name: content})
+    return browse(client)[name]["id"]
+
+
+def test_download_validators(client):
+    node_id = _upload(client)
+    response = client.get(f"/files/download/{node_id}")
+    etag = response.headers["etag"]
+    # 强校验值，带引号
+    assert etag.startswith('"') and etag.endswith('"')
+    assert response.headers["cache-control"] == CACHE_CONTROL_FILES
+    assert "last-modified" in response.headers
+    
+    # If-None-Match 按弱比较，可以是列表或 *
+    for value in (f"W/{etag}", f'"other", {etag}', "*"):
+        response = client.get(f"/files/download/{node_id}", headers={"If-None-Match": value})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+    
+    # If-None-Match 存在时忽略 If-Modified-Since
+    response = client.get(f"/files/download/{node_id}", headers={
+        "If-None-Match": '"other"', "If-Modified-Since": response.headers["last-modified"],
+    })
+    assert response.status_code == 200
+
+
+def test_etag_follows_content(client):
+    upload(client, "/", {"a.bin": CONTENT, "b.bin": CONTENT, "c.bin": CONTENT[::-1]})
+    items = browse(client)
+    etags = {name: client.get(f"/files/download/{items[name]['id']}").headers["etag"] for name in items}
+    # 内容相同的文件共用同一个数据块，校验值相同
+    assert etags["a.bin"] == etags["b.bin"] != etags["c.bin"]
+    response = client.get(f"/files/download/{items['c.bin']['id']}", headers={"If-None-Match": etags["a.bin"]})
+    assert response.status_code == 200
+
+
+def test_revalidation_does_not_read_content(client, monkeypatch):
+    node_id = _upload(client)
+    etag = client.get(f"/files/download/{node_id}").headers["etag"]
+    accesses = []
+    monkeypatch.setattr(media_stream, "record_access", accesses.append)
+    
+    assert client.get(f"/files/download/{node_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert accesses == []
+    assert client.get(f"/files/download/{node_id}").status_code == 200
+    assert len(accesses) == 1
+
+
+def test_gzip_representation_has_its_own_etag(client):
+    content = b"".join(b"line %d of a compressible log file\n" % i for i in range(20_000))
+    node_id = _upload(client, "big.log", content)
+    identity = client.get(f"/files/download/{node_id}", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get(f"/files/download/{node_id}", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    
+    assert gzipped.headers["etag"] == encoded_etag(identity.headers["etag"])
+    response = client.get(f"/files/download/{node_id}", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["etag"],
+    })
+    assert response.status_code == 304
+    # 压缩表示的校验值不能用于范围请求的 If-Range
+    response = client.get(f"/files/download/{node_id}", headers={
+        "Range": "bytes=0-9", "If-Range": gzipped.headers["etag"],
+    })
+    assert response.status_code == 200
+
+
+def test_static_files(app_client):
+    response = app_client.get("/static/js/app.js")
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    assert response.headers["cache-control"] == CACHE_CONTROL_STATIC
+    
+    response = app_client.get("/static/js/app.js", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["cache-control"] == CACHE_CONTROL_STATIC
+    
+    # 带版本参数的地址内容不会变化，可以长期缓存
+    response = app_client.get("/static/js/app.js", params={"v": "1"})
+    assert response.headers["cache-control"] == CACHE_CONTROL_STATIC_VERSIONED
+
+
+def test_pages(app_client):
+    for path in ("/", "/trash", "/some/folder", "/auth/login"):
+        response = app_client.get(path)
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == CACHE_CONTROL_PAGES
+        etag = response.headers["etag"]
+        response = app_client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+
+def test_shared_download_cache_control(client):
+    public_id = _upload(client, "public.bin")
+    private_id = _upload(client, "private.bin")
+    public_share = client.post("/share/create", json={"file_node_id": public_id}).json()["share_id"]
+    private_share = client.post("/share/create", json={
+        "file_node_id": private_id, "password": "secret",
+    }).json()["share_id"]
+    anonymous = TestClient(main.app)
+    
+    response = anonymous.get(f"/share/{public_share}/download")
+    assert response.headers["cache-control"] == CACHE_CONTROL_SHARES
+    # 有密码的分享不能存入共享缓存
+    assert anonymous.get(f"/share/{private_share}/download").status_code in (401, 403)
+    response = anonymous.get(f"/share/{private_share}/download", params={"password": "secret"})
+    assert response.status_code == 200 and response.content == CONTENT
+    assert response.headers["cache-control"] == CACHE_CONTROL_FILES
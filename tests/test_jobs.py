@@ -0,0 +1,83 @@
+"""
+后台任务
+"""
+
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.job import Job
+from app.services.job_service import JobService
+from tests.conftest import browse, create_user, login, mkdir, upload, wait_until
+
+
+def _wait_for_job(client, job_id: str) -> dict:
+    jobs = []
+    
+    def finished():
+        jobs.append(client.get(f"/jobs/{job_id}").json()["job"])
+        return jobs[-1]["status"] in ("succeeded", "failed")
+    
+    assert wait_until(finished)
+    return jobs[-1]
+
+
+def test_archive_job_produces_zip(client):
+    mkdir(client, "/album")
+    upload(client, "/album", {"a.txt": b"alpha", "b.txt": b"beta"})
+    folder = browse(client)["album"]
+    
+    started = client.post("/files/archive", json={"file_ids": [folder["id"]]}).json()
+    assert started["success"], started
+    job = _wait_for_job(client, started["job_id"])
+    assert job["status"] == "succeeded", job
+    assert job["result"]["filename"] == "album.zip"
+    assert job["progress"]["percent"] == 100.0
+    
+    response = client.get(job["download_url"])
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.read("album/a.txt") == b"alpha"
+        assert archive.read("album/b.txt") == b"beta"
+
+
+def test_job_is_private_to_its_owner(app_client, client):
+    upload(client, "/", {"a.txt": b"alpha"})
+    started = client.post("/files/archive", json={"file_ids": [browse(client)["a.txt"]["id"]]}).json()
+    _wait_for_job(client, started["job_id"])
+    
+    stranger = login(app_client, create_user())
+    assert stranger.get(f"/jobs/{started['job_id']}").status_code == 404
+    assert stranger.get(f"/jobs/{started['job_id']}/download").status_code == 404
+
+
+def test_empty_trash_runs_as_job(client):
+    upload(client, "/", {"a.txt": b"alpha", "b.txt": b"beta"})
+    for item in browse(client).values():
+        assert client.delete(f"/files/delete/{item['id']}").json()["success"]
+    
+    started = client.post("/trash/empty").json()
+    job = _wait_for_job(client, started["job_id"])
+    assert job["status"] == "succeeded", job
+    assert job["result"] == {"deleted_count": 2}
+
+
+def test_unknown_job_type_is_rejected(db, user):
+    with pytest.raises(ValueError, match="未知的任务类型"):
+        JobService(db).create_job(user, "no_such_job")
+
+
+def test_expired_jobs_are_removed_with_results(db, user, tmp_path):
+    result_path = tmp_path / "result.zip"
+    result_path.write_bytes(b"zip")
+    job = Job(id="expired-job", user_id=user.id, job_type="zip_archive", status="succeeded",
+              result_path=str(result_path), finished_at=datetime.utcnow() - timedelta(days=30))
+    db.add(job)
+    db.commit()
+    
+    assert JobService(db).cleanup_expired_jobs() >= 1
+    assert db.get(Job, "expired-job") is None
+    assert not os.path.exists(result_path)
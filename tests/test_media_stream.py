@@ -0,0 +1,183 @@
+"""
+文件内容的范围请求、条件请求和分享下载计数
+"""
+
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.models.share import ShareLink
+from app.utils import media_stream
+from app.utils.media_stream import FileRangeResponse, RangeNotSatisfiable, parse_range_header
+from tests.conftest import browse, upload
+
+CONTENT = os.urandom(1000)
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=900-", [(900, 999)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=990-5000", [(990, 999)]),
+    ("bytes=0-9, 20-29", [(0, 9), (20, 29)]),
+    # 重叠和相邻的范围合并，按起始位置排序
+    ("bytes=50-99,0-49,200-210,205-300", [(0, 99), (200, 300)]),
+    ("bytes=5-,0-4", [(0, 999)]),
+    ("bytes=0-0,2000-", [(0, 0)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-9", "bytes=", "bytes=a-b", "bytes=9-0", "bytes=5", "bytes=--5",
+    "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(17)),
+])
+def test_unrecognized_ranges_fall_back_to_full_content(header):
+    assert parse_range_header(header, 1000) is None
+
+
+def test_empty_content_ignores_range():
+    assert parse_range_header("bytes=0-10", 0) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0", "bytes=5000-6000,1000-"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 1000)
+
+
+@pytest.fixture
+def media(client):
+    upload(client, "/", {"media.bin": CONTENT})
+    return browse(client)["media.bin"]["id"]
+
+
+def test_single_range(client, media):
+    response = client.get(f"/files/download/{media}", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 990-999/1000"
+    assert response.headers["content-length"] == "10"
+    assert response.content == CONTENT[-10:]
+
+
+def test_multiple_ranges_use_multipart_byteranges(client, media):
+    response = client.get(f"/files/download/{media}", headers={"Range": "bytes=0-9,500-509"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1].encode()
+    assert int(response.headers["content-length"]) == len(response.content)
+    
+    parts = [part for part in response.content.split(b"--" + boundary) if part.strip() not in (b"", b"--")]
+    assert len(parts) == 2
+    for part, (start, end) in zip(parts, [(0, 9), (500, 509)]):
+        head, body = part.split(b"\r\n\r\n", 1)
+        assert f"Content-Range: bytes {start}-{end}/1000".encode() in head
+        # 每个部分的数据之后是下一个分隔行前的换行
+        assert body == CONTENT[start:end + 1] + b"\r\n"
+
+
+def test_unsatisfiable_range_returns_416(client, media):
+    response = client.get(f"/files/download/{media}", headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1000"
+
+
+def test_conditional_requests(client, media):
+    response = client.get(f"/files/download/{media}")
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+    
+    assert client.get(f"/files/download/{media}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/files/download/{media}", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(f"/files/download/{media}", headers={"If-None-Match": '"other"'}).status_code == 200
+    
+    # If-Range 与当前内容一致时按范围响应，不一致时返回完整内容
+    response = client.get(f"/files/download/{media}", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    response = client.get(f"/files/download/{media}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.content == CONTENT
+
+
+def test_media_token_only_previews_its_file(app_client, client):
+    upload(client, "/", {"clip.mp4": CONTENT, "other.mp4": CONTENT[::-1]})
+    items = browse(client)
+    url = client.get(f"/files/media-url/{items['clip.mp4']['id']}").json()["url"]
+    token = url.split("token=")[1]
+    
+    anonymous = TestClient(main.app)
+    response = anonymous.get(url, headers={"Range": "bytes=0-99"})
+    assert response.status_code == 206 and response.content == CONTENT[:100]
+    assert anonymous.get(f"/files/preview/{items['other.mp4']['id']}", params={"token": token}).status_code == 401
+    # 预览令牌不能用于下载
+    assert anonymous.get(f"/files/download/{items['clip.mp4']['id']}", params={"token": token}).status_code in (401, 403)
+
+
+def test_shared_download_counts_every_response_with_content(client, db, media):
+    share_id = client.post("/share/create", json={"file_node_id": media}).json()["share_id"]
+    anonymous = TestClient(main.app)
+    
+    def downloads(headers: dict) -> int:
+        response = anonymous.get(f"/share/{share_id}/download", headers=headers)
+        assert response.status_code in (200, 206, 304, 416)
+        db.expire_all()
+        return db.query(ShareLink).filter(ShareLink.share_id == share_id).one().current_downloads
+    
+    assert downloads({}) == 1
+    assert downloads({"Range": "bytes=100-"}) == 2
+    assert downloads({"Range": "bytes=500-599,700-"}) == 3
+    assert downloads({"Range": "bytes=abc"}) == 4
+    # 范围无法满足和缓存验证通过时不发送内容，不计数
+    assert downloads({"Range": "bytes=5000-"}) == 4
+    etag = anonymous.get(f"/share/{share_id}/download", headers={"Range": "bytes=900-"}).headers["etag"]
+    assert downloads({"If-None-Match": etag}) == 5
+    assert downloads({"Range": "bytes=100-", "If-Range": '"stale"'}) == 6
+
+
+def test_range_requests_cannot_bypass_download_limit(client, media):
+    share_id = client.post("/share/create", json={"file_node_id": media, "max_downloads": 3}).json()["share_id"]
+    anonymous = TestClient(main.app)
+    
+    # 每次用 bytes=1- 加单独的第一个字节取得完整内容
+    statuses = []
+    for _ in range(3):
+        statuses.append(anonymous.get(f"/share/{share_id}/download", headers={"Range": "bytes=1-"}).status_code)
+        statuses.append(anonymous.get(f"/share/{share_id}/download", headers={"Range": "bytes=0-0"}).status_code)
+    assert statuses == [206, 206, 206, 404, 404, 404]
+
+
+def _send_response(response) -> tuple:
+    """在测试中直接调用 ASGI 接口，返回（响应头消息，各个响应体块）"""
+    messages = []
+    
+    async def receive():
+        await asyncio.Event().wait()
+    
+    async def send(message):
+        messages.append(message)
+    
+    asyncio.run(response({"type": "http", "method": "GET", "headers": []}, receive, send))
+    bodies = [message["body"] for message in messages[1:] if message.get("body")]
+    return messages[0], bodies
+
+
+def test_file_range_response_reads_aligned_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_stream, "DOWNLOAD_READ_SIZE", 1024)
+    path = tmp_path / "data.bin"
+    data = os.urandom(8000)
+    path.write_bytes(data)
+    
+    start, bodies = _send_response(FileRangeResponse(str(path), 1000, 5000, status_code=206))
+    assert start["status"] == 206
+    assert (b"content-length", b"4001") in start["headers"]
+    assert b"".join(bodies) == data[1000:5001]
+    # 第一次读到 1024 的整数倍，之后每次从对齐的位置读取整块
+    assert [len(body) for body in bodies] == [24, 1024, 1024, 1024, 905]
+    
+    _, bodies = _send_response(FileRangeResponse(str(path), 0, len(data) - 1))
+    assert b"".join(bodies) == data
+    assert all(len(body) == 1024 for body in bodies[:-1])
@@ -0,0 +1,224 @@
+"""
+数据库结构迁移
+
+迁移在按旧版结构创建的临时数据库上执行，检查结构变更和已有数据。
+"""
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from app import migrations
+from app.models.user import Base
+from app.migrations import MIGRATIONS, _migration_001_blob_storage, get_applied_versions, run_migrations
+
+# 数据块存储之前的 file_nodes 表
+LEGACY_FILE_NODES = """
+CREATE TABLE file_nodes (
+    id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    path VARCHAR(1000) NOT NULL,
+    full_path VARCHAR(1000) NOT NULL,
+    node_type VARCHAR(10) NOT NULL,
+    file_size BIGINT,
+    mime_type VARCHAR(100),
+    file_extension VARCHAR(10),
+    parent_id INTEGER,
+    is_deleted BOOLEAN,
+    deleted_at DATETIME,
+    created_at DATETIME,
+    updated_at DATETIME,
+    owner_id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (full_path),
+    FOREIGN KEY(parent_id) REFERENCES file_nodes (id)
+)
+"""
+
+LEGACY_BLOBS = """
+CREATE TABLE blobs (
+    id INTEGER NOT NULL PRIMARY KEY,
+    content_hash VARCHAR(128) NOT NULL,
+    size BIGINT NOT NULL,
+    mime_type VARCHAR(100),
+    storage_key VARCHAR(64) NOT NULL UNIQUE,
+    ref_count INTEGER NOT NULL,
+    created_at DATETIME
+)
+"""
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """旧版结构的数据库，已有一个目录和一个文件"""
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as conn:
+        conn.execute(text(LEGACY_FILE_NODES))
+        conn.execute(text(LEGACY_BLOBS))
+        conn.execute(text(
+            "INSERT INTO file_nodes (id, name, path, full_path, node_type, file_size, parent_id, is_deleted, owner_id) "
+            "VALUES (1, 'docs', '/', '/docs', 'directory', 0, NULL, 0, 1), "
+            "(2, 'a.txt', '/docs', '/docs/a.txt', 'file', 5, 1, 0, 1)"
+        ))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def startup_engine(engine):
+    """与启动时相同：create_all 只补充缺失的表，已存在的旧表留给迁移处理"""
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def _columns(conn, table: str) -> set:
+    return {info['name'] for info in inspect(conn).get_columns(table)}
+
+
+def _indexes(conn, table: str) -> dict:
+    return {index['name']: index for index in inspect(conn).get_indexes(table)}
+
+
+def test_001_adds_blob_reference(engine):
+    for _ in range(2):  # 可重复执行
+        with engine.begin() as conn:
+            _migration_001_blob_storage(conn)
+    
+    with engine.connect() as conn:
+        assert "blob_id" in _columns(conn, "file_nodes")
+        assert {"ix_file_nodes_blob_id", "ix_file_nodes_parent_id"} <= set(_indexes(conn, "file_nodes"))
+        # 已有文件保持为旧版按路径存储的文件
+        rows = conn.execute(text("SELECT id, blob_id FROM file_nodes ORDER BY id")).all()
+        assert [tuple(row) for row in rows] == [(1, None), (2, None)]
+
+
+def test_runner_applies_pending_migrations_once(startup_engine):
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(startup_engine) == versions
+    assert run_migrations(startup_engine) == []
+    with startup_engine.connect() as conn:
+        assert get_applied_versions(conn) == set(versions)
+
+
+def test_failed_migration_is_rolled_back(startup_engine, monkeypatch):
+    def broken(conn):
+        conn.execute(text('CREATE TABLE "half_done" (id INTEGER)'))
+        raise RuntimeError("boom")
+    
+    monkeypatch.setattr(migrations, "MIGRATIONS", [MIGRATIONS[0], (99, "broken", broken)])
+    with pytest.raises(RuntimeError):
+        run_migrations(startup_engine)
+    
+    with startup_engine.connect() as conn:
+        # 之前的迁移已提交，失败的迁移连同其结构变更一起回滚
+        assert get_applied_versions(conn) == {1}
+        assert "half_done" not in inspect(conn).get_table_names()
+
+
+def test_002_adds_hot_query_indexes(startup_engine):
+    run_migrations(startup_engine)
+    with startup_engine.connect() as conn:
+        assert "ix_file_nodes_owner_parent" in _indexes(conn, "file_nodes")
+        assert "ix_file_nodes_deleted_at" in _indexes(conn, "file_nodes")
+        assert {"ix_share_links_file_node_id", "ix_share_links_creator_id"} <= set(_indexes(conn, "share_links"))
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM file_nodes "
+            "WHERE owner_id = 1 AND parent_id = 1 AND is_deleted = 0 ORDER BY node_type DESC, name"
+        )).all()
+        detail = " ".join(row[-1] for row in plan)
+        assert "ix_file_nodes_owner_parent" in detail and "TEMP B-TREE" not in detail
+
+
+def test_003_makes_paths_unique_per_user(startup_engine):
+    run_migrations(startup_engine)
+    insert = text(
+        "INSERT INTO file_nodes (name, path, full_path, node_type, is_deleted, owner_id) "
+        "VALUES ('docs', '/docs', '/docs', 'directory', 0, :owner)"
+    )
+    with startup_engine.begin() as conn:
+        rows = conn.execute(text("SELECT id, full_path, parent_id, owner_id FROM file_nodes ORDER BY id")).all()
+        assert [tuple(row) for row in rows] == [(1, "/docs", None, 1), (2, "/docs/a.txt", 1, 1)]
+        # 其他用户可以使用相同的路径
+        conn.execute(insert, {"owner": 2})
+    
+    with pytest.raises(IntegrityError):
+        with startup_engine.begin() as conn:
+            conn.execute(insert, {"owner": 1})
+    
+    with startup_engine.connect() as conn:
+        indexes = _indexes(conn, "file_nodes")
+        assert indexes["uq_file_nodes_owner_full_path"]["unique"]
+        assert "ix_file_nodes_owner_full_path" not in indexes
+        assert {"ix_file_nodes_blob_id", "ix_file_nodes_parent_id", "ix_file_nodes_owner_parent"} <= set(indexes)
+
+
+def test_004_records_storage_backend(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO blobs (id, content_hash, size, storage_key, ref_count) "
+            "VALUES (1, 'abc', 5, '0123456789abcdef0123456789abcdef', 1)"
+        ))
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    
+    with engine.connect() as conn:
+        assert {"storage_backend", "storage_key", "multipart_id"} <= _columns(conn, "upload_sessions")
+        # 已有数据块都在本地存储
+        assert conn.execute(text("SELECT backend FROM blobs")).scalar_one() == "local"
+
+
+def test_005_tracks_blob_access(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO blobs (id, content_hash, size, storage_key, ref_count, created_at) "
+            "VALUES (1, 'abc', 5, '0123456789abcdef0123456789abcdef', 1, '2024-01-02 03:04:05')"
+        ))
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    
+    with engine.connect() as conn:
+        # 已有数据块以创建时间作为最后访问时间
+        assert conn.execute(text("SELECT last_accessed_at FROM blobs")).scalar_one() == "2024-01-02 03:04:05"
+        assert "ix_blobs_backend_last_accessed" in _indexes(conn, "blobs")
+
+
+def test_006_records_blob_encoding(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO blobs (id, content_hash, size, storage_key, ref_count) "
+            "VALUES (1, 'abc', 5, '0123456789abcdef0123456789abcdef', 1)"
+        ))
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    
+    with engine.connect() as conn:
+        # 已有数据块按原样存放
+        row = conn.execute(text("SELECT encoding, encoded_size FROM blobs")).one()
+        assert tuple(row) == (None, None)
+
+
+def test_007_merges_duplicate_blobs(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO blobs (id, content_hash, size, storage_key, ref_count) VALUES "
+            "(1, 'abc', 5, 'key1', 2), (2, 'abc', 5, 'key2', 1), (3, 'abc', 6, 'key3', 1)"
+        ))
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _migration_001_blob_storage(conn)
+        conn.execute(text("UPDATE file_nodes SET blob_id = 2 WHERE id = 2"))
+    run_migrations(engine)
+    
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, ref_count FROM blobs ORDER BY id")).all()
+        assert [tuple(row) for row in rows] == [(1, 3), (3, 1)]
+        assert conn.execute(text("SELECT blob_id FROM file_nodes WHERE id = 2")).scalar_one() == 1
+        indexes = _indexes(conn, "blobs")
+        assert indexes["uq_blobs_content_hash_size"]["unique"]
+        assert "ix_blobs_content_hash" not in indexes
+    
+    with pytest.raises(IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO blobs (content_hash, size, storage_key, ref_count) VALUES ('abc', 6, 'key4', 1)"
+            ))
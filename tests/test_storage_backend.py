@@ -0,0 +1,184 @@
+"""
+数据块存储后端测试
+"""
+
+import io
+import os
+import uuid
+
+import pytest
+
+import migrate_storage
+from app.config import STORAGE_DIR
+from app.database import get_db_context
+from app.models.file import FileNode
+from app.services import storage_backend
+from app.services.storage_backend import (
+    LocalStorageBackend, S3StorageBackend, get_storage_backend, register_storage_backend, shard_path
+)
+from tests.conftest import browse
+
+S3_BUCKET = "netdisk-test"
+# S3 要求除最后一个外的分片不小于 5MB
+S3_PART_SIZE = 5 * 1024 * 1024
+
+
+def _key() -> str:
+    return uuid.uuid4().hex
+
+
+@pytest.fixture
+def storage(tmp_path) -> LocalStorageBackend:
+    return LocalStorageBackend(root=str(tmp_path / "blobs"), fanout_levels=2)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """使用 moto 模拟的 S3 后端，注册为名为 s3 的存储后端"""
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    # 测试结束后恢复原有的后端实例
+    monkeypatch.setattr(storage_backend, "_backends", dict(storage_backend._backends))
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=S3_BUCKET)
+        backend = S3StorageBackend(bucket=S3_BUCKET, prefix="blobs/", client=client)
+        register_storage_backend(backend)
+        yield backend
+
+
+def test_shard_path_fans_out_by_key_prefix():
+    key = "abcdef" + "0" * 26
+    assert shard_path(key, 2) == ["ab", "cd", key]
+    assert shard_path(key, 0) == [key]
+
+
+def test_blobs_are_stored_in_shard_directories(storage):
+    key = _key()
+    storage.put_stream(key, io.BytesIO(b"hello world"))
+    
+    assert storage.path_for(key) == os.path.join(storage.root, key[:2], key[2:4], key)
+    assert os.path.isfile(storage.path_for(key))
+    assert storage.exists(key)
+    assert b"".join(storage.iter_range(key, 6, 10)) == b"world"
+    # 根目录下只有分层子目录，没有遗留的临时文件
+    assert os.listdir(storage.root) == [key[:2]]
+    
+    storage.delete(key)
+    assert not storage.exists(key)
+    storage.delete(key)
+
+
+def test_migrate_flat_layout_moves_flat_blobs(storage):
+    keys = [_key() for _ in range(3)]
+    for key in keys:
+        with open(os.path.join(storage.root, key), "wb") as f:
+            f.write(key.encode())
+    # 上传中的临时文件和其他文件不是数据块
+    for name in (".put-tmp123", "README", "ABCDEF" + "0" * 26):
+        with open(os.path.join(storage.root, name), "wb") as f:
+            f.write(b"x")
+    
+    assert sorted(storage.iter_flat_keys()) == sorted(keys)
+    assert storage.migrate_flat_layout() == 3
+    
+    for key in keys:
+        assert not os.path.exists(os.path.join(storage.root, key))
+        assert storage.read_range(key) == key.encode()
+    for name in (".put-tmp123", "README", "ABCDEF" + "0" * 26):
+        assert os.path.isfile(os.path.join(storage.root, name))
+    # 再次执行没有需要移动的数据块
+    assert storage.migrate_flat_layout() == 0
+
+
+def test_migrate_legacy_files_moves_path_stored_files_into_blobs(db, user):
+    nodes = []
+    for name, content in (("a.txt", b"legacy"), ("b.txt", b"legacy"), ("gone.txt", None)):
+        full_path = f"/{user.username}-legacy/{name}"
+        if content is not None:
+            path = os.path.join(str(STORAGE_DIR), full_path.lstrip("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(content)
+        node = FileNode(name=name, path=full_path, full_path=full_path, node_type="file",
+                        file_size=0, owner_id=user.id)
+        db.add(node)
+        nodes.append(node)
+    db.commit()
+    
+    stats = migrate_storage.migrate_legacy_files(dry_run=False)
+    assert stats["converted"] >= 2 and stats["deduplicated"] >= 1 and stats["missing"] >= 1
+    
+    db.expire_all()
+    a, b, gone = nodes
+    assert a.blob_id is not None and a.blob_id == b.blob_id
+    assert a.blob.ref_count == 2 and a.file_size == 6
+    assert a.blob.storage.read_range(a.blob.storage_key) == b"legacy"
+    assert gone.blob_id is None
+    assert not os.path.exists(os.path.join(str(STORAGE_DIR), f"{user.username}-legacy", "a.txt"))
+
+
+def test_s3_put_ranged_get_and_delete(s3):
+    assert get_storage_backend("s3") is s3
+    key = _key()
+    s3.put_stream(key, io.BytesIO(b"hello world"))
+    
+    listed = s3.client.list_objects_v2(Bucket=S3_BUCKET)["Contents"]
+    assert [item["Key"] for item in listed] == [f"blobs/{key[:2]}/{key[2:4]}/{key}"]
+    assert s3.exists(key) and s3.size(key) == 11
+    assert s3.read_range(key) == b"hello world"
+    assert s3.read_range(key, 6, 10) == b"world"
+    assert s3.read_range(key, 6) == b"world"
+    assert b"".join(s3.iter_range(key, 0, 4, chunk_size=2)) == b"hello"
+    
+    s3.delete(key)
+    assert not s3.exists(key)
+    s3.delete(key)
+
+
+def test_s3_multipart_upload(s3):
+    key = _key()
+    parts = [os.urandom(S3_PART_SIZE), b"tail"]
+    upload_token = s3.create_multipart(key)
+    # 分片可以乱序上传
+    s3.upload_part(key, upload_token, 2, parts[1])
+    s3.upload_part(key, upload_token, 1, parts[0])
+    s3.complete_multipart(key, upload_token, len(parts))
+    assert s3.size(key) == S3_PART_SIZE + 4
+    assert s3.read_range(key, S3_PART_SIZE - 2) == parts[0][-2:] + b"tail"
+    
+    other = _key()
+    upload_token = s3.create_multipart(other)
+    s3.upload_part(other, upload_token, 1, parts[0])
+    with pytest.raises(ValueError):
+        s3.complete_multipart(other, upload_token, 2)
+    s3.abort_multipart(other, upload_token)
+    s3.abort_multipart(other, upload_token)
+    assert not s3.exists(other)
+
+
+def test_chunk_upload_to_s3_over_http(client, s3, monkeypatch):
+    monkeypatch.setattr(storage_backend, "STORAGE_BACKEND", "s3")
+    content = os.urandom(S3_PART_SIZE + 100)
+    init = client.post("/files/chunk/init", json={"filename": "s3.bin", "file_size": len(content)}).json()
+    assert init["success"], init
+    chunk_size = init["chunk_size"]
+    assert chunk_size >= S3_PART_SIZE
+    
+    for index in range(0, len(content), chunk_size):
+        result = client.post("/files/chunk/upload",
+                             data={"upload_id": init["upload_id"], "chunk_index": str(index // chunk_size)},
+                             files={"chunk_file": ("chunk", content[index:index + chunk_size])}).json()
+        assert result["received"], result
+    result = client.post("/files/chunk/complete", json={"upload_id": init["upload_id"]}).json()
+    assert result["success"], result
+    
+    item = browse(client)["s3.bin"]
+    with get_db_context() as db:
+        blob = db.get(FileNode, item["id"]).blob
+        assert blob.backend == "s3" and s3.exists(blob.storage_key)
+    assert client.get(f"/files/download/{item['id']}").content == content
+    response = client.get(f"/files/download/{item['id']}", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206 and response.content == content[-10:]
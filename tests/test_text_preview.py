@@ -0,0 +1,111 @@
+"""
+按窗口读取的文本预览
+"""
+
+import codecs
+
+import pytest
+
+from app.models.file import FileNode
+from app.utils import text_preview
+from app.utils.text_preview import detect_encoding, read_text_lines
+from tests.conftest import browse, upload
+
+
+def _preview(client, content: bytes, name: str = "a.txt", **params):
+    upload(client, "/", {name: content})
+    node_id = browse(client)[name]["id"]
+    response = client.get(f"/files/preview/{node_id}", params=params)
+    return node_id, response
+
+
+def test_detect_encoding():
+    assert detect_encoding(codecs.BOM_UTF8 + b"abc") == ("utf-8", 3)
+    assert detect_encoding(codecs.BOM_UTF16_LE + "文".encode("utf-16-le")) == ("utf-16-le", 2)
+    # 样本末尾截断在多字节字符中间仍按 UTF-8 识别
+    assert detect_encoding("中文".encode("utf-8")[:-1]) == ("utf-8", 0)
+    assert detect_encoding("中文内容".encode("gbk")) == ("gbk", 0)
+    assert detect_encoding(b"caf\xe9 \xff\xff") == ("latin-1", 0)
+
+
+def test_byte_windows_split_on_character_boundaries(client):
+    text = "".join(f"第{i}行：汉字和ASCII混排\n" for i in range(200))
+    node_id, response = _preview(client, text.encode("utf-8"), limit=16)
+    assert response.status_code == 200
+    
+    # 按 next_offset 依次读取各个窗口，拼接后与原文相同
+    parts = []
+    window = response.json()
+    while True:
+        assert window["encoding"] == "utf-8"
+        parts.append(window["content"])
+        if not window["has_more"]:
+            break
+        window = client.get(f"/files/preview/{node_id}",
+                            params={"offset": window["next_offset"], "limit": 16}).json()
+    assert "".join(parts) == text
+    
+    # 从字符中间开始时跳过不完整的字符
+    window = client.get(f"/files/preview/{node_id}", params={"offset": 1, "limit": 16}).json()
+    assert window["content"] == text.encode("utf-8")[3:window["next_offset"]].decode("utf-8")
+
+
+def test_gbk_and_bom_files(client):
+    _, response = _preview(client, "中文内容".encode("gbk") * 10, name="gbk.txt")
+    assert response.json()["encoding"] == "gbk"
+    assert response.json()["content"] == "中文内容" * 10
+    
+    _, response = _preview(client, codecs.BOM_UTF8 + "带BOM".encode("utf-8"), name="bom.txt")
+    assert response.json()["content"] == "带BOM"
+    assert response.json()["offset"] == 3
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_line_windows_use_sparse_index(client, monkeypatch, trailing_newline):
+    monkeypatch.setattr(text_preview, "PREVIEW_LINE_INDEX_STRIDE", 7)
+    lines = [f"line {i} " + "x" * (i % 13) for i in range(140)]
+    content = "\n".join(lines) + ("\n" if trailing_newline else "")
+    node_id, response = _preview(client, content.encode(), line=0, lines=3)
+    window = response.json()
+    assert window["content"] == "line 0 \nline 1 x\nline 2 xx\n"
+    assert window["total_lines"] == 140 and window["next_line"] == 3
+    
+    for start, count in ((6, 2), (7, 1), (13, 9), (134, 10), (139, 1)):
+        window = client.get(f"/files/preview/{node_id}", params={"line": start, "lines": count}).json()
+        expected = lines[start:start + count]
+        assert window["content"].split("\n")[:len(expected)] == expected
+        assert window["start_line"] == start
+        assert window["has_more"] == (start + count < 140)
+    
+    window = client.get(f"/files/preview/{node_id}", params={"line": 500}).json()
+    assert window["content"] == "" and not window["has_more"]
+
+
+def test_long_line_is_truncated(client, db, monkeypatch):
+    monkeypatch.setattr(text_preview, "PREVIEW_TEXT_MAX_SIZE", 100)
+    upload(client, "/", {"long.txt": b"short\n" + b"y" * 500 + b"\nend\n"})
+    node = db.get(FileNode, browse(client)["long.txt"]["id"])
+    
+    # 预算内在最后一个完整的行处截断
+    window = read_text_lines(node, 0, 3)
+    assert window["content"] == "short\n" and window["next_line"] == 1 and not window["truncated"]
+    # 单独一行超出预算时只返回开头部分
+    window = read_text_lines(node, 1, 1)
+    assert window["content"] == "y" * 100 and window["truncated"]
+
+
+def test_utf16_files_only_support_byte_windows(client):
+    content = codecs.BOM_UTF16_LE + "一行\n二行\n".encode("utf-16-le")
+    node_id, response = _preview(client, content, name="wide.txt")
+    assert response.json()["content"] == "一行\n二行\n"
+    assert client.get(f"/files/preview/{node_id}", params={"line": 0}).status_code == 400
+
+
+def test_windows_have_distinct_etags(client):
+    node_id, response = _preview(client, b"hello\nworld\n", limit=16)
+    etag = response.headers["etag"]
+    other = client.get(f"/files/preview/{node_id}", params={"line": 0})
+    assert other.headers["etag"] != etag
+    
+    response = client.get(f"/files/preview/{node_id}", params={"limit": 16}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
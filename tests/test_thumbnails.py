@@ -0,0 +1,145 @@
+"""
+图片缩略图
+"""
+
+import io
+import os
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.middleware.rate_limit import RateLimitMiddleware
+from app.services import thumbnail_service
+from app.services.thumbnail_service import cache_path, get_thumbnail
+from app.utils.path_remover import wait_for_removals
+from tests.conftest import browse, upload
+
+Image = pytest.importorskip("PIL.Image")
+
+# 测试配置中关闭了速率限制，这里保留原来的实现
+_is_rate_limited = RateLimitMiddleware.is_rate_limited
+
+
+def _image(width: int, height: int, fmt: str = "PNG", orientation: int = None) -> bytes:
+    image = Image.new("RGB", (width, height), (200, 30, 30))
+    output = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(output, fmt, exif=exif)
+    else:
+        image.save(output, fmt)
+    return output.getvalue()
+
+
+def _thumbnail_size(content: bytes):
+    with Image.open(io.BytesIO(content)) as image:
+        assert image.format == "WEBP"
+        return image.size
+
+
+def test_thumbnail_is_rendered_and_revalidated(client):
+    upload(client, "/", {"photo.png": _image(400, 200)})
+    item = browse(client)["photo.png"]
+    assert item["has_thumbnail"]
+    
+    # 请求的尺寸向上取到 128 一档
+    response = client.get(f"/files/thumbnail/{item['id']}", params={"size": 100})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert _thumbnail_size(response.content) == (128, 64)
+    
+    response = client.get(f"/files/thumbnail/{item['id']}", params={"size": 100},
+                          headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+
+def test_exif_orientation_is_applied(client):
+    # 方向 6 表示拍摄时顺时针旋转了 90 度
+    upload(client, "/", {"rotated.jpg": _image(400, 200, "JPEG", orientation=6)})
+    item = browse(client)["rotated.jpg"]
+    response = client.get(f"/files/thumbnail/{item['id']}", params={"size": 256})
+    assert _thumbnail_size(response.content) == (128, 256)
+
+
+def test_non_image_has_no_thumbnail(client):
+    upload(client, "/", {"notes.txt": b"hello"})
+    item = browse(client)["notes.txt"]
+    assert not item["has_thumbnail"]
+    assert client.get(f"/files/thumbnail/{item['id']}").status_code == 404
+
+
+def test_rename_removes_cached_thumbnails(client):
+    upload(client, "/", {"a.png": _image(50, 50)})
+    item = browse(client)["a.png"]
+    assert client.get(f"/files/thumbnail/{item['id']}", params={"size": 64}).status_code == 200
+    directory = os.path.dirname(cache_path(item["id"], "v", 64))
+    cached = lambda: [name for name in os.listdir(directory) if name.startswith(f"{item['id']}-")]
+    assert cached()
+    
+    assert client.put(f"/files/rename/{item['id']}", json={"new_name": "b.png"}).json()["success"]
+    wait_for_removals()
+    assert cached() == []
+
+
+def test_concurrent_requests_render_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_service, "THUMBNAIL_DIR", tmp_path)
+    source = tmp_path / "source.png"
+    source.write_bytes(_image(300, 300))
+    renders = []
+    render = thumbnail_service._render
+    
+    def slow_render(source, size):
+        renders.append(size)
+        time.sleep(0.2)
+        return render(source, size)
+    
+    monkeypatch.setattr(thumbnail_service, "_render", slow_render)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(get_thumbnail(1, "v1", 64, lambda: str(source))))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert renders == [64]
+    assert len(set(results)) == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_service, "THUMBNAIL_DIR", tmp_path)
+    monkeypatch.setattr(thumbnail_service, "_cache_bytes", None)
+    source = tmp_path / "source.png"
+    source.write_bytes(_image(300, 300))
+    size = len(get_thumbnail(1, "v1", 64, lambda: str(source)))
+    # 容量只够两张缩略图
+    monkeypatch.setattr(thumbnail_service, "THUMBNAIL_CACHE_MAX_BYTES", size * 2 + size // 2)
+    os.utime(cache_path(1, "v1", 64), (time.time() - 100, time.time() - 100))
+    get_thumbnail(2, "v1", 64, lambda: str(source))
+    os.utime(cache_path(2, "v1", 64), (time.time() - 50, time.time() - 50))
+    # 命中缓存会更新最后使用时间
+    get_thumbnail(1, "v1", 64, lambda: str(source))
+    get_thumbnail(3, "v1", 64, lambda: str(source))
+    
+    assert os.path.exists(cache_path(1, "v1", 64))
+    assert not os.path.exists(cache_path(2, "v1", 64))
+    assert os.path.exists(cache_path(3, "v1", 64))
+
+
+def test_thumbnails_are_not_rate_limited(monkeypatch):
+    monkeypatch.setattr(RateLimitMiddleware, "is_rate_limited", _is_rate_limited)
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, calls=1, period=60)
+    app.get("/files/thumbnail/{node_id}")(lambda node_id: {})
+    app.get("/files/browse")(lambda: {})
+    client = TestClient(app)
+    
+    for _ in range(5):
+        assert client.get("/files/thumbnail/1").status_code == 200
+    assert client.get("/files/browse").status_code == 200
+    assert client.get("/files/browse").status_code == 429
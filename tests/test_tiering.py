@@ -0,0 +1,152 @@
+"""
+冷热分层存储
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import TIER_COLD_AFTER_DAYS, TIER_COLD_BACKEND
+from app.models.blob import Blob, PendingBlobDeletion
+from app.models.file import FileNode
+from app.services import tiering_service
+from app.services.storage_backend import get_storage_backend
+from app.services.tiering_service import TieringService, delete_moved_copies
+from app.utils.path_remover import wait_for_removals
+from tests.conftest import browse, upload, wait_until
+
+
+@pytest.fixture
+def stale_blob(client, db):
+    """已上传且长期未读取的文件，返回（文件节点编号，内容）"""
+    content = os.urandom(200_000)
+    upload(client, "/", {"cold.bin": content})
+    node_id = browse(client)["cold.bin"]["id"]
+    blob = db.get(FileNode, node_id).blob
+    blob.last_accessed_at = datetime.utcnow() - timedelta(days=TIER_COLD_AFTER_DAYS + 1)
+    db.commit()
+    return node_id, content
+
+
+def _backend(db, node_id: int) -> str:
+    db.expire_all()
+    return db.get(FileNode, node_id).blob.backend
+
+
+def test_stale_blob_moves_to_cold_tier_and_back_on_read(client, db, stale_blob, monkeypatch):
+    monkeypatch.setattr(tiering_service, "TIER_DELETE_GRACE_SECONDS", 0)
+    node_id, content = stale_blob
+    blob = db.get(FileNode, node_id).blob
+    hot_path = blob.physical_path
+    
+    assert TieringService(db).demote_cold_blobs() >= 1
+    assert _backend(db, node_id) == TIER_COLD_BACKEND
+    wait_for_removals()
+    assert not os.path.exists(hot_path)
+    assert get_storage_backend(TIER_COLD_BACKEND).exists(blob.storage_key)
+    
+    # 从冷数据层直接读取，同时在后台提升回热数据层；冷数据在这次下载打开之后才删除
+    monkeypatch.setattr(tiering_service, "TIER_DELETE_GRACE_SECONDS", 0.5)
+    assert client.get(f"/files/download/{node_id}").content == content
+    assert wait_until(lambda: _backend(db, node_id) == "local")
+    assert client.get(f"/files/download/{node_id}").content == content
+
+
+def test_recently_read_blob_stays_hot(db, stale_blob):
+    node_id, _ = stale_blob
+    db.query(Blob).filter(Blob.id == db.get(FileNode, node_id).blob_id).update(
+        {"last_accessed_at": datetime.utcnow()}
+    )
+    db.commit()
+    
+    TieringService(db).demote_cold_blobs()
+    assert _backend(db, node_id) == "local"
+
+
+def test_source_outlives_reads_started_before_the_move(db, stale_blob, monkeypatch):
+    monkeypatch.setattr(tiering_service, "TIER_DELETE_GRACE_SECONDS", 0.5)
+    node_id, content = stale_blob
+    service = TieringService(db)
+    service.demote_cold_blobs()
+    blob = db.get(FileNode, node_id).blob
+    storage_key = blob.storage_key
+    
+    # 响应已按冷数据层构造，但还没有开始读取时，数据块被提升回热数据层
+    chunks = blob.storage.iter_range(storage_key)
+    assert service.promote_blob(blob.id)
+    wait_for_removals()
+    assert b"".join(chunks) == content
+    
+    cold = get_storage_backend(TIER_COLD_BACKEND)
+    assert wait_until(lambda: not cold.exists(storage_key))
+    assert _backend(db, node_id) == "local"
+
+
+@pytest.fixture
+def no_timers(monkeypatch):
+    """模拟服务在保留期内重启，内存中的定时器全部丢失"""
+    monkeypatch.setattr(tiering_service, "schedule_call_later", lambda delay, func, *args: None)
+
+
+def _pending(db, blob_id: int):
+    return db.query(PendingBlobDeletion).filter(PendingBlobDeletion.blob_id == blob_id)
+
+
+def _expire_pending(db, blob_id: int) -> list:
+    """让数据块的删除记录到期，返回记录中的后端"""
+    _pending(db, blob_id).update({"delete_after": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    return sorted(item.backend for item in _pending(db, blob_id))
+
+
+def test_pending_deletions_are_processed_after_restart(db, stale_blob, no_timers):
+    node_id, _ = stale_blob
+    blob = db.get(FileNode, node_id).blob
+    hot_path = blob.physical_path
+    TieringService(db).demote_cold_blobs()
+    assert os.path.exists(hot_path)
+    
+    # 保留期未结束时不删除
+    delete_moved_copies()
+    assert os.path.exists(hot_path)
+    assert _expire_pending(db, blob.id) == ["local"]
+    delete_moved_copies()
+    assert not os.path.exists(hot_path)
+    assert _pending(db, blob.id).count() == 0
+
+
+def test_copy_moved_back_within_grace_period_is_kept(client, db, stale_blob, no_timers):
+    node_id, content = stale_blob
+    service = TieringService(db)
+    service.demote_cold_blobs()
+    blob = db.get(FileNode, node_id).blob
+    assert service.promote_blob(blob.id)
+    
+    # 热数据层的删除记录指向的副本又在使用了，只删除冷数据层的副本
+    assert _expire_pending(db, blob.id) == sorted([TIER_COLD_BACKEND, "local"])
+    delete_moved_copies()
+    assert _pending(db, blob.id).count() == 0
+    assert _backend(db, node_id) == "local"
+    assert os.path.exists(blob.physical_path)
+    assert not get_storage_backend(TIER_COLD_BACKEND).exists(blob.storage_key)
+    assert client.get(f"/files/download/{node_id}").content == content
+
+
+def test_pending_deletion_waits_for_move_in_progress(db, stale_blob, no_timers):
+    node_id, _ = stale_blob
+    blob = db.get(FileNode, node_id).blob
+    hot_path = blob.physical_path
+    TieringService(db).demote_cold_blobs()
+    _expire_pending(db, blob.id)
+    
+    assert tiering_service._claim_blob(blob.id)
+    try:
+        delete_moved_copies()
+    finally:
+        tiering_service._release_blob(blob.id)
+    assert os.path.exists(hot_path)
+    assert _pending(db, blob.id).count() == 1
+    
+    delete_moved_copies()
+    assert not os.path.exists(hot_path)
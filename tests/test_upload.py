@@ -0,0 +1,71 @@
+"""
+普通上传的流式保存
+"""
+
+import io
+import os
+
+import pytest
+
+from app.config import BLOB_DIR
+from app.services.file_service import COPY_CHUNK_SIZE, FileService
+from tests.conftest import browse, upload
+
+
+class RecordingStream(io.BytesIO):
+    """记录每次读取请求的大小"""
+    
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.read_sizes = []
+    
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return super().read(size)
+
+
+def _temp_uploads():
+    return [name for name in os.listdir(BLOB_DIR) if name.startswith('.upload-')]
+
+
+def test_uploaded_file_round_trips(client):
+    content = os.urandom(3 * 1024 * 1024 + 5)
+    upload(client, "/", {"data.bin": content})
+    
+    item = browse(client)["data.bin"]
+    assert item["size"] == len(content)
+    assert client.get(f"/files/download/{item['id']}").content == content
+
+
+def test_folder_upload_creates_directories(client):
+    response = client.post(
+        "/files/upload",
+        data={"path": "/", "relative_paths": '["album/2024/a.txt", "album/b.txt"]'},
+        files=[("files", ("a.txt", b"a")), ("files", ("b.txt", b"b"))]
+    )
+    assert response.json()["success"]
+    assert set(browse(client, "/album")) == {"2024", "b.txt"}
+    assert set(browse(client, "/album/2024")) == {"a.txt"}
+
+
+def test_stream_is_copied_in_bounded_chunks(db, user):
+    content = os.urandom(COPY_CHUNK_SIZE * 2 + 100)
+    stream = RecordingStream(content)
+    
+    node = FileService(db).save_uploaded_stream("/stream.bin", stream, user)
+    
+    assert node.file_size == len(content)
+    assert all(0 < size <= COPY_CHUNK_SIZE for size in stream.read_sizes)
+    with open(node.physical_path, 'rb') as f:
+        assert f.read() == content
+
+
+def test_oversized_stream_leaves_nothing_behind(db, user):
+    before = _temp_uploads()
+    service = FileService(db)
+    
+    with pytest.raises(ValueError):
+        service.save_uploaded_stream("/too-big.bin", io.BytesIO(b"x" * 5000), user, max_size=4096)
+    
+    assert _temp_uploads() == before
+    assert service.get_node_by_path("/too-big.bin", user) is None
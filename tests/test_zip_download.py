@@ -0,0 +1,77 @@
+"""
+目录和批量 ZIP 下载
+"""
+
+import io
+import uuid
+import zipfile
+
+from app.services.storage_backend import CompressedLocalStorageBackend
+from app.utils.file_utils import _iter_zip_entries
+from tests.conftest import browse, mkdir, upload
+
+
+def _zip_contents(data: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        return {info.filename: zf.read(info) for info in zf.infolist()}
+
+
+def test_directory_download_streams_zip(client):
+    mkdir(client, "/docs")
+    mkdir(client, "/docs/sub")
+    upload(client, "/docs", {"a.txt": b"alpha"})
+    upload(client, "/docs/sub", {"b.bin": bytes(range(256)) * 100})
+    
+    response = client.get(f"/files/download/{browse(client)['docs']['id']}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    
+    contents = _zip_contents(response.content)
+    assert contents["docs/a.txt"] == b"alpha"
+    assert contents["docs/sub/b.bin"] == bytes(range(256)) * 100
+    assert "docs/sub/" in contents
+
+
+def test_batch_download_contains_selected_items(client):
+    mkdir(client, "/dir")
+    upload(client, "/dir", {"inner.txt": b"inner"})
+    upload(client, "/", {"top.txt": b"top"})
+    items = browse(client)
+    
+    response = client.post("/files/download/batch", json={"file_ids": [items["dir"]["id"], items["top.txt"]["id"]]})
+    assert response.status_code == 200
+    contents = _zip_contents(response.content)
+    assert contents["top.txt"] == b"top"
+    assert contents["dir/inner.txt"] == b"inner"
+
+
+def test_zip_is_produced_incrementally(tmp_path):
+    source = tmp_path / "big.bin"
+    source.write_bytes(b"x" * (3 * 1024 * 1024))
+    
+    chunks = list(_iter_zip_entries([("big.bin", str(source))]))
+    # 文件数据边读边输出，而不是在最后一次性输出
+    assert len(chunks) > 2
+    assert _zip_contents(b"".join(chunks))["big.bin"] == b"x" * (3 * 1024 * 1024)
+
+
+def test_missing_local_file_is_skipped(tmp_path):
+    present = tmp_path / "present.txt"
+    present.write_bytes(b"here")
+    
+    data = b"".join(_iter_zip_entries([("gone.txt", str(tmp_path / "gone.txt")), ("present.txt", str(present))]))
+    assert _zip_contents(data) == {"present.txt": b"here"}
+
+
+def test_blob_without_local_file_uses_zip64_when_large(tmp_path, monkeypatch):
+    # 压缩存储后端不能直接读取本地文件，条目大小由调用方给出
+    storage = CompressedLocalStorageBackend(root=str(tmp_path / "cold"))
+    storage_key = uuid.uuid4().hex
+    content = b"y" * 5000
+    storage.put_stream(storage_key, io.BytesIO(content))
+    # 把 ZIP64 阈值调低，模拟超过 4GB 的文件
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 4096)
+    
+    data = b"".join(_iter_zip_entries([("big.bin", (storage, storage_key, len(content)))]))
+    assert _zip_contents(data) == {"big.bin": content}